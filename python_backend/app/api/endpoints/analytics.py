@@ -0,0 +1,76 @@
+from datetime import date, timedelta
+from typing import List, Optional
+
+from fastapi import APIRouter, Depends, Query
+from fastapi.responses import JSONResponse, Response
+from loguru import logger
+from sqlalchemy import select
+from sqlalchemy.ext.asyncio import AsyncSession
+from starlette.concurrency import run_in_threadpool
+
+from app.core.clock import utc_today
+from app.core.config import settings
+from app.core.database import get_async_db
+from app.core.etag import star_records_version
+from app.core.query_budget import query_budget
+from app.core.responses import model_response
+from app.models import Child
+from app.services.analytics import (
+    analytics_available,
+    analytics_cache,
+    cache_key,
+    compute_star_analytics,
+    load_star_columns,
+)
+
+router = APIRouter()
+
+DEFAULT_DAYS = 90
+
+@router.get("/stars")
+@query_budget(3)
+async def get_star_analytics(
+    child_ids: Optional[List[int]] = Query(None),
+    date_from: Optional[date] = Query(None, alias="from"),
+    date_to: Optional[date] = Query(None, alias="to"),
+    window: int = Query(7, ge=1, le=90),
+    db: AsyncSession = Depends(get_async_db)
+):
+    """Get the heatmap, distributions, moving averages and comparison of a family's stars
+
+    The family is ``child_ids`` (all children by default); ``window`` is the
+    moving average length in days.
+    """
+    if not analytics_available():
+        return JSONResponse(status_code=503, content={"success": False, "message": "Analytics requires NumPy"})
+
+    date_to = date_to or utc_today()
+    date_from = date_from or date_to - timedelta(days=DEFAULT_DAYS - 1)
+    days = (date_to - date_from).days + 1
+    if days < 1 or days > settings.analytics_max_days:
+        return JSONResponse(
+            status_code=400,
+            content={"success": False, "message": f"Date range must be from <= to and at most {settings.analytics_max_days} days"}
+        )
+
+    # Entries are keyed by the version of the family's star records only
+    version = await star_records_version(db, child_ids)
+    key = cache_key(child_ids or ["*"], date_from, date_to, window, version)
+    body = analytics_cache.get(key)
+    if body is not None:
+        return Response(content=body, media_type="application/json")
+
+    if child_ids:
+        found = (await db.execute(select(Child.id).where(Child.id.in_(child_ids)))).scalars().all()
+        if len(found) != len(set(child_ids)):
+            return JSONResponse(status_code=404, content={"success": False, "message": "Child not found"})
+    else:
+        found = (await db.execute(select(Child.id))).scalars().all()
+
+    columns = await load_star_columns(db, found, date_from, date_to)
+    result = await run_in_threadpool(compute_star_analytics, columns, found, date_from, days, window)
+    logger.info(f"Computed star analytics for {len(found)} children over {days} days from {len(columns)} records")
+
+    response = model_response({"success": True, "data": result})
+    analytics_cache.set(key, response.body)
+    return response
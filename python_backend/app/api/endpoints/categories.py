@@ -0,0 +1,55 @@
+from fastapi import APIRouter, Depends, status
+from fastapi.responses import JSONResponse
+from loguru import logger
+from sqlalchemy import select
+from sqlalchemy.exc import IntegrityError
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from app.core.database import get_async_db
+from app.core.query_budget import query_budget
+from app.models import CategoryRule
+from app.schemas import CategoryRuleCreate, CategoryRuleResponse
+from app.services.categories import category_rules
+
+router = APIRouter()
+
+@router.get("/rules")
+@query_budget(1)
+async def get_category_rules(db: AsyncSession = Depends(get_async_db)):
+    """List the keyword rules that categorize star reasons"""
+    result = await db.execute(select(CategoryRule).order_by(CategoryRule.category, CategoryRule.keyword))
+    return {
+        "success": True,
+        "data": [CategoryRuleResponse.model_validate(rule).model_dump() for rule in result.scalars()]
+    }
+
+@router.post("/rules", status_code=status.HTTP_201_CREATED)
+@query_budget(3)
+async def create_category_rule(rule_data: CategoryRuleCreate, db: AsyncSession = Depends(get_async_db)):
+    """Add a keyword rule; it applies to star records created from now on"""
+    rule = CategoryRule(**rule_data.model_dump())
+    db.add(rule)
+    try:
+        await db.commit()
+    except IntegrityError:
+        await db.rollback()
+        return JSONResponse(
+            status_code=409,
+            content={"success": False, "message": f"A rule for '{rule_data.keyword}' already exists"}
+        )
+    category_rules.invalidate()
+    logger.info(f"Created category rule {rule.id}: '{rule.keyword}' -> {rule.category}")
+    return {"success": True, "data": CategoryRuleResponse.model_validate(rule).model_dump()}
+
+@router.delete("/rules/{rule_id}")
+@query_budget(3)
+async def delete_category_rule(rule_id: int, db: AsyncSession = Depends(get_async_db)):
+    """Delete a keyword rule; existing star records keep their category"""
+    rule = await db.get(CategoryRule, rule_id)
+    if not rule:
+        return JSONResponse(status_code=404, content={"success": False, "message": "Category rule not found"})
+    await db.delete(rule)
+    await db.commit()
+    category_rules.invalidate()
+    logger.info(f"Deleted category rule {rule_id}")
+    return {"success": True, "message": "Category rule deleted successfully"}
@@ -1,52 +1,69 @@
-from fastapi import APIRouter, Depends, HTTPException, status, Form, File, UploadFile
-from fastapi.responses import JSONResponse
-from sqlalchemy.orm import Session
+from fastapi import APIRouter, Depends, HTTPException, Query, Request, status, Form, File, UploadFile
+from fastapi.responses import JSONResponse, StreamingResponse
+from sqlalchemy import and_, case, delete, func, or_, select
+from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy.orm import joinedload, selectinload
 from typing import List, Optional, Literal
-from datetime import date, datetime
+from datetime import date, datetime, timedelta
 from loguru import logger
 import os
-import uuid
-from pathlib import Path
 
-from app.core.database import get_db
-from app.models import Child, StarRecord
-from app.schemas import ChildCreate, ChildUpdate, ChildResponse, ChildDetailResponse
-from app.core.config import settings
+from app.core.cache import response_cache
+from app.core.clock import utc_today
+from app.core.database import get_async_db
+from app.core.query_budget import query_budget
+from app.core.etag import child_version, children_version, make_etag, not_modified_response
+from app.models import Child, ReportJob, Reward, StarDailyRollup, StarRecord
+from app.models.reward import reward_children
+from app.core.responses import model_response
+from app.schemas import ChildCreate, ChildUpdate, ChildResponse, ChildDetailResponse, ChildDetailPayload, ChildListResponse, ChildSummary, StarRecordPage, DailyStarStats, DailyStarStatsResponse, CategoryStats, CategoryStatsResponse
+from app.schemas.child import calculate_age
+from app.services.rewards import select_rewards_with_progress
+from app.services.export import EXPORTERS, MEDIA_TYPES as EXPORT_MEDIA_TYPES, export_statement
+from app.services.image_variants import schedule_variants
+from app.services.reports import delete_artifacts
+from app.services.uploads import (
+    UploadError,
+    delete_released_files,
+    discard_upload,
+    release_path,
+    retain_path,
+    retain_upload,
+    save_upload,
+)
 
 router = APIRouter()
 
-def calculate_age(birthday: date) -> int:
-    """Calculate age from birthday"""
-    today = date.today()
-    age = today.year - birthday.year
-    if (today.month, today.day) < (birthday.month, birthday.day):
-        age -= 1
-    return age
+# Default and largest date range of the daily stats endpoint
+DEFAULT_STATS_DAYS = 30
+MAX_STATS_DAYS = 366
 
 @router.get("/")
-async def get_children(db: Session = Depends(get_db)):
+@query_budget(2)
+async def get_children(request: Request, db: AsyncSession = Depends(get_async_db)):
     """Get all children"""
     try:
-        children = db.query(Child).order_by(Child.created_at.desc()).all()
+        # Answer from the change sequences alone when the client is up to date
+        version = await children_version(db)
+        etag = make_etag("children", version)
+        not_modified = not_modified_response(request, etag)
+        if not_modified is not None:
+            return not_modified
         
-        # Format response like PHP backend
-        data = []
-        for child in children:
-            data.append({
-                "id": child.id,
-                "name": child.name,
-                "birthday": child.birthday.strftime("%Y-%m-%d"),
-                "age": calculate_age(child.birthday),
-                "gender": child.gender,
-                "avatar": f"/storage/{child.avatar}" if child.avatar else None,
-                "star_count": child.star_count
-            })
-            
+        cached = response_cache.cached_response(request, version)
+        if cached is not None:
+            cached.headers["ETag"] = etag
+            return cached
+        
+        result = await db.execute(select(Child).order_by(Child.created_at.desc()))
+        children = result.scalars().all()
+        
+        # Validated from the ORM objects and serialized by pydantic-core in
+        # the same format as the PHP backend
         logger.info(f"Retrieved {len(children)} children")
-        return {
-            "success": True,
-            "data": data
-        }
+        response = response_cache.store_response(request, ChildListResponse(data=children), version)
+        response.headers["ETag"] = etag
+        return response
     except Exception as e:
         logger.error(f"Error retrieving children: {e}")
         return {
@@ -54,15 +71,26 @@ async def get_children(db: Session = Depends(get_db)):
             "message": "Error retrieving children"
         }
 
+def latest_star_records(child_id: int, limit: int):
+    """Newest-first star records of a child, served by ix_star_records_child_id_created_at"""
+    return (
+        select(StarRecord)
+        .options(joinedload(StarRecord.reward))
+        .where(StarRecord.child_id == child_id)
+        .order_by(StarRecord.created_at.desc(), StarRecord.id.desc())
+        .limit(limit)
+    )
+
 @router.get("/{child_id}")
-async def get_child(child_id: int, db: Session = Depends(get_db)):
+@query_budget(5)
+async def get_child(child_id: int, request: Request, db: AsyncSession = Depends(get_async_db)):
     """Get single child with details including star records and rewards"""
-    from sqlalchemy.orm import joinedload
+    etag = make_etag(f"child-{child_id}", await child_version(db, child_id))
+    not_modified = not_modified_response(request, etag)
+    if not_modified is not None:
+        return not_modified
     
-    child = db.query(Child).options(
-        joinedload(Child.star_records).joinedload(StarRecord.reward),
-        joinedload(Child.rewards)
-    ).filter(Child.id == child_id).first()
+    child = await db.get(Child, child_id)
     
     if not child:
         logger.warning(f"Child {child_id} not found")
@@ -71,103 +99,224 @@ async def get_child(child_id: int, db: Session = Depends(get_db)):
             content={"success": False, "message": "Child not found"}
         )
     
-    # Get recent 20 star records ordered by created_at desc
-    star_records = sorted(child.star_records, key=lambda x: x.created_at, reverse=True)[:20]
+    # Get recent 20 star records; ordering and limit happen in the database
+    result = await db.execute(latest_star_records(child_id, 20))
+    star_records = result.scalars().all()
     
-    # Format star records with reward info
-    formatted_star_records = []
-    for record in star_records:
-        formatted_record = {
-            "id": record.id,
-            "amount": record.amount,
-            "type": record.type,
-            "reason": record.reason,
-            "reward": None,
-            "created_at": record.created_at.strftime("%Y-%m-%d %H:%M")
-        }
-        
-        # Add reward info if this is a redemption record
-        if record.reward:
-            formatted_record["reward"] = {
-                "id": record.reward.id,
-                "name": record.reward.name,
-                "image": f"/storage/{record.reward.image}" if record.reward.image else None
-            }
-        
-        formatted_star_records.append(formatted_record)
+    # Load the rewards this child participates in separately, with progress
+    # aggregated in SQL, instead of joining a second collection onto the records
+    result = await db.execute(
+        select_rewards_with_progress()
+        .options(selectinload(Reward.children))
+        .where(Reward.id.in_(select(reward_children.c.reward_id).where(reward_children.c.child_id == child_id)))
+        .order_by(Reward.id)
+    )
+    rewards = result.all()
     
-    # Format rewards this child is participating in
-    formatted_rewards = []
-    for reward in child.rewards:
-        # Calculate total stars from all participating children
-        total_stars = sum(c.star_count for c in reward.children)
-        is_achieved = total_stars >= reward.star_cost
-        
-        formatted_rewards.append({
-            "id": reward.id,
-            "name": reward.name,
-            "image": f"/storage/{reward.image}" if reward.image else None,
-            "star_cost": reward.star_cost,
-            "is_redeemed": reward.is_redeemed,
-            "children": [
-                {
-                    "id": c.id,
-                    "name": c.name,
-                    "gender": c.gender,
-                    "star_count": c.star_count
-                }
-                for c in reward.children
-            ],
-            "total_stars": total_stars,
-            "is_achieved": is_achieved
-        })
+    logger.info(f"Retrieved child {child_id} details with {len(star_records)} star records and {len(rewards)} rewards")
     
-    logger.info(f"Retrieved child {child_id} details with {len(star_records)} star records and {len(child.rewards)} rewards")
+    # Records and reward rows are validated as-is by the nested response models
+    return model_response(ChildDetailPayload(data={
+        "id": child.id,
+        "name": child.name,
+        "birthday": child.birthday,
+        "gender": child.gender,
+        "avatar": child.avatar,
+        "star_count": child.star_count,
+        "star_records": star_records,
+        "rewards": rewards
+    }), headers={"ETag": etag})
+
+@router.get("/{child_id}/star-records")
+@query_budget(2)
+async def get_child_star_records(
+    child_id: int,
+    before: Optional[int] = None,
+    limit: int = Query(20, ge=1, le=100),
+    db: AsyncSession = Depends(get_async_db)
+):
+    """Get a page of a child's star records, newest first, for infinite scroll
     
-    return {
-        "success": True,
-        "data": {
-            "id": child.id,
-            "name": child.name,
-            "birthday": child.birthday.strftime("%Y-%m-%d"),
-            "age": calculate_age(child.birthday),
-            "gender": child.gender,
-            "avatar": f"/storage/{child.avatar}" if child.avatar else None,
-            "star_count": child.star_count,
-            "star_records": formatted_star_records,
-            "rewards": formatted_rewards
-        }
+    Pass the returned ``next_cursor`` as ``before`` to fetch the next page.
+    """
+    child = await db.get(Child, child_id)
+    if not child:
+        logger.warning(f"Child {child_id} not found for star records")
+        return JSONResponse(
+            status_code=404,
+            content={"success": False, "message": "Child not found"}
+        )
+    
+    stmt = latest_star_records(child_id, limit + 1)
+    if before is not None:
+        # Keyset condition (created_at, id) < cursor; the cursor's created_at is read
+        # from the row itself so it compares in the column's own storage format
+        cursor_created_at = select(StarRecord.created_at).where(StarRecord.id == before).scalar_subquery()
+        stmt = stmt.where(or_(
+            StarRecord.created_at < cursor_created_at,
+            and_(StarRecord.created_at == cursor_created_at, StarRecord.id < before)
+        ))
+    
+    result = await db.execute(stmt)
+    records = result.scalars().all()
+    has_more = len(records) > limit
+    records = records[:limit]
+    
+    return model_response(StarRecordPage(
+        data=records,
+        next_cursor=records[-1].id if has_more else None
+    ))
+
+def export_response(child_ids: Optional[List[int]], export_format: str, filename: str) -> StreamingResponse:
+    return StreamingResponse(
+        EXPORTERS[export_format](export_statement(child_ids)),
+        media_type=EXPORT_MEDIA_TYPES[export_format],
+        headers={"Content-Disposition": f'attachment; filename="{filename}.{export_format}"'}
+    )
+
+@router.get("/{child_id}/star-records/export")
+@query_budget(2)
+async def export_child_star_records(
+    child_id: int,
+    format: Literal["ndjson", "csv"] = "ndjson",
+    db: AsyncSession = Depends(get_async_db)
+):
+    """Download a child's full star history, oldest first, streamed as NDJSON or CSV"""
+    child = await db.get(Child, child_id)
+    if not child:
+        logger.warning(f"Child {child_id} not found for star record export")
+        return JSONResponse(
+            status_code=404,
+            content={"success": False, "message": "Child not found"}
+        )
+    
+    logger.info(f"Exporting star records of child {child_id} as {format}")
+    return export_response([child_id], format, f"star-records-{child_id}")
+
+@router.get("/star-records/export")
+@query_budget(2)
+async def export_family_star_records(
+    child_ids: Optional[List[int]] = Query(None),
+    format: Literal["ndjson", "csv"] = "ndjson",
+    db: AsyncSession = Depends(get_async_db)
+):
+    """Download the star history of a family, ``child_ids`` (all children by default), streamed as NDJSON or CSV"""
+    if child_ids:
+        found = (await db.execute(select(Child.id).where(Child.id.in_(child_ids)))).scalars().all()
+        if len(found) != len(set(child_ids)):
+            return JSONResponse(
+                status_code=404,
+                content={"success": False, "message": "Child not found"}
+            )
+    
+    logger.info(f"Exporting star records of {'children ' + ', '.join(map(str, child_ids)) if child_ids else 'all children'} as {format}")
+    return export_response(child_ids or None, format, "star-records")
+
+@router.get("/{child_id}/stats/daily")
+@query_budget(2)
+async def get_child_daily_stats(
+    child_id: int,
+    date_from: Optional[date] = Query(None, alias="from"),
+    date_to: Optional[date] = Query(None, alias="to"),
+    db: AsyncSession = Depends(get_async_db)
+):
+    """Get a child's stars per day between ``from`` and ``to`` (inclusive) for trend charts
+    
+    Reads star_daily_rollups only, so the cost depends on the range, not on
+    the size of the child's history. Days without records are returned as zeros.
+    """
+    # Rollup days are in the records' clock (UTC), so today is too
+    date_to = date_to or utc_today()
+    date_from = date_from or date_to - timedelta(days=DEFAULT_STATS_DAYS - 1)
+    if date_from > date_to or (date_to - date_from).days >= MAX_STATS_DAYS:
+        return JSONResponse(
+            status_code=400,
+            content={"success": False, "message": f"Date range must be from <= to and at most {MAX_STATS_DAYS} days"}
+        )
+    
+    child = await db.get(Child, child_id)
+    if not child:
+        logger.warning(f"Child {child_id} not found for daily stats")
+        return JSONResponse(
+            status_code=404,
+            content={"success": False, "message": "Child not found"}
+        )
+    
+    result = await db.execute(
+        select(StarDailyRollup.day, StarDailyRollup.type, StarDailyRollup.record_count, StarDailyRollup.total_amount)
+        .where(
+            StarDailyRollup.child_id == child_id,
+            StarDailyRollup.day >= date_from,
+            StarDailyRollup.day <= date_to
+        )
+    )
+    days = {
+        date_from + timedelta(days=offset): DailyStarStats(day=date_from + timedelta(days=offset))
+        for offset in range((date_to - date_from).days + 1)
     }
+    for day, record_type, record_count, total_amount in result:
+        stats = days[day]
+        setattr(stats, record_type, abs(total_amount))
+        stats.net += total_amount
+        stats.records += record_count
+    
+    return model_response(DailyStarStatsResponse(data=list(days.values())))
 
-async def save_avatar_file(file: UploadFile) -> str:
-    """Save avatar file and return the path"""
-    # Create public storage directory like Laravel
-    storage_dir = Path("public") / "storage" / "avatars"
-    storage_dir.mkdir(parents=True, exist_ok=True)
+@router.get("/{child_id}/stats/categories")
+@query_budget(2)
+async def get_child_category_stats(
+    child_id: int,
+    date_from: Optional[date] = Query(None, alias="from"),
+    date_to: Optional[date] = Query(None, alias="to"),
+    db: AsyncSession = Depends(get_async_db)
+):
+    """Get a child's add and subtract records per behavior category, optionally between ``from`` and ``to``
     
-    # Generate unique filename
-    file_extension = os.path.splitext(file.filename)[1]
-    unique_filename = f"{uuid.uuid4()}{file_extension}"
-    file_path = storage_dir / unique_filename
+    One GROUP BY over the category stored with each record, served by
+    ix_star_records_child_id_category_created_at.
+    """
+    child = await db.get(Child, child_id)
+    if not child:
+        logger.warning(f"Child {child_id} not found for category stats")
+        return JSONResponse(
+            status_code=404,
+            content={"success": False, "message": "Child not found"}
+        )
     
-    # Save file
-    content = await file.read()
-    with open(file_path, "wb") as f:
-        f.write(content)
+    stmt = (
+        select(
+            StarRecord.category,
+            func.count(),
+            func.coalesce(func.sum(case((StarRecord.type == "add", StarRecord.amount), else_=0)), 0),
+            func.coalesce(func.sum(case((StarRecord.type == "subtract", -StarRecord.amount), else_=0)), 0)
+        )
+        .where(StarRecord.child_id == child_id, StarRecord.type.in_(("add", "subtract")))
+        .group_by(StarRecord.category)
+        .order_by(func.count().desc())
+    )
+    if date_from is not None:
+        stmt = stmt.where(StarRecord.created_at >= datetime.combine(date_from, datetime.min.time()))
+    if date_to is not None:
+        stmt = stmt.where(StarRecord.created_at < datetime.combine(date_to + timedelta(days=1), datetime.min.time()))
     
-    # Return relative path for storage in database (matches Laravel format)
-    return f"avatars/{unique_filename}"
+    result = await db.execute(stmt)
+    return model_response(CategoryStatsResponse(data=[
+        CategoryStats(category=category, records=records, added=added, subtracted=subtracted)
+        for category, records, added, subtracted in result
+    ]))
 
 @router.post("/", status_code=status.HTTP_201_CREATED)
+@query_budget(4)
 async def create_child(
     name: str = Form(...),
     birthday: date = Form(...),
     gender: Literal["boy", "girl", "male", "female"] = Form(...),
     avatar: Optional[UploadFile] = File(None),
     avatar_url: Optional[str] = Form(None),
-    db: Session = Depends(get_db)
+    db: AsyncSession = Depends(get_async_db)
 ):
     """Create new child - accepts form data with optional avatar file upload"""
+    stored_avatar = None
     try:
         # Store original gender for database (PHP uses male/female)
         db_gender = gender
@@ -190,16 +339,16 @@ async def create_child(
                     }
                 }
             
-            # Check file size (100MB max like PHP)
-            if avatar.size and avatar.size > 104857600:  # 100MB in bytes
-                return {
-                    "success": False,
-                    "errors": {
-                        "avatar": ["File too large. Maximum size: 100MB"]
-                    }
-                }
-            
-            avatar_path = await save_avatar_file(avatar)
+            # Size (settings.max_upload_size) and content are checked while streaming
+            try:
+                stored_avatar = await save_upload(avatar)
+            except UploadError as e:
+                logger.warning(f"Rejected avatar upload {avatar.filename}: {e.message}")
+                return JSONResponse(
+                    status_code=e.status_code,
+                    content={"success": False, "errors": {"avatar": [e.message]}}
+                )
+            avatar_path = stored_avatar.path
         elif avatar_url:
             avatar_path = avatar_url
             
@@ -210,26 +359,25 @@ async def create_child(
             avatar=avatar_path
         )
         db.add(child)
-        db.commit()
-        db.refresh(child)
+        if stored_avatar:
+            await retain_upload(db, stored_avatar)
+        else:
+            await retain_path(db, avatar_path)
+        await db.commit()
+        await db.refresh(child)
+        if stored_avatar:
+            schedule_variants(stored_avatar.path)
         
         logger.info(f"Created child: {child.name} (ID: {child.id})")
         
         # Return response matching PHP format
         return {
             "success": True,
-            "data": {
-                "id": child.id,
-                "name": child.name,
-                "birthday": child.birthday.strftime("%Y-%m-%d"),
-                "age": calculate_age(child.birthday),
-                "gender": child.gender,
-                "avatar": f"/storage/{child.avatar}" if child.avatar else None,
-                "star_count": child.star_count
-            }
+            "data": ChildSummary.model_validate(child)
         }
     except Exception as e:
-        db.rollback()
+        await db.rollback()
+        await discard_upload(stored_avatar)
         logger.error(f"Error creating child: {e}")
         return {
             "success": False,
@@ -239,27 +387,29 @@ async def create_child(
         }
 
 @router.post("/json", response_model=ChildResponse, status_code=status.HTTP_201_CREATED)
-async def create_child_json(child_data: ChildCreate, db: Session = Depends(get_db)):
+@query_budget(3)
+async def create_child_json(child_data: ChildCreate, db: AsyncSession = Depends(get_async_db)):
     """Create new child - accepts JSON data"""
     try:
         child = Child(**child_data.dict())
         db.add(child)
-        db.commit()
-        db.refresh(child)
+        await db.commit()
+        await db.refresh(child)
         
         child.age = calculate_age(child.birthday)
         
         logger.info(f"Created child: {child.name} (ID: {child.id})")
         return child
     except Exception as e:
-        db.rollback()
+        await db.rollback()
         logger.error(f"Error creating child: {e}")
         raise HTTPException(status_code=500, detail="Error creating child")
 
 @router.patch("/{child_id}")
-async def update_child(child_id: int, child_data: ChildUpdate, db: Session = Depends(get_db)):
+@query_budget(8)
+async def update_child(child_id: int, child_data: ChildUpdate, db: AsyncSession = Depends(get_async_db)):
     """Update child information"""
-    child = db.query(Child).filter(Child.id == child_id).first()
+    child = await db.get(Child, child_id)
     
     if not child:
         logger.warning(f"Child {child_id} not found for update")
@@ -278,28 +428,26 @@ async def update_child(child_id: int, child_data: ChildUpdate, db: Session = Dep
             elif update_data["gender"] == "girl":
                 update_data["gender"] = "female"
         
+        released = None
+        if "avatar" in update_data and update_data["avatar"] != child.avatar:
+            released = await release_path(db, child.avatar)
+            await retain_path(db, update_data["avatar"])
+        
         for field, value in update_data.items():
             setattr(child, field, value)
         
-        db.commit()
-        db.refresh(child)
+        await db.commit()
+        await db.refresh(child)
+        await delete_released_files([released])
         
         logger.info(f"Updated child {child_id}")
         
         return {
             "success": True,
-            "data": {
-                "id": child.id,
-                "name": child.name,
-                "birthday": child.birthday.strftime("%Y-%m-%d"),
-                "age": calculate_age(child.birthday),
-                "gender": child.gender,
-                "avatar": f"/storage/{child.avatar}" if child.avatar else None,
-                "star_count": child.star_count
-            }
+            "data": ChildSummary.model_validate(child)
         }
     except Exception as e:
-        db.rollback()
+        await db.rollback()
         logger.error(f"Error updating child {child_id}: {e}")
         return {
             "success": False,
@@ -307,9 +455,18 @@ async def update_child(child_id: int, child_data: ChildUpdate, db: Session = Dep
         }
 
 @router.delete("/{child_id}")
-async def delete_child(child_id: int, db: Session = Depends(get_db)):
+@query_budget(14)
+async def delete_child(child_id: int, db: AsyncSession = Depends(get_async_db)):
     """Delete child"""
-    child = db.query(Child).filter(Child.id == child_id).first()
+    # Load the collections the delete cascade has to walk up front;
+    # AsyncSession cannot lazy-load them during flush
+    result = await db.execute(
+        select(Child).options(
+            selectinload(Child.star_records),
+            selectinload(Child.rewards)
+        ).filter(Child.id == child_id)
+    )
+    child = result.scalars().first()
     
     if not child:
         logger.warning(f"Child {child_id} not found for deletion")
@@ -319,14 +476,18 @@ async def delete_child(child_id: int, db: Session = Depends(get_db)):
         )
     
     try:
-        # Delete avatar file if exists
-        if child.avatar:
-            avatar_path = Path("public/storage") / child.avatar
-            if avatar_path.exists():
-                avatar_path.unlink()
+        # The avatar file is deleted once no other row references it
+        released = await release_path(db, child.avatar)
         
-        db.delete(child)
-        db.commit()
+        await db.execute(delete(StarDailyRollup).where(StarDailyRollup.child_id == child_id))
+        reports = (await db.execute(
+            select(ReportJob.artifact).where(ReportJob.child_id == child_id, ReportJob.artifact.is_not(None))
+        )).scalars().all()
+        await db.execute(delete(ReportJob).where(ReportJob.child_id == child_id))
+        await db.delete(child)
+        await db.commit()
+        await delete_released_files([released])
+        delete_artifacts(reports)
         logger.info(f"Deleted child {child_id}")
         
         return {
@@ -334,7 +495,7 @@ async def delete_child(child_id: int, db: Session = Depends(get_db)):
             "message": "Child deleted successfully"
         }
     except Exception as e:
-        db.rollback()
+        await db.rollback()
         logger.error(f"Error deleting child {child_id}: {e}")
         return JSONResponse(
             status_code=500,
@@ -0,0 +1,38 @@
+import re
+
+from fastapi import APIRouter, Request
+from fastapi.responses import JSONResponse
+from loguru import logger
+from starlette.concurrency import run_in_threadpool
+
+from app.core.static_files import storage_response
+from app.services.image_variants import VARIANT_SIZES, ensure_variant, find_blob, variant_path, variants_enabled
+
+router = APIRouter()
+
+SHA256_PATTERN = re.compile(r"[0-9a-f]{64}")
+
+@router.get("/variants/{size}/{prefix}/{name}")
+async def get_image_variant(size: int, prefix: str, name: str, request: Request):
+    """Serve a resized WebP variant of an uploaded image, rendering it on first request"""
+    sha256, _, extension = name.partition(".")
+    if (
+        not variants_enabled()
+        or size not in VARIANT_SIZES
+        or extension != "webp"
+        or not SHA256_PATTERN.fullmatch(sha256)
+        or prefix != sha256[:2]
+    ):
+        return JSONResponse(status_code=404, content={"success": False, "message": "Variant not found"})
+    
+    path = await run_in_threadpool(find_blob, f"{prefix}/{sha256}")
+    if path is None:
+        return JSONResponse(status_code=404, content={"success": False, "message": "Image not found"})
+    
+    try:
+        variant = await ensure_variant(path, size)
+    except Exception as e:
+        logger.error(f"Error rendering {size}px variant of {path}: {e}")
+        return JSONResponse(status_code=500, content={"success": False, "message": "Failed to render image"})
+    
+    return await storage_response(request, variant, variant_path(path, size))
@@ -0,0 +1,44 @@
+import re
+
+from fastapi import APIRouter, Request
+from fastapi.responses import FileResponse, JSONResponse
+from starlette.concurrency import run_in_threadpool
+
+from app.core import profiling
+from app.core.config import settings
+
+router = APIRouter()
+
+PROFILE_ID_PATTERN = re.compile(r"\d{8}-\d{6}-[0-9a-f]{8}")
+
+def profiling_disabled() -> JSONResponse:
+    return JSONResponse(status_code=404, content={"success": False, "message": "Profiling is disabled"})
+
+def token_rejected(request: Request) -> bool:
+    """Profiles expose SQL and stacks, so reading them takes PROFILING_TOKEN too"""
+    value = request.headers.get("x-profiling-token") or request.query_params.get("token")
+    return not profiling.token_accepted(value)
+
+def invalid_token() -> JSONResponse:
+    return JSONResponse(status_code=403, content={"success": False, "message": "Invalid profiling token"})
+
+@router.get("/")
+async def get_profiles(request: Request):
+    """List stored request profiles, newest first"""
+    if not settings.profiling_enabled:
+        return profiling_disabled()
+    if token_rejected(request):
+        return invalid_token()
+    return {"success": True, "data": await run_in_threadpool(profiling.list_profiles)}
+
+@router.get("/{profile_id}")
+async def get_profile(request: Request, profile_id: str):
+    """Download a profile in the speedscope format"""
+    if not settings.profiling_enabled:
+        return profiling_disabled()
+    if token_rejected(request):
+        return invalid_token()
+    path = profiling.PROFILE_DIR / f"{profile_id}.speedscope.json"
+    if not PROFILE_ID_PATTERN.fullmatch(profile_id) or not await run_in_threadpool(path.is_file):
+        return JSONResponse(status_code=404, content={"success": False, "message": "Profile not found"})
+    return FileResponse(path, media_type="application/json", filename=path.name)
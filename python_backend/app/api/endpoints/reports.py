@@ -0,0 +1,85 @@
+from fastapi import APIRouter, Depends, status
+from fastapi.responses import FileResponse, JSONResponse
+from loguru import logger
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from app.core.clock import utc_today
+from app.core.database import get_async_db
+from app.core.query_budget import query_budget
+from app.models import Child, ReportJob
+from app.schemas import ReportJobResponse, ReportRequest
+from app.services.report_rendering import MEDIA_TYPES, format_available
+from app.services.reports import create_job, data_version, find_report, get_job, period_start, report_root
+
+router = APIRouter()
+
+def job_payload(job: ReportJob) -> dict:
+    payload = ReportJobResponse.model_validate(job)
+    payload.status_url = f"/api/reports/jobs/{job.id}"
+    if job.status == "done":
+        payload.download_url = f"/api/reports/jobs/{job.id}/download"
+    return payload.model_dump(mode="json")
+
+@router.post("/", status_code=status.HTTP_202_ACCEPTED)
+@query_budget(6)
+async def request_report(report: ReportRequest, db: AsyncSession = Depends(get_async_db)):
+    """Queue a weekly or monthly report of a child and return its job right away
+
+    Poll ``status_url`` until the job is done, then fetch ``download_url``.
+    If the same report of unchanged data was already requested, its job is
+    returned instead (200 once it is done) and nothing is rendered again.
+    """
+    if not format_available(report.format):
+        library = "openpyxl" if report.format == "xlsx" else "reportlab"
+        return JSONResponse(
+            status_code=503,
+            content={"success": False, "message": f"{report.format} reports require {library}"}
+        )
+
+    child = await db.get(Child, report.child_id)
+    if not child:
+        return JSONResponse(status_code=404, content={"success": False, "message": "Child not found"})
+
+    start = period_start(report.period, report.start or utc_today())
+    version = await data_version(db, report.child_id, report.period, start)
+    job = await find_report(db, report.child_id, report.period, start, report.format, version)
+    if job is None:
+        job = await create_job(report.child_id, report.period, start, report.format, version)
+        logger.info(f"Queued {report.period} {report.format} report {job.id} of child {report.child_id} from {start}")
+
+    content = {"success": True, "data": job_payload(job)}
+    if job.status == "done":
+        return JSONResponse(status_code=status.HTTP_200_OK, content=content)
+    return content
+
+@router.get("/jobs/{job_id}")
+@query_budget(1)
+async def get_report_job(job_id: int):
+    """Get the status of a report job"""
+    job = await get_job(job_id)
+    if not job:
+        return JSONResponse(status_code=404, content={"success": False, "message": "Report job not found"})
+    return {"success": True, "data": job_payload(job)}
+
+@router.get("/jobs/{job_id}/download")
+@query_budget(1)
+async def download_report(job_id: int):
+    """Download the file of a finished report job"""
+    job = await get_job(job_id)
+    if not job:
+        return JSONResponse(status_code=404, content={"success": False, "message": "Report job not found"})
+    if job.status != "done":
+        return JSONResponse(
+            status_code=409,
+            content={"success": False, "message": f"Report job is {job.status}"}
+        )
+
+    path = report_root() / job.artifact
+    if not path.is_file():
+        logger.error(f"File of report job {job_id} is missing: {path}")
+        return JSONResponse(status_code=404, content={"success": False, "message": "Report file not found"})
+    return FileResponse(
+        path,
+        media_type=MEDIA_TYPES[job.format],
+        filename=f"{job.period}-report-{job.child_id}-{job.period_start.isoformat()}.{job.format}"
+    )
@@ -1,73 +1,97 @@
-from fastapi import APIRouter, Depends, HTTPException, status, Form, File, UploadFile
+from fastapi import APIRouter, Depends, HTTPException, Query, Request, status, Form, File, UploadFile
 from fastapi.responses import JSONResponse
-from sqlalchemy.orm import Session
-from typing import List, Optional
+from sqlalchemy import func, select
+from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy.orm import selectinload
+from typing import List, Literal, Optional
 from loguru import logger
-import os
-import uuid
-from pathlib import Path
 
-from app.core.database import get_db
-from app.models import Reward, Child, StarRecord
-from app.schemas import RewardCreate, RewardUpdate, RewardResponse, RedeemRequest
+from app.api.routing import IdempotentRoute
+from app.core.cache import response_cache
+from app.core.database import get_async_db
+from app.core.query_budget import query_budget
+from app.core.etag import make_etag, not_modified_response, rewards_version
+from app.models import Reward, Child
+from app.models.reward import reward_children
+from app.schemas import RewardCreate, RewardUpdate, RewardResponse, RedeemRequest, RewardListResponse
+from app.services.rewards import (
+    RedemptionError,
+    apply_redemption,
+    progress_ratio,
+    reward_progress_subquery,
+    select_rewards_with_progress,
+)
+from app.services.image_variants import schedule_variants, variant_urls
+from app.services.uploads import (
+    UploadError,
+    delete_released_files,
+    discard_upload,
+    release_path,
+    retain_upload,
+    save_upload,
+)
 
 router = APIRouter()
-
-async def save_reward_image(file: UploadFile) -> str:
-    """Save reward image and return the path"""
-    # Create public storage directory like Laravel
-    storage_dir = Path("public") / "storage" / "rewards"
-    storage_dir.mkdir(parents=True, exist_ok=True)
-    
-    # Generate unique filename
-    file_extension = os.path.splitext(file.filename)[1]
-    unique_filename = f"{uuid.uuid4()}{file_extension}"
-    file_path = storage_dir / unique_filename
-    
-    # Save file
-    content = await file.read()
-    with open(file_path, "wb") as f:
-        f.write(content)
-    
-    # Return relative path for storage in database (matches Laravel format)
-    return f"rewards/{unique_filename}"
+# Only the JSON redemption honours Idempotency-Key: fingerprinting the multipart
+# routes would buffer whole image uploads and hash their per-attempt boundaries
+idempotent_router = APIRouter(route_class=IdempotentRoute)
 
 @router.get("/")
-async def get_rewards(db: Session = Depends(get_db)):
-    """Get all rewards with participants and progress"""
+@query_budget(3)
+async def get_rewards(
+    request: Request,
+    achieved: Optional[bool] = None,
+    redeemed: Optional[bool] = None,
+    child_id: Optional[int] = None,
+    order_by: Literal["default", "progress"] = "default",
+    limit: Optional[int] = Query(None, ge=1, le=500),
+    offset: int = Query(0, ge=0),
+    db: AsyncSession = Depends(get_async_db)
+):
+    """Get rewards with participants and progress, optionally filtered and paginated"""
     try:
-        rewards = db.query(Reward).order_by(Reward.is_redeemed, Reward.created_at.desc()).all()
+        # Answer from the change sequences alone when the client is up to date
+        version = await rewards_version(db)
+        etag = make_etag("rewards", version)
+        not_modified = not_modified_response(request, etag)
+        if not_modified is not None:
+            return not_modified
         
-        data = []
-        for reward in rewards:
-            total_stars = sum(child.star_count for child in reward.children)
-            is_achieved = total_stars >= reward.star_cost
-            
-            data.append({
-                "id": reward.id,
-                "name": reward.name,
-                "image": f"/storage/{reward.image}" if reward.image else None,
-                "star_cost": reward.star_cost,
-                "is_redeemed": reward.is_redeemed,
-                "redeemed_at": reward.redeemed_at.strftime("%Y-%m-%d %H:%M") if reward.redeemed_at else None,
-                "children": [
-                    {
-                        "id": child.id,
-                        "name": child.name,
-                        "star_count": child.star_count,
-                        "avatar": f"/storage/{child.avatar}" if child.avatar else None
-                    }
-                    for child in reward.children
-                ],
-                "total_stars": total_stars,
-                "is_achieved": is_achieved
-            })
+        cached = response_cache.cached_response(request, version)
+        if cached is not None:
+            cached.headers["ETag"] = etag
+            return cached
         
-        logger.info(f"Retrieved {len(rewards)} rewards")
-        return {
-            "success": True,
-            "data": data
-        }
+        # Progress is aggregated in SQL and participants are loaded with one
+        # extra SELECT ... IN, so the query count does not grow with the list
+        progress = reward_progress_subquery()
+        stmt = select_rewards_with_progress(progress).options(selectinload(Reward.children))
+        
+        if achieved is not None:
+            is_achieved = func.coalesce(progress.c.total_stars, 0) >= Reward.star_cost
+            stmt = stmt.where(is_achieved if achieved else ~is_achieved)
+        if redeemed is not None:
+            stmt = stmt.where(Reward.is_redeemed == redeemed)
+        if child_id is not None:
+            stmt = stmt.where(
+                Reward.id.in_(select(reward_children.c.reward_id).where(reward_children.c.child_id == child_id))
+            )
+        
+        if order_by == "progress":
+            stmt = stmt.order_by(progress_ratio(progress).desc(), Reward.created_at.desc())
+        else:
+            stmt = stmt.order_by(Reward.is_redeemed, Reward.created_at.desc())
+        stmt = stmt.order_by(Reward.id.desc()).offset(offset)
+        if limit is not None:
+            stmt = stmt.limit(limit)
+        
+        rows = (await db.execute(stmt)).all()
+        
+        # RewardSummary reads the (Reward, total_stars, is_achieved) rows directly
+        logger.info(f"Retrieved {len(rows)} rewards")
+        response = response_cache.store_response(request, RewardListResponse(data=rows), version)
+        response.headers["ETag"] = etag
+        return response
     except Exception as e:
         logger.error(f"Error retrieving rewards: {e}")
         return {
@@ -76,9 +100,10 @@ async def get_rewards(db: Session = Depends(get_db)):
         }
 
 @router.get("/{reward_id}", response_model=RewardResponse)
-async def get_reward(reward_id: int, db: Session = Depends(get_db)):
+@query_budget(1)
+async def get_reward(reward_id: int, db: AsyncSession = Depends(get_async_db)):
     """Get single reward"""
-    reward = db.query(Reward).filter(Reward.id == reward_id).first()
+    reward = await db.get(Reward, reward_id)
     
     if not reward:
         logger.warning(f"Reward {reward_id} not found")
@@ -88,43 +113,48 @@ async def get_reward(reward_id: int, db: Session = Depends(get_db)):
     return reward
 
 @router.post("/", status_code=status.HTTP_201_CREATED)
+@query_budget(5)
 async def create_reward(
     name: str = Form(...),
     star_cost: int = Form(...),
     description: Optional[str] = Form(None),
     image: Optional[UploadFile] = File(None),
     child_ids: List[int] = Form(..., alias="child_ids[]"),
-    db: Session = Depends(get_db)
+    db: AsyncSession = Depends(get_async_db)
 ):
     """Create new reward"""
+    stored_image = None
     try:
         # Validate child_ids are not empty
         if not child_ids:
             raise HTTPException(status_code=422, detail="At least one child must be selected")
         
+        # Check the children before streaming the image, so a rejected request stores nothing
+        result = await db.execute(select(Child).filter(Child.id.in_(child_ids)))
+        children = result.scalars().all()
+        if len(children) != len(child_ids):
+            raise HTTPException(status_code=422, detail="One or more invalid child IDs")
+        
         # Handle image upload if provided
-        image_path = None
         if image and image.filename:
-            image_path = await save_reward_image(image)
+            stored_image = await save_upload(image)
         
         # Create reward
         reward = Reward(
             name=name,
             star_cost=star_cost,
             description=description,
-            image=image_path,
+            image=stored_image.path if stored_image else None,
             is_redeemed=False  # Initialize as not redeemed
         )
-        
-        # Add children
-        children = db.query(Child).filter(Child.id.in_(child_ids)).all()
-        if len(children) != len(child_ids):
-            raise HTTPException(status_code=422, detail="One or more invalid child IDs")
-        reward.children = children
+        reward.children = list(children)
         
         db.add(reward)
-        db.commit()
-        db.refresh(reward)
+        if stored_image:
+            await retain_upload(db, stored_image)
+        await db.commit()
+        if stored_image:
+            schedule_variants(stored_image.path)
         
         logger.info(f"Created reward: {reward.name} (ID: {reward.id})")
         
@@ -135,6 +165,7 @@ async def create_reward(
                 "id": reward.id,
                 "name": reward.name,
                 "image": f"/storage/{reward.image}" if reward.image else None,
+                "image_variants": variant_urls(reward.image),
                 "star_cost": reward.star_cost,
                 "children": [
                     {
@@ -149,8 +180,16 @@ async def create_reward(
         }
     except HTTPException:
         raise
+    except UploadError as e:
+        await db.rollback()
+        logger.warning(f"Rejected reward image upload: {e.message}")
+        return JSONResponse(
+            status_code=e.status_code,
+            content={"success": False, "message": e.message}
+        )
     except Exception as e:
-        db.rollback()
+        await db.rollback()
+        await discard_upload(stored_image)
         logger.error(f"Error creating reward: {e}")
         return {
             "success": False,
@@ -158,6 +197,7 @@ async def create_reward(
         }
 
 @router.patch("/{reward_id}")
+@query_budget(11)
 async def update_reward(
     reward_id: int,
     name: Optional[str] = Form(None),
@@ -165,10 +205,13 @@ async def update_reward(
     description: Optional[str] = Form(None),
     image: Optional[UploadFile] = File(None),
     child_ids: Optional[List[int]] = Form(None, alias="child_ids[]"),
-    db: Session = Depends(get_db)
+    db: AsyncSession = Depends(get_async_db)
 ):
     """Update reward information"""
-    reward = db.query(Reward).filter(Reward.id == reward_id).first()
+    result = await db.execute(
+        select(Reward).options(selectinload(Reward.children)).filter(Reward.id == reward_id)
+    )
+    reward = result.scalars().first()
     
     if not reward:
         logger.warning(f"Reward {reward_id} not found for update")
@@ -184,7 +227,17 @@ async def update_reward(
             }
         )
     
+    stored_image = None
     try:
+        # Update children if provided; checked before streaming the image,
+        # so a rejected request stores nothing
+        if child_ids is not None:
+            result = await db.execute(select(Child).filter(Child.id.in_(child_ids)))
+            children = result.scalars().all()
+            if len(children) != len(child_ids):
+                raise HTTPException(status_code=422, detail="One or more invalid child IDs")
+            reward.children = list(children)
+        
         # Update fields if provided
         if name is not None:
             reward.name = name
@@ -193,26 +246,24 @@ async def update_reward(
         if description is not None:
             reward.description = description
         
-        # Handle image upload if provided
+        # Handle image upload if provided; the old image is deleted after
+        # commit once nothing references it, so a rejected upload keeps it
+        released = None
         if image and image.filename:
-            # Delete old image if it exists
-            if reward.image:
-                old_image_path = Path("public") / "storage" / reward.image
-                if old_image_path.exists():
-                    old_image_path.unlink()
-            
-            # Save new image
-            reward.image = await save_reward_image(image)
-        
-        # Update children if provided
-        if child_ids is not None:
-            children = db.query(Child).filter(Child.id.in_(child_ids)).all()
-            if len(children) != len(child_ids):
-                raise HTTPException(status_code=422, detail="One or more invalid child IDs")
-            reward.children = children
+            stored_image = await save_upload(image)
+            if stored_image.path != reward.image:
+                released = await release_path(db, reward.image)
+                await retain_upload(db, stored_image)
+                reward.image = stored_image.path
+            else:
+                # Same content as the current image; drop the temporary copy
+                await discard_upload(stored_image)
+                stored_image = None
         
-        db.commit()
-        db.refresh(reward)
+        await db.commit()
+        await delete_released_files([released])
+        if image and image.filename:
+            schedule_variants(reward.image)
         
         # Calculate total stars
         total_stars = sum(child.star_count for child in reward.children)
@@ -224,6 +275,7 @@ async def update_reward(
                 "id": reward.id,
                 "name": reward.name,
                 "image": f"/storage/{reward.image}" if reward.image else None,
+                "image_variants": variant_urls(reward.image),
                 "star_cost": reward.star_cost,
                 "is_redeemed": reward.is_redeemed,
                 "children": [
@@ -241,8 +293,16 @@ async def update_reward(
         }
     except HTTPException:
         raise
+    except UploadError as e:
+        await db.rollback()
+        logger.warning(f"Rejected image upload for reward {reward_id}: {e.message}")
+        return JSONResponse(
+            status_code=e.status_code,
+            content={"success": False, "message": e.message}
+        )
     except Exception as e:
-        db.rollback()
+        await db.rollback()
+        await discard_upload(stored_image)
         logger.error(f"Error updating reward {reward_id}: {e}")
         return JSONResponse(
             status_code=500,
@@ -253,9 +313,15 @@ async def update_reward(
         )
 
 @router.delete("/{reward_id}")
-async def delete_reward(reward_id: int, db: Session = Depends(get_db)):
+@query_budget(8)
+async def delete_reward(reward_id: int, db: AsyncSession = Depends(get_async_db)):
     """Delete reward"""
-    reward = db.query(Reward).filter(Reward.id == reward_id).first()
+    # The secondary rows in reward_children are removed through the
+    # children collection, so it must be loaded before the delete
+    result = await db.execute(
+        select(Reward).options(selectinload(Reward.children)).filter(Reward.id == reward_id)
+    )
+    reward = result.scalars().first()
     
     if not reward:
         logger.warning(f"Reward {reward_id} not found for deletion")
@@ -272,14 +338,12 @@ async def delete_reward(reward_id: int, db: Session = Depends(get_db)):
         )
     
     try:
-        # Delete image if it exists
-        if reward.image:
-            image_path = Path("public") / "storage" / reward.image
-            if image_path.exists():
-                image_path.unlink()
+        # The image file is deleted once no other row references it
+        released = await release_path(db, reward.image)
         
-        db.delete(reward)
-        db.commit()
+        await db.delete(reward)
+        await db.commit()
+        await delete_released_files([released])
         logger.info(f"Deleted reward {reward_id}")
         
         return {
@@ -287,7 +351,7 @@ async def delete_reward(reward_id: int, db: Session = Depends(get_db)):
             "message": "Reward deleted successfully"
         }
     except Exception as e:
-        db.rollback()
+        await db.rollback()
         logger.error(f"Error deleting reward {reward_id}: {e}")
         return JSONResponse(
             status_code=500,
@@ -297,105 +361,28 @@ async def delete_reward(reward_id: int, db: Session = Depends(get_db)):
             }
         )
 
-@router.post("/{reward_id}/redeem")
-async def redeem_reward(reward_id: int, redeem_data: RedeemRequest, db: Session = Depends(get_db)):
+@idempotent_router.post("/{reward_id}/redeem")
+@query_budget(11)
+async def redeem_reward(reward_id: int, redeem_data: RedeemRequest, db: AsyncSession = Depends(get_async_db)):
     """Redeem a reward with multiple children contributing stars"""
-    from datetime import datetime
-    from sqlalchemy import text
-    
-    # Get reward
-    reward = db.query(Reward).filter(Reward.id == reward_id).first()
-    if not reward:
-        logger.warning(f"Reward {reward_id} not found for redemption")
-        return JSONResponse(
-            status_code=404,
-            content={"success": False, "message": "Reward not found"}
-        )
-    
-    # Check if already redeemed
-    if reward.is_redeemed:
-        return JSONResponse(
-            status_code=400,
-            content={"success": False, "message": "Reward already redeemed"}
-        )
-    
-    # Validate total deduction >= star_cost
-    total_deduction = sum(d.amount for d in redeem_data.deductions)
-    if total_deduction < reward.star_cost:
-        return JSONResponse(
-            status_code=400,
-            content={"success": False, "message": "Total deduction is less than required stars"}
-        )
-    
-    # Validate each child has enough stars
-    for deduction in redeem_data.deductions:
-        child = db.query(Child).filter(Child.id == deduction.child_id).first()
-        if not child:
-            return JSONResponse(
-                status_code=400,
-                content={"success": False, "message": f"Child {deduction.child_id} not found"}
-            )
-        if child.star_count < deduction.amount:
-            return JSONResponse(
-                status_code=400,
-                content={"success": False, "message": f"Child {child.name} doesn't have enough stars"}
-            )
-    
     try:
-        # Process each deduction
-        for deduction in redeem_data.deductions:
-            if deduction.amount == 0:
-                continue  # Skip if no deduction
-                
-            child = db.query(Child).filter(Child.id == deduction.child_id).first()
-            
-            # Create star record (redemption type) with negative amount like PHP
-            star_record = StarRecord(
-                child_id=child.id,
-                type="redeem",
-                amount=-deduction.amount,  # Store as negative like PHP
-                reason=None,  # PHP doesn't set reason for redeem
-                reward_id=reward.id
-            )
-            
-            # Update child's star count
-            child.star_count -= deduction.amount
-            
-            # Update deduction_amount in pivot table using raw SQL
-            # First check if the relationship exists
-            existing = db.execute(
-                text("SELECT * FROM reward_children WHERE reward_id = :rid AND child_id = :cid"),
-                {"rid": reward.id, "cid": child.id}
-            ).fetchone()
-            
-            if existing:
-                # Update existing relationship with deduction amount
-                db.execute(
-                    text("UPDATE reward_children SET deduction_amount = :amount, updated_at = :now WHERE reward_id = :rid AND child_id = :cid"),
-                    {"amount": deduction.amount, "now": datetime.now(), "rid": reward.id, "cid": child.id}
-                )
-            else:
-                # Insert new relationship with deduction amount
-                db.execute(
-                    text("INSERT INTO reward_children (reward_id, child_id, deduction_amount, created_at, updated_at) VALUES (:rid, :cid, :amount, :now, :now)"),
-                    {"rid": reward.id, "cid": child.id, "amount": deduction.amount, "now": datetime.now()}
-                )
-            
-            db.add(star_record)
-        
-        # Mark reward as redeemed
-        reward.is_redeemed = True
-        reward.redeemed_at = datetime.now()
-        
-        db.commit()
+        await apply_redemption(db, reward_id, redeem_data.deductions)
+        await db.commit()
         
         logger.info(f"Reward {reward_id} redeemed successfully with deductions from multiple children")
         return {
             "success": True,
             "message": "Reward redeemed successfully"
         }
+    except RedemptionError as e:
+        await db.rollback()
+        logger.warning(f"Redemption of reward {reward_id} rejected: {e.message}")
+        return JSONResponse(
+            status_code=e.status_code,
+            content={"success": False, "message": e.message}
+        )
     except Exception as e:
-        db.rollback()
+        await db.rollback()
         logger.error(f"Error redeeming reward {reward_id}: {e}")
         return JSONResponse(
             status_code=500,
@@ -405,3 +392,5 @@ async def redeem_reward(reward_id: int, redeem_data: RedeemRequest, db: Session
                 "error": str(e)
             }
         )
+
+router.include_router(idempotent_router)
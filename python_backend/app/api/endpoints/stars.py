@@ -1,26 +1,24 @@
 from fastapi import APIRouter, Depends, HTTPException, status
 from fastapi.responses import JSONResponse
-from sqlalchemy.orm import Session
+from sqlalchemy.ext.asyncio import AsyncSession
 from loguru import logger
 
-from app.core.database import get_db
-from app.models import Child, StarRecord
-from app.schemas import StarAdd, StarSubtract, StarRecordResponse
+from app.api.routing import IdempotentRoute
+from app.core.database import get_async_db
+from app.schemas import StarAdd, StarSubtract, StarBulkRequest, StarRecordResponse
+from app.services.stars import (
+    ChildNotFoundError,
+    ConcurrentBalanceChangeError,
+    InsufficientStarsError,
+    apply_star_operations,
+    change_star_balance,
+)
 
-router = APIRouter()
+router = APIRouter(route_class=IdempotentRoute)
 
 @router.post("/children/{child_id}/stars/add")
-async def add_stars(child_id: int, star_data: StarAdd, db: Session = Depends(get_db)):
+async def add_stars(child_id: int, star_data: StarAdd, db: AsyncSession = Depends(get_async_db)):
     """Add stars to a child"""
-    child = db.query(Child).filter(Child.id == child_id).first()
-    
-    if not child:
-        logger.warning(f"Child {child_id} not found for adding stars")
-        return JSONResponse(
-            status_code=404,
-            content={"success": False, "message": "Child not found"}
-        )
-    
     # Validate amount (max 50 like PHP)
     if star_data.amount > 50:
         return {
@@ -29,34 +27,30 @@ async def add_stars(child_id: int, star_data: StarAdd, db: Session = Depends(get
                 "amount": ["Amount cannot be more than 50"]
             }
         }
-    
+
     try:
-        # Create star record
-        star_record = StarRecord(
-            child_id=child_id,
-            type="add",
-            amount=star_data.amount,
-            reason=star_data.reason
-        )
-        
-        # Update child's star count
-        child.star_count += star_data.amount
-        
-        db.add(star_record)
-        db.commit()
-        db.refresh(child)
-        
-        logger.info(f"Added {star_data.amount} stars to child {child_id}. New total: {child.star_count}")
-        
+        # Update the balance and create the star record in one transaction
+        star_count = await change_star_balance(db, child_id, star_data.amount, "add", star_data.reason)
+        await db.commit()
+
+        logger.info(f"Added {star_data.amount} stars to child {child_id}. New total: {star_count}")
+
         return {
             "success": True,
             "message": "Stars added successfully",
             "data": {
-                "star_count": child.star_count
+                "star_count": star_count
             }
         }
+    except ChildNotFoundError:
+        await db.rollback()
+        logger.warning(f"Child {child_id} not found for adding stars")
+        return JSONResponse(
+            status_code=404,
+            content={"success": False, "message": "Child not found"}
+        )
     except Exception as e:
-        db.rollback()
+        await db.rollback()
         logger.error(f"Error adding stars to child {child_id}: {e}")
         return JSONResponse(
             status_code=500,
@@ -64,54 +58,87 @@ async def add_stars(child_id: int, star_data: StarAdd, db: Session = Depends(get
         )
 
 @router.post("/children/{child_id}/stars/subtract")
-async def subtract_stars(child_id: int, star_data: StarSubtract, db: Session = Depends(get_db)):
+async def subtract_stars(child_id: int, star_data: StarSubtract, db: AsyncSession = Depends(get_async_db)):
     """Subtract stars from a child"""
-    child = db.query(Child).filter(Child.id == child_id).first()
-    
-    if not child:
+    try:
+        # Store as negative amount like PHP; the balance check is part of the UPDATE
+        star_count = await change_star_balance(db, child_id, -star_data.amount, "subtract", star_data.reason)
+        await db.commit()
+
+        logger.info(f"Subtracted {star_data.amount} stars from child {child_id}. New total: {star_count}")
+
+        return {
+            "success": True,
+            "message": "Stars subtracted successfully",
+            "data": {
+                "star_count": star_count
+            }
+        }
+    except ChildNotFoundError:
+        await db.rollback()
         logger.warning(f"Child {child_id} not found for subtracting stars")
         return JSONResponse(
             status_code=404,
             content={"success": False, "message": "Child not found"}
         )
-    
-    # Check if child has enough stars
-    if child.star_count < star_data.amount:
-        logger.warning(f"Child {child_id} has insufficient stars: {child.star_count} < {star_data.amount}")
+    except InsufficientStarsError:
+        await db.rollback()
+        logger.warning(f"Child {child_id} has insufficient stars to subtract {star_data.amount}")
         return JSONResponse(
             status_code=400,
             content={"success": False, "message": "Not enough stars"}
         )
-    
-    try:
-        # Create star record (store as negative like PHP)
-        star_record = StarRecord(
-            child_id=child_id,
-            type="subtract",
-            amount=-star_data.amount,  # Store as negative amount like PHP
-            reason=star_data.reason
+    except Exception as e:
+        await db.rollback()
+        logger.error(f"Error subtracting stars from child {child_id}: {e}")
+        return JSONResponse(
+            status_code=500,
+            content={"success": False, "message": "Failed to subtract stars"}
         )
-        
-        # Update child's star count
-        child.star_count -= star_data.amount
-        
-        db.add(star_record)
-        db.commit()
-        db.refresh(child)
-        
-        logger.info(f"Subtracted {star_data.amount} stars from child {child_id}. New total: {child.star_count}")
-        
+
+@router.post("/stars/bulk")
+async def bulk_star_operations(bulk_data: StarBulkRequest, db: AsyncSession = Depends(get_async_db)):
+    """Add or subtract stars for many children in a single transaction"""
+    atomic = bulk_data.mode == "atomic"
+    try:
+        results, star_counts = await apply_star_operations(db, bulk_data.operations, atomic=atomic)
+        failed = sum(1 for result in results if not result.success)
+
+        data = {
+            "results": [result.to_dict() for result in results],
+            "star_counts": [
+                {"child_id": child_id, "star_count": star_count}
+                for child_id, star_count in sorted(star_counts.items())
+            ]
+        }
+
+        if atomic and failed:
+            await db.rollback()
+            logger.warning(f"Rejected bulk star batch: {failed} of {len(results)} operations invalid")
+            return JSONResponse(
+                status_code=400,
+                content={"success": False, "message": "One or more operations are invalid", "data": data}
+            )
+
+        await db.commit()
+
+        logger.info(f"Applied {len(results) - failed} of {len(results)} bulk star operations")
         return {
             "success": True,
-            "message": "Stars subtracted successfully",
-            "data": {
-                "star_count": child.star_count
-            }
+            "message": "Stars updated successfully",
+            "data": data
         }
+    except ConcurrentBalanceChangeError:
+        await db.rollback()
+        logger.warning("Bulk star batch conflicted with a concurrent balance change")
+        return JSONResponse(
+            status_code=409,
+            content={"success": False, "message": "Star balances changed, please retry"}
+        )
     except Exception as e:
-        db.rollback()
-        logger.error(f"Error subtracting stars from child {child_id}: {e}")
+        await db.rollback()
+        logger.error(f"Error applying bulk star operations: {e}")
         return JSONResponse(
             status_code=500,
-            content={"success": False, "message": "Failed to subtract stars"}
+            content={"success": False, "message": "Failed to update stars"}
         )
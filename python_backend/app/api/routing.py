@@ -0,0 +1,31 @@
+"""Custom route classes shared by the API routers"""
+from typing import Callable
+
+from fastapi import Request, Response
+from fastapi.routing import APIRoute
+
+from app.services.idempotency import IDEMPOTENCY_HEADER, run_idempotent
+
+MUTATING_METHODS = {"POST", "PUT", "PATCH", "DELETE"}
+
+
+class IdempotentRoute(APIRoute):
+    """Route honouring the Idempotency-Key header on mutating requests
+
+    Requests without the header run exactly as before. The request body is
+    read into memory and hashed, so use it only for routes taking small
+    JSON bodies, not multipart uploads.
+    """
+
+    def get_route_handler(self) -> Callable:
+        handler = super().get_route_handler()
+        if not self.methods & MUTATING_METHODS:
+            return handler
+
+        async def idempotent_route_handler(request: Request) -> Response:
+            key = request.headers.get(IDEMPOTENCY_HEADER)
+            if not key:
+                return await handler(request)
+            return await run_idempotent(request, key, handler)
+
+        return idempotent_route_handler
@@ -0,0 +1,110 @@
+"""In-process response cache for hot read endpoints
+
+Entries are keyed by route, query string and the version of the data
+they were built from (see app.core.etag), and bounded by an LRU size and
+a TTL. Nothing is invalidated explicitly: a write changes the versions of
+the resources it touched, so requests for them build a new key, while
+entries of other resources stay valid. Outdated entries are never looked
+up again and age out.
+
+The cache is per process, but the versions are read from the database on
+every request, so a worker that did not handle a mutation misses too.
+"""
+import threading
+import time
+from collections import OrderedDict
+from typing import Any, Optional
+
+from fastapi import Request, Response
+
+from app.core.config import settings
+from app.core.responses import model_response
+
+
+class ResponseCache:
+    """LRU + TTL cache of serialized JSON bodies, keyed by the data version they were built from"""
+
+    def __init__(self, max_entries: int, ttl_seconds: float, enabled: bool = True):
+        self.max_entries = max_entries
+        self.ttl_seconds = ttl_seconds
+        self.enabled = enabled
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self._entries: "OrderedDict[str, tuple[float, bytes]]" = OrderedDict()
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def key_for(request: Request, variant: Any = None) -> str:
+        query = "&".join(sorted(request.url.query.split("&"))) if request.url.query else ""
+        return f"{request.url.path}?{query}#{variant}"
+
+    def get(self, key: str) -> Optional[bytes]:
+        if not self.enabled:
+            return None
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None:
+                expires_at, body = entry
+                if expires_at > time.monotonic():
+                    self._entries.move_to_end(key)
+                    self.hits += 1
+                    return body
+                del self._entries[key]
+                self.evictions += 1
+            self.misses += 1
+            return None
+
+    def set(self, key: str, body: bytes):
+        if not self.enabled:
+            return
+        with self._lock:
+            self._entries[key] = (time.monotonic() + self.ttl_seconds, body)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+                self.evictions += 1
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {
+                "enabled": self.enabled,
+                "entries": len(self._entries),
+                "max_entries": self.max_entries,
+                "ttl_seconds": self.ttl_seconds,
+                "hits": self.hits,
+                "misses": self.misses,
+                "evictions": self.evictions,
+            }
+
+    def cached_response(self, request: Request, variant: Any = None) -> Optional[Response]:
+        """The cached response for this request, or None on a miss
+
+        ``variant`` becomes part of the key, e.g. the data version the
+        response was built from.
+        """
+        body = self.get(self.key_for(request, variant))
+        if body is None:
+            return None
+        return Response(content=body, media_type="application/json")
+
+    def store_response(self, request: Request, content: Any, variant: Any = None) -> Response:
+        """Serialize ``content`` once, cache the bytes and return them as the response
+
+        ``content`` is a response model or plain JSON data, read in the same
+        transaction as the version passed as ``variant``.
+        """
+        response = model_response(content)
+        self.set(self.key_for(request, variant), response.body)
+        return response
+
+
+response_cache = ResponseCache(
+    max_entries=settings.response_cache_max_entries,
+    ttl_seconds=settings.response_cache_ttl_seconds,
+    enabled=settings.response_cache_enabled
+)
@@ -0,0 +1,21 @@
+"""The one clock the application stamps rows with: naive UTC
+
+Every timestamp the app writes (star records, redemptions, idempotency
+leases and expiry, report jobs, created_at/updated_at) comes from
+``utc_now()`` rather than ``datetime.now()`` or the server's NOW(), and
+every "today" (rollup days, default chart ranges, ages) from
+``utc_today()``. SQLite's CURRENT_TIMESTAMP is UTC as well, and MySQL
+sessions are switched to UTC in ``app.core.database``, so server defaults
+agree with the application.
+"""
+from datetime import date, datetime, timezone
+
+
+def utc_now() -> datetime:
+    """Now as a naive UTC datetime"""
+    return datetime.now(timezone.utc).replace(tzinfo=None)
+
+
+def utc_today() -> date:
+    """Today's date in UTC"""
+    return utc_now().date()
@@ -1,7 +1,34 @@
-from sqlalchemy import create_engine
+from typing import Optional
+
+from sqlalchemy import create_engine, event, inspect, text
+from sqlalchemy.engine import make_url
+from sqlalchemy.ext.asyncio import AsyncSession, async_sessionmaker, create_async_engine
 from sqlalchemy.ext.declarative import declarative_base
-from sqlalchemy.orm import sessionmaker
+from sqlalchemy.orm import Session, sessionmaker
+from sqlalchemy.pool import AsyncAdaptedQueuePool, QueuePool, StaticPool
 from app.core.config import settings
+from app.core.metrics import timed_pool
+from app.core.slow_queries import SlowQueryRecorder
+
+# Async drivers used by the request handlers, keyed by database backend
+ASYNC_DRIVERS = {
+    "sqlite": "aiosqlite",
+    "mysql": "aiomysql",
+}
+
+
+def get_async_database_url(database_url: str) -> str:
+    """Translate a sync database URL (e.g. mysql+pymysql) to its async driver equivalent"""
+    url = make_url(database_url)
+    backend = url.get_backend_name()
+    if url.get_driver_name() == ASYNC_DRIVERS.get(backend):
+        return database_url
+    if backend not in ASYNC_DRIVERS:
+        raise ValueError(f"No async driver configured for database backend '{backend}'")
+    return url.set(drivername=f"{backend}+{ASYNC_DRIVERS[backend]}").render_as_string(hide_password=False)
+
+
+async_database_url = settings.async_database_url or get_async_database_url(settings.database_url)
 
 # Create engine with different settings based on database type
 if settings.database_url.startswith("sqlite"):
@@ -9,21 +36,69 @@ if settings.database_url.startswith("sqlite"):
     engine = create_engine(
         settings.database_url,
         connect_args={"check_same_thread": False},  # Needed for SQLite
-        echo=settings.debug
+        echo=settings.sql_echo
     )
+    if make_url(async_database_url).database in (None, "", ":memory:"):
+        # In-memory databases only exist on a single connection
+        async_engine = create_async_engine(
+            async_database_url,
+            poolclass=StaticPool,
+            echo=settings.sql_echo
+        )
+    else:
+        async_engine = create_async_engine(
+            async_database_url,
+            poolclass=timed_pool(AsyncAdaptedQueuePool, "async"),
+            pool_size=settings.db_pool_size,
+            max_overflow=settings.db_max_overflow,
+            echo=settings.sql_echo
+        )
 else:
     # MySQL/PostgreSQL specific settings
     engine = create_engine(
         settings.database_url,
+        poolclass=timed_pool(QueuePool, "sync"),
         pool_pre_ping=True,
-        pool_size=10,
-        max_overflow=20,
-        echo=settings.debug
+        pool_size=settings.db_pool_size,
+        max_overflow=settings.db_max_overflow,
+        echo=settings.sql_echo
     )
+    async_engine = create_async_engine(
+        async_database_url,
+        poolclass=timed_pool(AsyncAdaptedQueuePool, "async"),
+        pool_pre_ping=True,
+        pool_size=settings.db_pool_size,
+        max_overflow=settings.db_max_overflow,
+        echo=settings.sql_echo
+    )
+
+    if make_url(settings.database_url).get_backend_name() == "mysql":
+        # NOW() server defaults stamp in the session time zone; keep them on
+        # the application's clock (app.core.clock) instead of the server's
+        @event.listens_for(engine, "connect")
+        @event.listens_for(async_engine.sync_engine, "connect")
+        def _use_utc_session(dbapi_connection, connection_record):
+            cursor = dbapi_connection.cursor()
+            cursor.execute("SET time_zone = '+00:00'")
+            cursor.close()
 
-# Create SessionLocal class
+# Statements slower than SLOW_QUERY_MS are logged with their query plan
+SlowQueryRecorder(engine)
+SlowQueryRecorder(async_engine.sync_engine)
+
+# Create SessionLocal class (used by scripts such as init_db.py and alembic)
 SessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine)
 
+# Create AsyncSessionLocal class (used by the API request handlers)
+# expire_on_commit=False keeps loaded attributes usable after commit without
+# triggering implicit IO, which AsyncSession does not allow
+AsyncSessionLocal = async_sessionmaker(
+    bind=async_engine,
+    class_=AsyncSession,
+    autoflush=False,
+    expire_on_commit=False
+)
+
 # Create Base class
 Base = declarative_base()
 
@@ -34,3 +109,62 @@ def get_db():
         yield db
     finally:
         db.close()
+
+# Dependency to get async DB session
+async def get_async_db():
+    async with AsyncSessionLocal() as db:
+        yield db
+
+def _written_scope(operation: str, table: str) -> Optional[str]:
+    """The data_versions scope a write changes; updates of a child row bump children.version"""
+    if table in ("rewards", "reward_children"):
+        return "rewards"
+    if table == "children" and operation != "update":
+        return "children"
+    return None
+
+
+def _track_write(session, operation: str, table: str):
+    session.info.setdefault("written_tables", set()).add(table)
+    scope = _written_scope(operation, table)
+    if scope is not None:
+        session.info.setdefault("written_scopes", set()).add(scope)
+
+
+@event.listens_for(Session, "after_flush")
+def _track_flush_writes(session, flush_context):
+    for operation, objects in (("insert", session.new), ("update", session.dirty), ("delete", session.deleted)):
+        for obj in objects:
+            state = inspect(obj)
+            _track_write(session, operation, state.mapper.local_table.name)
+            # Many-to-many collections write their association table
+            for relationship in state.mapper.relationships:
+                if relationship.secondary is not None and (
+                    operation == "delete" or state.attrs[relationship.key].history.has_changes()
+                ):
+                    _track_write(session, operation, relationship.secondary.name)
+
+
+@event.listens_for(Session, "do_orm_execute")
+def _track_statement_writes(orm_execute_state):
+    for operation in ("insert", "update", "delete"):
+        if getattr(orm_execute_state, f"is_{operation}"):
+            _track_write(orm_execute_state.session, operation, orm_execute_state.statement.table.name)
+
+
+@event.listens_for(Session, "before_commit")
+def _bump_data_versions(session):
+    # Flush first so pending ORM changes are tracked too. Bumping in the same
+    # transaction means a reader never sees new data paired with an old version
+    # (the versions drive ETags); scopes are bumped in a fixed order so two
+    # writers never wait on each other's rows
+    session.flush()
+    for scope in sorted(session.info.get("written_scopes", ())):
+        session.execute(text("UPDATE data_versions SET version = version + 1 WHERE scope = :scope"), {"scope": scope})
+
+
+@event.listens_for(Session, "after_commit")
+@event.listens_for(Session, "after_rollback")
+def _discard_tracked_writes(session):
+    session.info.pop("written_tables", None)
+    session.info.pop("written_scopes", None)
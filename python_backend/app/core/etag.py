@@ -0,0 +1,91 @@
+"""Strong ETags derived from per-resource change sequences
+
+Every UPDATE of a child row increments its ``children.version``, and
+transactions that create or delete children, or write rewards or their
+participants, increment the ``children`` or ``rewards`` scope of
+``data_versions`` (see ``_bump_data_versions`` in app.core.database).
+A response's version combines only the sequences its payload depends on,
+read in one statement, so a GET can be answered with ``304 Not Modified``
+before any of its payload is queried or built, and a star change of one
+child leaves the ETags of unrelated children alone.
+"""
+from typing import Optional, Sequence
+
+from fastapi import Request, Response
+from sqlalchemy import func, select
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from app.models import Child, DataVersion
+from app.models.reward import reward_children
+
+
+def scope_version(scope: str):
+    return select(DataVersion.version).where(DataVersion.scope == scope).scalar_subquery()
+
+
+def child_versions(*criteria):
+    """Sum of the row versions of the children matching ``criteria``"""
+    return select(func.coalesce(func.sum(Child.version), 0)).where(*criteria).scalar_subquery()
+
+
+async def read_version(db: AsyncSession, *sequences) -> str:
+    row = (await db.execute(select(*sequences))).one()
+    return ".".join(str(value or 0) for value in row)
+
+
+async def children_version(db: AsyncSession) -> str:
+    """Version of the children list: its members and their rows"""
+    return await read_version(db, scope_version("children"), child_versions())
+
+
+async def rewards_version(db: AsyncSession) -> str:
+    """Version of the rewards list: the rewards and their participants' rows"""
+    participants = select(reward_children.c.child_id)
+    return await read_version(db, scope_version("rewards"), child_versions(Child.id.in_(participants)))
+
+
+async def star_records_version(db: AsyncSession, child_ids: Optional[Sequence[int]] = None) -> str:
+    """Version of the star records of ``child_ids`` (all children by default)
+
+    Records are only written together with their child's balance, so the
+    children's row versions cover them.
+    """
+    criteria = [Child.id.in_(child_ids)] if child_ids else []
+    return await read_version(db, scope_version("children"), child_versions(*criteria))
+
+
+async def child_version(db: AsyncSession, child_id: int) -> str:
+    """Version of a child's detail: its row, its rewards and their participants' rows"""
+    rewards = select(reward_children.c.reward_id).where(reward_children.c.child_id == child_id)
+    participants = select(reward_children.c.child_id).where(reward_children.c.reward_id.in_(rewards))
+    return await read_version(
+        db,
+        # Ids can be reused after a delete, which bumps the children scope
+        scope_version("children"),
+        select(Child.version).where(Child.id == child_id).scalar_subquery(),
+        scope_version("rewards"),
+        child_versions(Child.id.in_(participants)),
+    )
+
+
+def make_etag(scope: str, version: str) -> str:
+    return f'"{scope}-v{version}"'
+
+
+def etag_matches(request: Request, etag: str) -> bool:
+    """Whether the request's If-None-Match already names ``etag``"""
+    header = request.headers.get("if-none-match")
+    if not header:
+        return False
+    if header.strip() == "*":
+        return True
+    # If-None-Match uses the weak comparison, so a W/ prefix still matches
+    candidates = (candidate.strip() for candidate in header.split(","))
+    return etag in (candidate[2:] if candidate.startswith("W/") else candidate for candidate in candidates)
+
+
+def not_modified_response(request: Request, etag: str) -> Optional[Response]:
+    """A 304 response if the client's copy is current, else None"""
+    if etag_matches(request, etag):
+        return Response(status_code=304, headers={"ETag": etag})
+    return None
@@ -1,36 +1,285 @@
+"""Loguru configuration
+
+By default logs go to the console and to daily text files. With
+``LOG_JSON=true`` the all-levels file sink is replaced by
+``BatchingJsonSink``: the logging call only puts the record on a bounded
+queue, and a background thread serializes records to compact JSON lines
+and writes them in batches, so request handlers never wait on the disk.
+When the queue is full, records below WARNING are dropped (and counted)
+unless ``LOG_OVERFLOW=block``, in which case the caller waits for room.
+
+High-volume INFO messages can be sampled per route with
+``LOG_SAMPLE_RATES``, e.g. ``{"/api/children/": 0.1}`` keeps one in ten
+INFO and DEBUG records logged while handling that route. Warnings and
+errors are never sampled.
+"""
+import contextvars
+import queue
+import random
 import sys
+import threading
+import time
+import traceback
+from datetime import datetime, timedelta
 from pathlib import Path
+from typing import List, Optional
+
+import orjson
 from loguru import logger
+from starlette.types import ASGIApp, Receive, Scope, Send
+
+from app.core.config import settings
+
+LOG_DIR = Path(__file__).parent.parent.parent / "logs"
+
+# ASGI scope of the request being handled; routing adds the matched route to it
+_request_scope: contextvars.ContextVar[Optional[Scope]] = contextvars.ContextVar("request_scope", default=None)
+
+WARNING_LEVEL = 30
+
+_STOP = object()
+
+
+class LogContextMiddleware:
+    """Make the current request visible to log filters and sinks"""
+
+    def __init__(self, app: ASGIApp):
+        self.app = app
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+        token = _request_scope.set(scope)
+        try:
+            await self.app(scope, receive, send)
+        finally:
+            _request_scope.reset(token)
+
+
+def current_route() -> Optional[str]:
+    """Path template of the route handling the current request, e.g. /api/children/{child_id}"""
+    scope = _request_scope.get()
+    if scope is None:
+        return None
+    route = scope.get("route")
+    return getattr(route, "path", None) or scope.get("path")
+
+
+def sample_filter(record) -> bool:
+    """Keep a record, or drop it according to the sample rate of the current route"""
+    if not settings.log_sample_rates or record["level"].no >= WARNING_LEVEL:
+        return True
+    route = current_route()
+    if route is None:
+        return True
+    rate = settings.log_sample_rates.get(route)
+    return rate is None or random.random() < rate
+
+
+class BatchingJsonSink:
+    """Loguru sink writing JSON lines to ``<directory>/app_YYYY-MM-DD.jsonl`` from a background thread
+
+    Files are rotated at midnight and deleted after ``retention_days``.
+    """
+
+    def __init__(
+        self,
+        directory: Path,
+        queue_size: int = 10000,
+        batch_size: int = 256,
+        flush_interval: float = 0.5,
+        overflow: str = "drop",
+        retention_days: int = 30,
+    ):
+        if overflow not in ("drop", "block"):
+            raise ValueError(f"Unknown log overflow policy: {overflow}")
+        self.directory = Path(directory)
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.overflow = overflow
+        self.retention_days = retention_days
+        self.written = 0
+        self.dropped = 0
+        self._reported_dropped = 0
+        self._queue: queue.Queue = queue.Queue(maxsize=queue_size)
+        self._file = None
+        self._file_date = None
+        self._thread = threading.Thread(target=self._run, name="log-writer", daemon=True)
+        self._thread.start()
+
+    def write(self, message):
+        record = message.record
+        entry = {
+            "time": record["time"],
+            "level": record["level"].name,
+            "levelno": record["level"].no,
+            "message": record["message"],
+            "logger": record["name"],
+            "function": record["function"],
+            "line": record["line"],
+            "route": current_route(),
+            "extra": record["extra"],
+            "exception": record["exception"],
+        }
+        if self.overflow == "block" or entry["levelno"] >= WARNING_LEVEL:
+            self._queue.put(entry)
+            return
+        try:
+            self._queue.put_nowait(entry)
+        except queue.Full:
+            # Cheap and lock-free enough: a lost increment only skews the report
+            self.dropped += 1
+
+    def stop(self):
+        """Write everything still queued and close the file; called by ``logger.remove``"""
+        if self._thread.is_alive():
+            self._queue.put(_STOP)
+            self._thread.join()
+
+    def stats(self) -> dict:
+        return {"queued": self._queue.qsize(), "written": self.written, "dropped": self.dropped}
+
+    def _run(self):
+        while True:
+            batch = [self._queue.get()]
+            deadline = time.monotonic() + self.flush_interval
+            while batch[-1] is not _STOP and len(batch) < self.batch_size:
+                timeout = deadline - time.monotonic()
+                if timeout <= 0:
+                    break
+                try:
+                    batch.append(self._queue.get(timeout=timeout))
+                except queue.Empty:
+                    break
+
+            stopping = batch[-1] is _STOP
+            if stopping:
+                batch.pop()
+            try:
+                self._write_batch(batch)
+            except Exception as e:
+                # A sink must not take the application down; report on stderr and go on
+                print(f"Error writing logs: {e}", file=sys.stderr)
+            if stopping:
+                if self._file is not None:
+                    self._file.close()
+                    self._file = None
+                return
+
+    def _write_batch(self, entries: List[dict]):
+        dropped = self.dropped
+        if dropped > self._reported_dropped:
+            entries.append(self._dropped_entry(dropped - self._reported_dropped))
+            self._reported_dropped = dropped
+        if not entries:
+            return
+
+        lines = []
+        for entry in entries:
+            file_date = entry["time"].date()
+            if file_date != self._file_date:
+                if lines:
+                    self._file.write(b"".join(lines))
+                    lines = []
+                self._open(file_date)
+            lines.append(self._serialize(entry))
+        self._file.write(b"".join(lines))
+        self._file.flush()
+        self.written += len(entries)
+
+    def _open(self, file_date):
+        if self._file is not None:
+            self._file.close()
+        self.directory.mkdir(parents=True, exist_ok=True)
+        self._file = open(self.directory / f"app_{file_date:%Y-%m-%d}.jsonl", "ab")
+        self._file_date = file_date
+        self._remove_expired(file_date)
+
+    def _remove_expired(self, today):
+        oldest = f"app_{today - timedelta(days=self.retention_days):%Y-%m-%d}.jsonl"
+        for path in self.directory.glob("app_*.jsonl"):
+            if path.name < oldest:
+                path.unlink(missing_ok=True)
+
+    @staticmethod
+    def _dropped_entry(count: int) -> dict:
+        return {
+            "time": datetime.now().astimezone(),
+            "level": "WARNING",
+            "message": f"Dropped {count} log records: log queue full",
+            "logger": __name__,
+            "function": "write",
+            "line": None,
+        }
+
+    @staticmethod
+    def _serialize(entry: dict) -> bytes:
+        data = {
+            "time": entry["time"].isoformat(timespec="milliseconds"),
+            "level": entry["level"],
+            "message": entry["message"],
+            "logger": entry["logger"],
+            "function": entry["function"],
+            "line": entry["line"],
+        }
+        if entry.get("route"):
+            data["route"] = entry["route"]
+        if entry.get("extra"):
+            data["extra"] = entry["extra"]
+        exception = entry.get("exception")
+        if exception is not None and exception.type is not None:
+            data["exception"] = "".join(
+                traceback.format_exception(exception.type, exception.value, exception.traceback)
+            )
+        return orjson.dumps(data, default=str, option=orjson.OPT_APPEND_NEWLINE)
+
 
 def setup_logging():
     """Configure loguru for both console and file output"""
-    
+
     # Remove default handler
     logger.remove()
-    
+
     # Get logs directory
-    log_dir = Path(__file__).parent.parent.parent / "logs"
+    log_dir = LOG_DIR
     log_dir.mkdir(exist_ok=True)
-    
+
     # Console handler with colored output
     logger.add(
         sys.stdout,
         colorize=True,
         format="<green>{time:YYYY-MM-DD HH:mm:ss}</green> | <level>{level: <8}</level> | <cyan>{name}</cyan>:<cyan>{function}</cyan>:<cyan>{line}</cyan> - <level>{message}</level>",
         level="INFO",
+        filter=sample_filter,
         enqueue=True  # Thread-safe logging
     )
-    
+
     # File handler for all logs
-    logger.add(
-        log_dir / "app_{time:YYYY-MM-DD}.log",
-        rotation="00:00",  # New file every day at midnight
-        retention="30 days",  # Keep logs for 30 days
-        compression="zip",  # Compress old logs
-        format="{time:YYYY-MM-DD HH:mm:ss} | {level: <8} | {name}:{function}:{line} - {message}",
-        level="DEBUG"
-    )
-    
+    if settings.log_json:
+        logger.add(
+            BatchingJsonSink(
+                log_dir,
+                queue_size=settings.log_queue_size,
+                batch_size=settings.log_batch_size,
+                flush_interval=settings.log_flush_interval,
+                overflow=settings.log_overflow
+            ),
+            level="DEBUG",
+            filter=sample_filter
+        )
+    else:
+        logger.add(
+            log_dir / "app_{time:YYYY-MM-DD}.log",
+            rotation="00:00",  # New file every day at midnight
+            retention="30 days",  # Keep logs for 30 days
+            compression="zip",  # Compress old logs
+            format="{time:YYYY-MM-DD HH:mm:ss} | {level: <8} | {name}:{function}:{line} - {message}",
+            level="DEBUG",
+            filter=sample_filter,
+            enqueue=True
+        )
+
     # File handler for error logs only
     logger.add(
         log_dir / "errors_{time:YYYY-MM-DD}.log",
@@ -40,9 +289,10 @@ def setup_logging():
         format="{time:YYYY-MM-DD HH:mm:ss} | {level: <8} | {name}:{function}:{line} - {message}\n{exception}",
         level="ERROR",
         backtrace=True,
-        diagnose=True
+        diagnose=True,
+        enqueue=True
     )
-    
+
     logger.info("Logging system initialized")
-    
+
     return logger
@@ -0,0 +1,386 @@
+"""Request and database metrics, exposed at /metrics in the Prometheus text format
+
+A small in-process registry rather than a client library: counters,
+gauges and fixed-bucket histograms keyed by label values, each updated
+under its own lock, so recording costs a dict lookup and a bisect.
+
+``MetricsMiddleware`` times every HTTP request and labels it with the
+path template of the matched route (``/api/children/{child_id}``, not the
+raw path), keeping the number of series bounded. SQL statements are
+timed with cursor events (``instrument_engine``) and attributed to the
+request running them through a context variable, which SQLAlchemy's
+async layer carries into the greenlets running the sync engine code.
+Other modules observe those counters through ``on_statement`` and
+``on_request_finished`` hooks (e.g. the query budgets of
+``app.core.query_budget``).
+
+Pool gauges are read from the pools when /metrics is scraped. Checkout
+wait time is measured by ``timed_pool``, a pool subclass the engines in
+``app.core.database`` are created with; it includes opening a new
+connection when the pool has none idle.
+"""
+import contextvars
+import threading
+from abc import ABC, abstractmethod
+import time
+from bisect import bisect_left
+from typing import Callable, Dict, List, Optional, Sequence, Tuple, Type
+
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+from sqlalchemy.pool import Pool
+from starlette.types import ASGIApp, Message, Receive, Scope, Send
+
+CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+DB_LATENCY_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 1.0)
+STATEMENT_COUNT_BUCKETS = (0, 1, 2, 5, 10, 20, 50, 100)
+
+
+def _escape(value: str) -> str:
+    return str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _format_labels(names: Sequence[str], values: Sequence[str], extra: str = "") -> str:
+    pairs = [f'{name}="{_escape(value)}"' for name, value in zip(names, values)]
+    if extra:
+        pairs.append(extra)
+    return "{" + ",".join(pairs) + "}" if pairs else ""
+
+
+def _format_value(value: float) -> str:
+    if value == float("inf"):
+        return "+Inf"
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+class Metric(ABC):
+    kind = ""
+
+    def __init__(self, name: str, documentation: str, labels: Sequence[str] = ()):
+        self.name = name
+        self.documentation = documentation
+        self.label_names = tuple(labels)
+        self._lock = threading.Lock()
+
+    def header(self) -> List[str]:
+        return [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} {self.kind}"]
+
+    @abstractmethod
+    def render(self) -> List[str]:
+        """Sample lines in the text format, without the header"""
+
+    @abstractmethod
+    def clear(self):
+        """Drop every recorded value"""
+
+
+class Counter(Metric):
+    kind = "counter"
+
+    def __init__(self, name: str, documentation: str, labels: Sequence[str] = ()):
+        super().__init__(name, documentation, labels)
+        self._values: Dict[Tuple[str, ...], float] = {}
+
+    def inc(self, *labels: str, amount: float = 1):
+        with self._lock:
+            self._values[labels] = self._values.get(labels, 0) + amount
+
+    def value(self, *labels: str) -> float:
+        return self._values.get(labels, 0)
+
+    def render(self) -> List[str]:
+        with self._lock:
+            values = list(self._values.items())
+        return [f"{self.name}{_format_labels(self.label_names, key)} {_format_value(value)}" for key, value in values]
+
+    def clear(self):
+        with self._lock:
+            self._values.clear()
+
+
+class Gauge(Counter):
+    """A value that goes up and down, or is computed by ``collect`` at scrape time"""
+
+    kind = "gauge"
+
+    def __init__(
+        self,
+        name: str,
+        documentation: str,
+        labels: Sequence[str] = (),
+        collect: Optional[Callable[[], Dict[Tuple[str, ...], float]]] = None,
+    ):
+        super().__init__(name, documentation, labels)
+        self.collect = collect
+
+    def dec(self, *labels: str, amount: float = 1):
+        self.inc(*labels, amount=-amount)
+
+    def render(self) -> List[str]:
+        if self.collect is not None:
+            with self._lock:
+                self._values = dict(self.collect())
+        return super().render()
+
+
+class Histogram(Metric):
+    kind = "histogram"
+
+    def __init__(self, name: str, documentation: str, labels: Sequence[str] = (), buckets: Sequence[float] = LATENCY_BUCKETS):
+        super().__init__(name, documentation, labels)
+        self.buckets = tuple(buckets)
+        # label values -> [per-bucket counts (last one is +Inf), sum]
+        self._values: Dict[Tuple[str, ...], list] = {}
+
+    def observe(self, value: float, *labels: str):
+        index = bisect_left(self.buckets, value)
+        with self._lock:
+            entry = self._values.get(labels)
+            if entry is None:
+                entry = self._values[labels] = [[0] * (len(self.buckets) + 1), 0.0]
+            entry[0][index] += 1
+            entry[1] += value
+
+    def count(self, *labels: str) -> int:
+        entry = self._values.get(labels)
+        return sum(entry[0]) if entry else 0
+
+    def sum(self, *labels: str) -> float:
+        entry = self._values.get(labels)
+        return entry[1] if entry else 0.0
+
+    def render(self) -> List[str]:
+        with self._lock:
+            values = [(key, list(counts), total) for key, (counts, total) in self._values.items()]
+        lines = []
+        for key, counts, total in values:
+            cumulative = 0
+            for bound, count in zip(self.buckets + (float("inf"),), counts):
+                cumulative += count
+                labels = _format_labels(self.label_names, key, f'le="{_format_value(float(bound))}"')
+                lines.append(f"{self.name}_bucket{labels} {cumulative}")
+            labels = _format_labels(self.label_names, key)
+            lines.append(f"{self.name}_sum{labels} {_format_value(total)}")
+            lines.append(f"{self.name}_count{labels} {cumulative}")
+        return lines
+
+    def clear(self):
+        with self._lock:
+            self._values.clear()
+
+
+class Registry:
+    def __init__(self):
+        self.metrics: List[Metric] = []
+
+    def register(self, metric: Metric) -> Metric:
+        self.metrics.append(metric)
+        return metric
+
+    def render(self) -> str:
+        lines = []
+        for metric in self.metrics:
+            lines.extend(metric.header())
+            lines.extend(metric.render())
+        return "\n".join(lines) + "\n"
+
+    def clear(self):
+        for metric in self.metrics:
+            metric.clear()
+
+
+registry = Registry()
+
+http_requests = registry.register(Counter(
+    "http_requests_total", "HTTP requests handled, by route template and status", ("method", "route", "status")
+))
+http_request_duration = registry.register(Histogram(
+    "http_request_duration_seconds", "Time to handle an HTTP request", ("method", "route")
+))
+http_requests_in_flight = registry.register(Gauge(
+    "http_requests_in_flight", "HTTP requests currently being handled"
+))
+http_request_db_statements = registry.register(Histogram(
+    "http_request_db_statements", "SQL statements executed per HTTP request", ("method", "route"),
+    buckets=STATEMENT_COUNT_BUCKETS
+))
+http_request_db_duration = registry.register(Histogram(
+    "http_request_db_duration_seconds", "Total SQL execution time per HTTP request", ("method", "route"),
+    buckets=DB_LATENCY_BUCKETS
+))
+db_statement_duration = registry.register(Histogram(
+    "db_statement_duration_seconds", "SQL statement execution time", ("engine",), buckets=DB_LATENCY_BUCKETS
+))
+db_pool_checkout_wait = registry.register(Histogram(
+    "db_pool_checkout_wait_seconds", "Time spent waiting for a pooled connection", ("engine",),
+    buckets=DB_LATENCY_BUCKETS
+))
+
+# Pools instrumented by timed_pool, by engine name, for the scrape-time gauges
+_pools: Dict[str, Pool] = {}
+
+
+def _pool_values(read: Callable[[Pool], float]) -> Callable[[], Dict[Tuple[str, ...], float]]:
+    def collect():
+        return {(name,): read(pool) for name, pool in list(_pools.items())}
+    return collect
+
+
+def _saturation(pool: Pool) -> float:
+    capacity = pool.size() + max(pool._max_overflow, 0)
+    return pool.checkedout() / capacity if capacity else 0.0
+
+
+registry.register(Gauge(
+    "db_pool_size", "Configured pool size", ("engine",), collect=_pool_values(lambda pool: pool.size())
+))
+registry.register(Gauge(
+    "db_pool_checked_out", "Connections currently checked out", ("engine",),
+    collect=_pool_values(lambda pool: pool.checkedout())
+))
+registry.register(Gauge(
+    "db_pool_overflow", "Connections open beyond the pool size", ("engine",),
+    collect=_pool_values(lambda pool: max(pool.overflow(), 0))
+))
+registry.register(Gauge(
+    "db_pool_saturation", "Checked out connections / (pool size + max overflow)", ("engine",),
+    collect=_pool_values(_saturation)
+))
+
+
+class RequestStats:
+    """SQL work done by one request; ``shapes`` counts runs of each statement text"""
+
+    __slots__ = ("scope", "statements", "db_time", "shapes")
+
+    def __init__(self, scope: Optional[Scope] = None):
+        self.scope = scope
+        self.statements = 0
+        self.db_time = 0.0
+        self.shapes: Dict[str, int] = {}
+
+
+_request_stats: contextvars.ContextVar[Optional[RequestStats]] = contextvars.ContextVar("request_stats", default=None)
+
+# Called with a request's stats after each statement it runs, and once it
+# finished along with whether its response had started
+_statement_hooks: List[Callable[[RequestStats], None]] = []
+_request_finished_hooks: List[Callable[[RequestStats, bool], None]] = []
+
+
+def on_statement(hook: Callable[[RequestStats], None]) -> Callable[[RequestStats], None]:
+    """Register ``hook`` to run after every SQL statement of a request"""
+    _statement_hooks.append(hook)
+    return hook
+
+
+def on_request_finished(hook: Callable[[RequestStats, bool], None]) -> Callable[[RequestStats, bool], None]:
+    """Register ``hook`` to run when a request finished"""
+    _request_finished_hooks.append(hook)
+    return hook
+
+
+def current_request_stats() -> Optional[RequestStats]:
+    """SQL counters of the request being handled, or None outside a request"""
+    return _request_stats.get()
+
+
+def route_label(scope: Scope) -> str:
+    """Path template of the route that handled ``scope``, or its mount point"""
+    route = scope.get("route")
+    if route is not None:
+        return route.path
+    if scope.get("root_path"):
+        # Mounted apps (e.g. /storage) are counted as a whole
+        return scope["root_path"]
+    return "unmatched"
+
+
+class MetricsMiddleware:
+    """Count and time HTTP requests, with the SQL work each one did"""
+
+    def __init__(self, app: ASGIApp):
+        self.app = app
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        status = 500
+        response_started = False
+
+        async def send_with_status(message: Message):
+            nonlocal status, response_started
+            if message["type"] == "http.response.start":
+                status = message["status"]
+                response_started = True
+            await send(message)
+
+        stats = RequestStats(scope)
+        token = _request_stats.set(stats)
+        http_requests_in_flight.inc()
+        started = time.perf_counter()
+        try:
+            await self.app(scope, receive, send_with_status)
+        finally:
+            elapsed = time.perf_counter() - started
+            http_requests_in_flight.dec()
+            _request_stats.reset(token)
+            method, route = scope["method"], route_label(scope)
+            http_requests.inc(method, route, str(status))
+            http_request_duration.observe(elapsed, method, route)
+            http_request_db_statements.observe(stats.statements, method, route)
+            http_request_db_duration.observe(stats.db_time, method, route)
+            for hook in _request_finished_hooks:
+                hook(stats, response_started)
+
+
+def instrument_engine(engine: Engine, name: str):
+    """Time every SQL statement run through ``engine`` (for an AsyncEngine, pass its ``sync_engine``)"""
+
+    @event.listens_for(engine, "before_cursor_execute")
+    def _start_timer(conn, cursor, statement, parameters, context, executemany):
+        if context is not None:
+            context._metrics_started = time.perf_counter()
+
+    @event.listens_for(engine, "after_cursor_execute")
+    def _stop_timer(conn, cursor, statement, parameters, context, executemany):
+        started = getattr(context, "_metrics_started", None)
+        if started is None:
+            return
+        elapsed = time.perf_counter() - started
+        db_statement_duration.observe(elapsed, name)
+        stats = _request_stats.get()
+        if stats is not None:
+            stats.statements += 1
+            stats.db_time += elapsed
+            stats.shapes[statement] = stats.shapes.get(statement, 0) + 1
+            for hook in _statement_hooks:
+                hook(stats)
+
+
+def timed_pool(pool_class: Type[Pool], name: str) -> Type[Pool]:
+    """``pool_class`` recording checkout wait time and reporting its gauges as engine ``name``
+
+    The class, not the instance, is instrumented because ``Engine.dispose``
+    replaces the pool with a new instance of the same class.
+    """
+
+    class TimedPool(pool_class):
+        def __init__(self, *args, **kwargs):
+            super().__init__(*args, **kwargs)
+            _pools[name] = self
+
+        def connect(self):
+            started = time.perf_counter()
+            try:
+                return super().connect()
+            finally:
+                db_pool_checkout_wait.observe(time.perf_counter() - started, name)
+
+    TimedPool.__name__ = f"Timed{pool_class.__name__}"
+    TimedPool.__qualname__ = TimedPool.__name__
+    return TimedPool
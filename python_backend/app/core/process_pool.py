@@ -0,0 +1,58 @@
+"""Lazily started process pools for CPU-bound work
+
+A worker that dies (killed for memory, or a crash in a C extension on a
+hostile input) breaks a ``ProcessPoolExecutor`` for good: every later
+submit raises ``BrokenProcessPool``. ``WorkerPool.run`` replaces a broken
+pool and retries the call once on the fresh one, so one bad job cannot
+stop the work of the whole process.
+"""
+import asyncio
+import multiprocessing
+import threading
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from typing import Any, Callable, Optional
+
+from loguru import logger
+
+
+class WorkerPool:
+    """A ``ProcessPoolExecutor`` started on first use and replaced when broken"""
+
+    def __init__(self, name: str, max_workers: Callable[[], int]):
+        self.name = name
+        self.max_workers = max_workers
+        self._executor: Optional[ProcessPoolExecutor] = None
+        self._lock = threading.Lock()
+
+    def executor(self) -> ProcessPoolExecutor:
+        with self._lock:
+            if self._executor is None:
+                # spawn: forking the threaded API process is not safe
+                self._executor = ProcessPoolExecutor(
+                    max_workers=self.max_workers(),
+                    mp_context=multiprocessing.get_context("spawn")
+                )
+            return self._executor
+
+    def shutdown(self, executor: Optional[ProcessPoolExecutor] = None):
+        """Stop the pool; with ``executor``, only if it is still the current one"""
+        with self._lock:
+            if self._executor is None or (executor is not None and executor is not self._executor):
+                return
+            executor, self._executor = self._executor, None
+        executor.shutdown(wait=False, cancel_futures=True)
+
+    async def run(self, fn: Callable[..., Any], *args) -> Any:
+        """Run ``fn(*args)`` in a worker process, retrying once on a fresh pool if it broke"""
+        loop = asyncio.get_running_loop()
+        for attempt in (1, 2):
+            executor = self.executor()
+            try:
+                return await loop.run_in_executor(executor, fn, *args)
+            except BrokenProcessPool:
+                # Concurrent callers of the broken pool replace it only once
+                self.shutdown(executor)
+                if attempt == 2:
+                    raise
+                logger.warning(f"A {self.name} worker died; restarting the pool")
@@ -0,0 +1,271 @@
+"""On-demand profiling of single requests
+
+With ``PROFILING_ENABLED=true``, a request carrying an ``X-Profile``
+header or a ``profile`` query parameter (equal to ``PROFILING_TOKEN`` when
+one is configured) is profiled:
+
+- a sampling profiler thread records the event loop thread's stack every
+  ``PROFILING_INTERVAL_MS``; coroutines only show up while they run, so
+  time spent awaiting IO appears as the event loop waiting
+- every SQL statement the request runs is timed
+- tracemalloc is started for the request and the largest allocation
+  differences are kept
+
+The samples are written to ``logs/profiles/<id>.speedscope.json`` (open
+it at https://www.speedscope.app) and the rest to ``<id>.json``; the id
+is returned in the ``X-Profile-Id`` response header and listed by
+``GET /profiles/``. One request is profiled at a time, and the sampler
+also sees other requests running on the loop meanwhile.
+
+When profiling is disabled the middleware and the SQL listeners are not
+installed at all (see main.py), so requests pay nothing for it.
+"""
+import contextvars
+import hmac
+import json
+import sys
+import threading
+import time
+import tracemalloc
+import uuid
+from datetime import datetime
+from pathlib import Path
+from typing import Dict, List, Optional, Tuple
+
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+from starlette.concurrency import run_in_threadpool
+from starlette.datastructures import Headers, QueryParams
+from starlette.types import ASGIApp, Message, Receive, Scope, Send
+
+from app.core.config import settings
+from app.core.logging import LOG_DIR
+from app.core.query_budget import statement_shape
+
+PROFILE_DIR = LOG_DIR / "profiles"
+SPEEDSCOPE_SCHEMA = "https://www.speedscope.app/file-format-schema.json"
+TOP_ALLOCATIONS = 20
+
+_current_profile: contextvars.ContextVar[Optional["RequestProfile"]] = contextvars.ContextVar(
+    "current_profile", default=None
+)
+_profiling = threading.Lock()
+
+
+class StackSampler(threading.Thread):
+    """Samples the stack of one thread at a fixed interval"""
+
+    def __init__(self, thread_id: int, interval: float):
+        super().__init__(name="request-profiler", daemon=True)
+        self.thread_id = thread_id
+        self.interval = interval
+        self.frames: List[dict] = []
+        self.samples: List[List[int]] = []
+        self.weights: List[float] = []
+        self._frame_index: Dict[Tuple[str, str, int], int] = {}
+        self._stopped = threading.Event()
+
+    def run(self):
+        last = time.perf_counter()
+        while not self._stopped.wait(self.interval):
+            frame = sys._current_frames().get(self.thread_id)
+            now = time.perf_counter()
+            if frame is not None:
+                self.samples.append(self._stack(frame))
+                self.weights.append((now - last) * 1000)
+            last = now
+
+    def stop(self):
+        self._stopped.set()
+        self.join()
+
+    def _stack(self, frame) -> List[int]:
+        stack = []
+        while frame is not None:
+            code = frame.f_code
+            key = (code.co_name, code.co_filename, code.co_firstlineno)
+            index = self._frame_index.get(key)
+            if index is None:
+                index = self._frame_index[key] = len(self.frames)
+                self.frames.append({"name": key[0], "file": key[1], "line": key[2]})
+            stack.append(index)
+            frame = frame.f_back
+        stack.reverse()  # speedscope stacks go from the root to the leaf
+        return stack
+
+
+class RequestProfile:
+    def __init__(self, scope: Scope):
+        self.id = f"{datetime.now():%Y%m%d-%H%M%S}-{uuid.uuid4().hex[:8]}"
+        self.scope = scope
+        self.status: Optional[int] = None
+        self.statements: List[dict] = []
+        self.sampler = StackSampler(threading.get_ident(), settings.profiling_interval_ms / 1000)
+        self._started_tracemalloc = False
+        self._snapshot = None
+        self._started = 0.0
+        self.duration_ms = 0.0
+        self.allocations: List[dict] = []
+
+    def start(self):
+        if not tracemalloc.is_tracing():
+            tracemalloc.start()
+            self._started_tracemalloc = True
+        self._snapshot = tracemalloc.take_snapshot()
+        self._started = time.perf_counter()
+        self.sampler.start()
+
+    def stop(self):
+        self.duration_ms = (time.perf_counter() - self._started) * 1000
+        self.sampler.stop()
+        snapshot = tracemalloc.take_snapshot()
+        if self._started_tracemalloc:
+            tracemalloc.stop()
+        filters = [tracemalloc.Filter(False, tracemalloc.__file__)]
+        differences = snapshot.filter_traces(filters).compare_to(self._snapshot.filter_traces(filters), "lineno")
+        self.allocations = [
+            {"location": str(difference.traceback), "size_diff": difference.size_diff, "count_diff": difference.count_diff}
+            for difference in differences[:TOP_ALLOCATIONS]
+            if difference.size_diff
+        ]
+
+    @property
+    def route(self) -> str:
+        route = self.scope.get("route")
+        return getattr(route, "path", None) or self.scope["path"]
+
+    def summary(self) -> dict:
+        return {
+            "id": self.id,
+            "method": self.scope["method"],
+            "path": self.scope["path"],
+            "route": self.route,
+            "status": self.status,
+            "duration_ms": round(self.duration_ms, 3),
+            "samples": len(self.sampler.samples),
+            "sql_statements": len(self.statements),
+            "sql_ms": round(sum(statement["duration_ms"] for statement in self.statements), 3),
+        }
+
+    def speedscope(self) -> dict:
+        return {
+            "$schema": SPEEDSCOPE_SCHEMA,
+            "name": f"{self.scope['method']} {self.scope['path']}",
+            "exporter": settings.app_name,
+            "activeProfileIndex": 0,
+            "shared": {"frames": self.sampler.frames},
+            "profiles": [{
+                "type": "sampled",
+                "name": f"{self.scope['method']} {self.route}",
+                "unit": "milliseconds",
+                "startValue": 0,
+                "endValue": sum(self.sampler.weights),
+                "samples": self.sampler.samples,
+                "weights": self.sampler.weights,
+            }],
+        }
+
+    def save(self, directory: Path):
+        directory.mkdir(parents=True, exist_ok=True)
+        (directory / f"{self.id}.speedscope.json").write_text(json.dumps(self.speedscope()))
+        details = {**self.summary(), "sql": self.statements, "allocations": self.allocations}
+        (directory / f"{self.id}.json").write_text(json.dumps(details, indent=2))
+        _remove_old_profiles(directory, settings.profiling_max_files)
+
+
+def _summary_files(directory: Path) -> List[Path]:
+    """``<id>.json`` files, newest first (ids start with their timestamp)"""
+    paths = [path for path in directory.glob("*.json") if not path.name.endswith(".speedscope.json")]
+    return sorted(paths, reverse=True)
+
+
+def _remove_old_profiles(directory: Path, keep: int):
+    for path in _summary_files(directory)[keep:]:
+        path.unlink(missing_ok=True)
+        path.with_name(path.stem + ".speedscope.json").unlink(missing_ok=True)
+
+
+def list_profiles(directory: Optional[Path] = None) -> List[dict]:
+    """Summaries of the stored profiles, newest first"""
+    directory = directory or PROFILE_DIR
+    profiles = []
+    if not directory.is_dir():
+        return []
+    for path in _summary_files(directory):
+        try:
+            details = json.loads(path.read_text())
+        except (OSError, ValueError):
+            continue
+        profiles.append({key: details.get(key) for key in (
+            "id", "method", "path", "route", "status", "duration_ms", "samples", "sql_statements", "sql_ms"
+        )})
+    return profiles
+
+
+def token_accepted(value: Optional[str]) -> bool:
+    """Whether ``value`` matches PROFILING_TOKEN; anything goes when no token is set"""
+    if not settings.profiling_token:
+        return True
+    return value is not None and hmac.compare_digest(value.encode(), settings.profiling_token.encode())
+
+
+def profile_requested(scope: Scope) -> bool:
+    value = Headers(scope=scope).get("x-profile") or QueryParams(scope.get("query_string", b"")).get("profile")
+    return value is not None and token_accepted(value)
+
+
+class ProfilingMiddleware:
+    """Profile requests that ask for it; only installed when profiling is enabled"""
+
+    def __init__(self, app: ASGIApp, directory: Optional[Path] = None):
+        self.app = app
+        self.directory = directory or PROFILE_DIR
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send):
+        if scope["type"] != "http" or not profile_requested(scope) or not _profiling.acquire(blocking=False):
+            await self.app(scope, receive, send)
+            return
+
+        try:
+            profile = RequestProfile(scope)
+
+            async def send_with_profile_id(message: Message):
+                if message["type"] == "http.response.start":
+                    profile.status = message["status"]
+                    message["headers"] = list(message.get("headers", [])) + [(b"x-profile-id", profile.id.encode())]
+                await send(message)
+
+            token = _current_profile.set(profile)
+            profile.start()
+            try:
+                await self.app(scope, receive, send_with_profile_id)
+            finally:
+                profile.stop()
+                _current_profile.reset(token)
+                await run_in_threadpool(profile.save, self.directory)
+        finally:
+            _profiling.release()
+
+
+def instrument_engine(engine: Engine):
+    """Time the SQL statements of profiled requests run through ``engine``; safe to call repeatedly"""
+    if event.contains(engine, "after_cursor_execute", _stop_timer):
+        return
+    event.listen(engine, "before_cursor_execute", _start_timer)
+    event.listen(engine, "after_cursor_execute", _stop_timer)
+
+
+def _start_timer(conn, cursor, statement, parameters, context, executemany):
+    if context is not None and _current_profile.get() is not None:
+        context._profile_started = time.perf_counter()
+
+
+def _stop_timer(conn, cursor, statement, parameters, context, executemany):
+    started = getattr(context, "_profile_started", None)
+    profile = _current_profile.get()
+    if started is None or profile is None:
+        return
+    profile.statements.append({
+        "statement": statement_shape(statement),
+        "duration_ms": round((time.perf_counter() - started) * 1000, 3),
+    })
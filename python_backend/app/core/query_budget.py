@@ -0,0 +1,112 @@
+"""Per-route SQL statement budgets and N+1 detection
+
+Decorate a route with ``@query_budget(n)`` (below the ``@router`` line) to
+declare how many SQL statements one request may run. Statements are
+counted per request by the cursor events in ``app.core.metrics``, whose
+statement and request-finished hooks run the checks below; when a
+request goes over its budget, ``QUERY_BUDGET_MODE`` decides what happens:
+
+- ``log``: a warning is logged once the request finishes (the default)
+- ``raise``: the statement that exceeds the budget raises
+  ``QueryBudgetExceeded``, so the request fails at the offending call site;
+  what the test suite uses, never meant for deployments
+- ``off``: budgets are ignored
+
+Independently of budgets, an identical statement run
+``N_PLUS_ONE_THRESHOLD`` times or more in one request, typically a lazy
+load or per-row query inside a loop, is logged as a probable N+1.
+"""
+import re
+from typing import Callable, Dict, List, Optional, Tuple
+
+from loguru import logger
+
+from app.core.config import settings
+from app.core.metrics import on_request_finished, on_statement
+
+# Bound IN lists expand to one placeholder per value; (?, ?, ?) and (?) are the same shape
+_PLACEHOLDER_LIST = re.compile(r"(\?|%s|%\(\w+\)s|:\w+)(\s*,\s*(\?|%s|%\(\w+\)s|:\w+))+")
+_WHITESPACE = re.compile(r"\s+")
+
+
+class QueryBudgetExceeded(Exception):
+    """A request ran more SQL statements than its route's ``@query_budget``"""
+
+    def __init__(self, route: str, budget: int, statements: int, repeated: List[Tuple[str, int]]):
+        details = "".join(f"\n  {count} x {shape}" for shape, count in repeated)
+        super().__init__(f"{route} ran {statements} SQL statements, budget is {budget}{details}")
+        self.route = route
+        self.budget = budget
+        self.statements = statements
+
+
+def query_budget(statements: int) -> Callable:
+    """Declare the maximum number of SQL statements a request to this route may run"""
+    def decorator(endpoint: Callable) -> Callable:
+        endpoint.query_budget = statements
+        return endpoint
+    return decorator
+
+
+def budget_mode() -> str:
+    return settings.query_budget_mode or "log"
+
+
+def route_budget(scope) -> Optional[int]:
+    """Budget declared on the endpoint handling ``scope``, if any"""
+    route = scope.get("route") if scope is not None else None
+    return getattr(getattr(route, "endpoint", None), "query_budget", None)
+
+
+def statement_shape(statement: str) -> str:
+    return _PLACEHOLDER_LIST.sub(r"\1, ...", _WHITESPACE.sub(" ", statement).strip())
+
+
+def repeated_statements(statements: Dict[str, int], threshold: int = 2) -> List[Tuple[str, int]]:
+    """(shape, count) of statement shapes run at least ``threshold`` times, most frequent first"""
+    shapes: Dict[str, int] = {}
+    for statement, count in statements.items():
+        shape = statement_shape(statement)
+        shapes[shape] = shapes.get(shape, 0) + count
+    return sorted(((shape, count) for shape, count in shapes.items() if count >= threshold), key=lambda item: -item[1])
+
+
+def _route_name(scope) -> str:
+    route = scope.get("route")
+    return f"{scope.get('method')} {getattr(route, 'path', scope.get('path'))}"
+
+
+@on_statement
+def check_statement(stats):
+    """Raise once a statement takes the request over its budget, in raise mode"""
+    budget = route_budget(stats.scope)
+    if budget is not None and stats.statements > budget and budget_mode() == "raise":
+        raise QueryBudgetExceeded(_route_name(stats.scope), budget, stats.statements, repeated_statements(stats.shapes))
+
+
+@on_request_finished
+def check_request(stats, response_started: bool = True):
+    """Report a finished request that went over its budget or repeated a statement
+
+    In raise mode the budget is checked again here, because route handlers
+    turn most exceptions, including the one raised by ``check_statement``,
+    into error responses. Once the response has started, raising can no
+    longer change it, so the overrun is logged as an error instead.
+    """
+    if stats.scope is None or not stats.statements:
+        return
+    repeated = repeated_statements(stats.shapes, settings.n_plus_one_threshold)
+    for shape, count in repeated:
+        logger.warning(f"Probable N+1 in {_route_name(stats.scope)}: {count} x {shape}")
+
+    budget = route_budget(stats.scope)
+    if budget is None or stats.statements <= budget:
+        return
+    mode = budget_mode()
+    if mode == "log":
+        logger.warning(f"{_route_name(stats.scope)} ran {stats.statements} SQL statements, budget is {budget}")
+    elif mode == "raise":
+        exceeded = QueryBudgetExceeded(_route_name(stats.scope), budget, stats.statements, repeated_statements(stats.shapes))
+        if not response_started:
+            raise exceeded
+        logger.error(str(exceeded))
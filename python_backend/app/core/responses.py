@@ -0,0 +1,24 @@
+"""Fast JSON response helpers
+
+``ORJSONResponse`` is the application's default response class. Hot read
+endpoints go further and return typed response models through
+``model_response``: pydantic-core serializes them to bytes in one pass,
+skipping FastAPI's ``jsonable_encoder`` walk over plain dicts.
+"""
+from typing import Any, Mapping, Optional
+
+from fastapi import Response
+from fastapi.responses import ORJSONResponse
+from pydantic_core import to_json
+
+__all__ = ["ORJSONResponse", "model_response"]
+
+
+def model_response(content: Any, status_code: int = 200, headers: Optional[Mapping[str, str]] = None) -> Response:
+    """Serialize a response model (or plain JSON data) with pydantic-core"""
+    return Response(
+        content=to_json(content),
+        status_code=status_code,
+        headers=headers,
+        media_type="application/json"
+    )
@@ -0,0 +1,134 @@
+"""Slow statement log with automatic query plans
+
+Statements running longer than ``SLOW_QUERY_MS`` are logged with their
+normalized SQL, the types of their parameters (never the values), the
+duration and the route of the request that ran them. The first time a
+statement shape is slow, its plan is captured too (``EXPLAIN QUERY PLAN``
+on SQLite, ``EXPLAIN`` elsewhere) and any full table scan in it is called
+out, e.g. ``full scan of star_records``.
+
+The plan is read through a separate DBAPI cursor on the same connection,
+inside the cursor event, so it sees the same transaction and bypasses the
+engine events. That costs the slow request one more round trip, once per
+shape.
+"""
+import threading
+import time
+from collections import OrderedDict
+from typing import Any, List, Optional
+
+from loguru import logger
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+
+from app.core.config import settings
+from app.core.logging import current_route
+from app.core.query_budget import statement_shape
+
+# Statement shapes whose plan was already captured; bounded so ad-hoc SQL cannot grow it forever
+MAX_EXPLAINED_SHAPES = 1000
+
+EXPLAINABLE = ("SELECT", "WITH", "UPDATE", "DELETE")
+
+
+def parameters_shape(parameters: Any, executemany: bool = False) -> str:
+    """Types of the bound parameters, e.g. ``(int, str)`` or ``{child_id: int}``"""
+    if executemany:
+        rows = list(parameters or [])
+        return f"{len(rows)} x {parameters_shape(rows[0])}" if rows else "[]"
+    if isinstance(parameters, dict):
+        return "{" + ", ".join(f"{key}: {type(value).__name__}" for key, value in parameters.items()) + "}"
+    if isinstance(parameters, (list, tuple)):
+        # Runs of one type, e.g. an expanded IN list, collapse to "int x 500"
+        runs = []
+        for value in parameters:
+            name = type(value).__name__
+            if runs and runs[-1][0] == name:
+                runs[-1][1] += 1
+            else:
+                runs.append([name, 1])
+        return "(" + ", ".join(name if count == 1 else f"{name} x {count}" for name, count in runs) + ")"
+    return "()"
+
+
+def full_scans(dialect: str, columns: List[str], rows: List[tuple]) -> List[str]:
+    """Tables a query plan reads in full"""
+    tables = []
+    for row in rows:
+        values = dict(zip(columns, row))
+        if dialect == "sqlite":
+            detail = str(values.get("detail", ""))
+            if detail.startswith("SCAN ") and "INDEX" not in detail:
+                tables.append(detail.split()[1])
+        elif dialect == "mysql":
+            if values.get("type") == "ALL":
+                tables.append(str(values.get("table")))
+        else:
+            plan = str(row[0])
+            if "Seq Scan on " in plan:
+                tables.append(plan.split("Seq Scan on ", 1)[1].split()[0])
+    return tables
+
+
+class SlowQueryRecorder:
+    """Cursor event listeners logging statements slower than the threshold"""
+
+    def __init__(self, engine: Engine):
+        self.dialect = engine.dialect.name
+        self.explain_prefix = "EXPLAIN QUERY PLAN " if self.dialect == "sqlite" else "EXPLAIN "
+        self._explained: "OrderedDict[str, None]" = OrderedDict()
+        self._lock = threading.Lock()
+        event.listen(engine, "before_cursor_execute", self.before_cursor_execute)
+        event.listen(engine, "after_cursor_execute", self.after_cursor_execute)
+
+    def before_cursor_execute(self, conn, cursor, statement, parameters, context, executemany):
+        if context is not None:
+            context._slow_query_started = time.perf_counter()
+
+    def after_cursor_execute(self, conn, cursor, statement, parameters, context, executemany):
+        started = getattr(context, "_slow_query_started", None)
+        if started is None or settings.slow_query_ms is None:
+            return
+        elapsed_ms = (time.perf_counter() - started) * 1000
+        if elapsed_ms < settings.slow_query_ms:
+            return
+
+        shape = statement_shape(statement)
+        logger.warning(
+            f"Slow query ({elapsed_ms:.1f} ms) in {current_route() or 'no request'}: {shape} "
+            f"params={parameters_shape(parameters, executemany)}"
+        )
+        if settings.slow_query_explain and not executemany and self._first_time(shape):
+            self.explain(conn, statement, parameters, shape)
+
+    def _first_time(self, shape: str) -> bool:
+        with self._lock:
+            if shape in self._explained:
+                return False
+            self._explained[shape] = None
+            if len(self._explained) > MAX_EXPLAINED_SHAPES:
+                self._explained.popitem(last=False)
+            return True
+
+    def explain(self, conn, statement: str, parameters, shape: str) -> Optional[List[tuple]]:
+        """Log the plan of ``statement``; returns its rows, or None if it could not be explained"""
+        if not statement.lstrip().upper().startswith(EXPLAINABLE):
+            return None
+        cursor = None
+        try:
+            cursor = conn.connection.cursor()
+            cursor.execute(self.explain_prefix + statement, parameters)
+            columns = [column[0] for column in cursor.description or ()]
+            rows = [tuple(row) for row in cursor.fetchall()]
+        except Exception as e:
+            logger.debug(f"Could not explain {shape}: {e}")
+            return None
+        finally:
+            if cursor is not None:
+                cursor.close()
+
+        plan = "\n".join("  " + " | ".join(str(value) for value in row) for row in rows)
+        scans = full_scans(self.dialect, columns, rows)
+        summary = f" (full scan of {', '.join(scans)})" if scans else ""
+        logger.warning(f"Query plan for {shape}{summary}:\n{plan}")
+        return rows
@@ -0,0 +1,239 @@
+"""Cache-friendly serving of public/storage
+
+Blobs and their variants are named after their content hash and never
+change, so they are sent with a year-long ``immutable`` Cache-Control and
+an ETag derived from the hash; browsers then never revalidate them. Files
+outside the content-addressed store (uploads predating it) must be
+revalidated, which conditional GET keeps cheap.
+
+Responses honour ``If-None-Match`` / ``If-Modified-Since``, single
+``Range`` requests (with ``If-Range``) and precompressed ``.br`` / ``.gz``
+siblings. When ``STORAGE_ACCEL_REDIRECT_PREFIX`` is set, the body is not
+sent at all: an ``X-Accel-Redirect`` header hands the transfer to nginx
+(see the internal location in nginx.conf), which then also takes care of
+ranges and conditional requests. File system checks run in a worker
+thread, like StaticFiles' own lookups, so they never block the event loop.
+"""
+import os
+import re
+import stat
+from email.utils import parsedate_to_datetime
+from mimetypes import guess_type
+from pathlib import Path
+from typing import List, Optional, Tuple
+from urllib.parse import quote
+
+import anyio
+from fastapi import Request, Response
+from starlette.responses import FileResponse
+from starlette.staticfiles import NotModifiedResponse, StaticFiles
+from starlette.types import Receive, Scope, Send
+
+from app.core.config import settings
+from app.core.etag import etag_matches
+from app.core.storage import BLOB_DIR
+
+IMMUTABLE_CACHE_CONTROL = "public, max-age=31536000, immutable"
+REVALIDATE_CACHE_CONTROL = "public, no-cache"
+
+# Content-addressed directories, see app.core.storage and app.services.image_variants
+IMMUTABLE_DIRS = (f"{BLOB_DIR}/", "variants/")
+
+# Precompressed siblings, in order of preference
+ENCODINGS = (("br", ".br"), ("gzip", ".gz"))
+
+RANGE_PATTERN = re.compile(r"bytes=(\d*)-(\d*)")
+
+
+class PartialFileResponse(FileResponse):
+    """206 response carrying bytes ``start``..``end`` (inclusive) of a file"""
+
+    def __init__(self, path: Path, start: int, end: int, stat_result: os.stat_result, **kwargs):
+        super().__init__(path, status_code=206, stat_result=stat_result, **kwargs)
+        self.start = start
+        self.end = end
+        self.headers["content-range"] = f"bytes {start}-{end}/{stat_result.st_size}"
+        self.headers["content-length"] = str(end - start + 1)
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send) -> None:
+        await send({"type": "http.response.start", "status": self.status_code, "headers": self.raw_headers})
+        if scope["method"].upper() == "HEAD":
+            await send({"type": "http.response.body", "body": b"", "more_body": False})
+            return
+        async with await anyio.open_file(self.path, mode="rb") as file:
+            await file.seek(self.start)
+            remaining = self.end - self.start + 1
+            while remaining > 0:
+                chunk = await file.read(min(self.chunk_size, remaining))
+                if not chunk:
+                    break
+                remaining -= len(chunk)
+                await send({"type": "http.response.body", "body": chunk, "more_body": remaining > 0})
+            if remaining > 0:
+                # The file shrank under us; end the body rather than hang the client
+                await send({"type": "http.response.body", "body": b"", "more_body": False})
+
+
+def cache_control_for(path: str) -> str:
+    return IMMUTABLE_CACHE_CONTROL if path.startswith(IMMUTABLE_DIRS) else REVALIDATE_CACHE_CONTROL
+
+
+def content_etag(path: str) -> Optional[str]:
+    """ETag from the content hash in a content-addressed path, e.g. variants/64/ab/<sha>.webp"""
+    if not path.startswith(IMMUTABLE_DIRS):
+        return None
+    stem = path.rsplit(".", 1)[0]
+    return f'"{stem.replace("/", "-")}"'
+
+
+def parse_range(header: str, size: int) -> Optional[Tuple[int, int]]:
+    """(start, end) of a single satisfiable byte range; raises ValueError if unsatisfiable
+
+    Returns None for headers we answer with the full file (malformed or
+    multiple ranges).
+    """
+    match = RANGE_PATTERN.fullmatch(header.strip())
+    if match is None:
+        return None
+    first, last = match.groups()
+    if not first and not last:
+        return None
+    if not first:
+        # Suffix range: the last N bytes
+        length = int(last)
+        if length == 0:
+            raise ValueError("empty suffix range")
+        return max(size - length, 0), size - 1
+    start = int(first)
+    end = min(int(last), size - 1) if last else size - 1
+    if start >= size or start > end:
+        raise ValueError("range not satisfiable")
+    return start, end
+
+
+def if_range_allows(request: Request, etag: str, last_modified: str) -> bool:
+    """Whether a Range may be honoured given the request's If-Range precondition"""
+    value = request.headers.get("if-range")
+    if not value:
+        return True
+    if value.startswith(('"', "W/")):
+        # Requires a strong match
+        return value == etag
+    try:
+        return parsedate_to_datetime(value) >= parsedate_to_datetime(last_modified)
+    except (TypeError, ValueError):
+        return False
+
+
+def is_not_modified(request: Request, response: Response) -> bool:
+    if "if-none-match" in request.headers:
+        # If-Modified-Since is ignored when If-None-Match is present
+        return etag_matches(request, response.headers["etag"])
+    if_modified_since = request.headers.get("if-modified-since")
+    if not if_modified_since:
+        return False
+    try:
+        return parsedate_to_datetime(if_modified_since) >= parsedate_to_datetime(response.headers["last-modified"])
+    except (TypeError, ValueError):
+        return False
+
+
+def precompressed_siblings(full_path: Path) -> List[Tuple[str, Path]]:
+    """(encoding, path) of the precompressed copies stored next to ``full_path``"""
+    siblings = []
+    for encoding, suffix in ENCODINGS:
+        candidate = full_path.with_name(full_path.name + suffix)
+        if candidate.is_file():
+            siblings.append((encoding, candidate))
+    return siblings
+
+
+def accepted_encoding(request: Request, siblings: List[Tuple[str, Path]]) -> Tuple[Optional[str], Optional[Path]]:
+    """The preferred precompressed copy the client accepts, if any"""
+    accepted = {value.split(";")[0].strip() for value in request.headers.get("accept-encoding", "").split(",")}
+    for encoding, path in siblings:
+        if encoding in accepted:
+            return encoding, path
+    return None, None
+
+
+def select_body(request: Request, full_path: Path) -> Tuple[List[Tuple[str, Path]], Optional[str], Path, os.stat_result]:
+    """Siblings of ``full_path``, the encoding and file to send, and that file's stat
+
+    Touches the file system; run it in a worker thread.
+    """
+    siblings = precompressed_siblings(full_path)
+    encoding, body_path = accepted_encoding(request, siblings)
+    body_path = body_path or full_path
+    return siblings, encoding, body_path, os.stat(body_path)
+
+
+async def storage_response(request: Request, full_path: Path, path: str) -> Response:
+    """Serve ``full_path`` (``path`` relative to public/storage) with caching, conditional and range support"""
+    media_type = guess_type(full_path.name)[0] or "application/octet-stream"
+    headers = {"cache-control": cache_control_for(path)}
+
+    if settings.storage_accel_redirect_prefix:
+        headers["x-accel-redirect"] = settings.storage_accel_redirect_prefix.rstrip("/") + "/" + quote(path)
+        return Response(headers=headers, media_type=media_type)
+
+    siblings, encoding, body_path, stat_result = await anyio.to_thread.run_sync(select_body, request, full_path)
+    if siblings:
+        headers["vary"] = "Accept-Encoding"
+    if encoding:
+        headers["content-encoding"] = encoding
+    else:
+        headers["accept-ranges"] = "bytes"
+
+    etag = content_etag(path)
+    if etag:
+        headers["etag"] = etag if not encoding else f'{etag[:-1]}-{encoding}"'
+
+    response = FileResponse(body_path, headers=headers, media_type=media_type, stat_result=stat_result)
+    if is_not_modified(request, response):
+        return NotModifiedResponse(response.headers)
+
+    range_header = request.headers.get("range")
+    if encoding or not range_header or not if_range_allows(request, response.headers["etag"], response.headers["last-modified"]):
+        return response
+    try:
+        byte_range = parse_range(range_header, stat_result.st_size)
+    except ValueError:
+        return Response(
+            status_code=416,
+            headers={**headers, "content-range": f"bytes */{stat_result.st_size}"}
+        )
+    if byte_range is None:
+        return response
+    return PartialFileResponse(
+        body_path, *byte_range, stat_result=stat_result, headers=headers, media_type=media_type
+    )
+
+
+class DeferredStorageResponse(Response):
+    """Builds the ``storage_response`` when sent, so StaticFiles' sync hook can await it"""
+
+    def __init__(self, request: Request, full_path: Path, path: str):
+        self.request = request
+        self.full_path = full_path
+        self.path = path
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send) -> None:
+        response = await storage_response(self.request, self.full_path, self.path)
+        await response(scope, receive, send)
+
+
+class StorageFiles(StaticFiles):
+    """StaticFiles for public/storage, answering through ``storage_response``"""
+
+    def file_response(
+        self,
+        full_path,
+        stat_result: os.stat_result,
+        scope: Scope,
+        status_code: int = 200,
+    ) -> Response:
+        if not stat.S_ISREG(stat_result.st_mode):
+            return super().file_response(full_path, stat_result, scope, status_code)
+        path = Path(os.path.relpath(full_path, os.path.realpath(self.directory))).as_posix()
+        return DeferredStorageResponse(Request(scope), Path(full_path), path)
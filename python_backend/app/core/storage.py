@@ -0,0 +1,19 @@
+"""Layout of public/storage, served under /storage
+
+Uploaded files are content-addressed blobs (see app.services.uploads);
+derived files such as resized variants live next to them.
+"""
+from pathlib import Path
+from typing import Optional
+
+STORAGE_ROOT = Path("public") / "storage"
+BLOB_DIR = "blobs"
+
+
+def blob_path(sha256: str, extension: str) -> str:
+    """Storage path of the blob with this content hash, fanned out by hash prefix"""
+    return f"{BLOB_DIR}/{sha256[:2]}/{sha256}{extension}"
+
+
+def is_blob_path(path: Optional[str]) -> bool:
+    return bool(path) and path.startswith(f"{BLOB_DIR}/")
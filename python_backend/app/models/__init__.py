@@ -1,5 +1,11 @@
 from .child import Child
 from .star_record import StarRecord
 from .reward import Reward
+from .idempotency_key import IdempotencyKey
+from .data_version import DataVersion
+from .upload_blob import UploadBlob
+from .star_daily_rollup import StarDailyRollup
+from .category_rule import CategoryRule
+from .report_job import ReportJob
 
-__all__ = ["Child", "StarRecord", "Reward"]
+__all__ = ["Child", "StarRecord", "Reward", "IdempotencyKey", "DataVersion", "UploadBlob", "StarDailyRollup", "CategoryRule", "ReportJob"]
@@ -0,0 +1,33 @@
+from sqlalchemy import Column, Integer, String, DateTime, func, Index, event
+from app.core.clock import utc_now
+from app.core.database import Base
+
+class CategoryRule(Base):
+    """A keyword that puts star records whose reason contains it in a behavior category"""
+    __tablename__ = "category_rules"
+    __table_args__ = (
+        Index("uq_category_rules_keyword", "keyword", unique=True),
+    )
+    
+    id = Column(Integer, primary_key=True, index=True)
+    keyword = Column(String(100), nullable=False)  # matched case-insensitively anywhere in the reason
+    category = Column(String(50), nullable=False)
+    priority = Column(Integer, default=0, nullable=False)  # the highest priority match wins
+    created_at = Column(DateTime, default=utc_now, server_default=func.now())
+
+# Starting rules for the categories of the behavior distribution chart
+DEFAULT_CATEGORY_RULES = {
+    "homework": ["作业", "功课", "学习", "阅读", "读书", "练字", "背诵", "homework", "study", "reading"],
+    "chores": ["家务", "洗碗", "扫地", "拖地", "整理", "收拾", "叠被", "倒垃圾", "chores", "tidy", "clean"],
+    "sleep": ["睡觉", "早睡", "午睡", "按时睡", "起床", "sleep", "bedtime"],
+    "exercise": ["运动", "跑步", "跳绳", "游泳", "锻炼", "exercise", "sport"],
+    "manners": ["礼貌", "分享", "帮助", "谢谢", "polite", "sharing", "helping"],
+}
+
+@event.listens_for(CategoryRule.__table__, "after_create")
+def _seed_default_rules(table, connection, **kw):
+    connection.execute(table.insert(), [
+        {"keyword": keyword, "category": category, "priority": 0}
+        for category, keywords in DEFAULT_CATEGORY_RULES.items()
+        for keyword in keywords
+    ])
@@ -1,5 +1,6 @@
-from sqlalchemy import Column, Integer, String, Date, Enum, DateTime, func
+from sqlalchemy import Column, Integer, String, Date, Enum, DateTime, func, literal_column
 from sqlalchemy.orm import relationship
+from app.core.clock import utc_now
 from app.core.database import Base
 
 class Child(Base):
@@ -11,8 +12,12 @@ class Child(Base):
     gender = Column(Enum('male', 'female'), nullable=False)  # Changed to match PHP's male/female
     avatar = Column(String(255), nullable=True)
     star_count = Column(Integer, default=0, nullable=False)
-    created_at = Column(DateTime, server_default=func.now())
-    updated_at = Column(DateTime, server_default=func.now(), onupdate=func.now())
+    created_at = Column(DateTime, default=utc_now, server_default=func.now())
+    updated_at = Column(DateTime, default=utc_now, server_default=func.now(), onupdate=utc_now)
+    # Bumped by every UPDATE of the row, star balance changes included, so the
+    # ETags of a child's responses change without a shared counter (see app.core.etag)
+    version = Column(Integer, nullable=False, default=1, server_default="1",
+                     onupdate=literal_column("version", Integer) + 1)
     
     # Relationships
     star_records = relationship("StarRecord", back_populates="child", cascade="all, delete-orphan")
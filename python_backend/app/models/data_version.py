@@ -0,0 +1,21 @@
+from sqlalchemy import Column, String, BigInteger, DDL, event
+from app.core.database import Base
+
+class DataVersion(Base):
+    """Change sequences of the children and rewards collections
+
+    A scope is bumped by transactions that create or delete children
+    (``children``) or write rewards or their participants (``rewards``);
+    updates of a child row bump ``children.version`` instead.
+    """
+    __tablename__ = "data_versions"
+    
+    scope = Column(String(50), primary_key=True)
+    version = Column(BigInteger, nullable=False, default=0)
+
+# Seed the rows the sequences live in as soon as the table exists
+event.listen(
+    DataVersion.__table__,
+    "after_create",
+    DDL("INSERT INTO data_versions (scope, version) VALUES ('children', 0), ('rewards', 0)")
+)
@@ -0,0 +1,23 @@
+from sqlalchemy import Boolean, Column, Integer, String, LargeBinary, DateTime, func, Index
+from app.core.clock import utc_now
+from app.core.database import Base
+
+class IdempotencyKey(Base):
+    """Stored outcome of a mutation sent with an Idempotency-Key header"""
+    __tablename__ = "idempotency_keys"
+    __table_args__ = (
+        Index("uq_idempotency_keys_key", "key", unique=True),
+    )
+    
+    id = Column(Integer, primary_key=True, index=True)
+    key = Column(String(255), nullable=False)
+    request_hash = Column(String(64), nullable=False)  # sha256 of method, path and body
+    status_code = Column(Integer, nullable=True)  # NULL while the first request is in flight
+    media_type = Column(String(100), nullable=True)
+    response_body = Column(LargeBinary, nullable=True)
+    # While in flight: a retry may take the key over after this lease runs out
+    locked_until = Column(DateTime, nullable=True)
+    # Set in the handler's own transaction, so a retry knows whether the mutation happened
+    committed = Column(Boolean, nullable=False, default=False, server_default="0")
+    created_at = Column(DateTime, default=utc_now, server_default=func.now())
+    expires_at = Column(DateTime, nullable=False, index=True)
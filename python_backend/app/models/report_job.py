@@ -0,0 +1,27 @@
+from sqlalchemy import Column, Integer, String, Date, DateTime, Enum, ForeignKey, func, Index
+from app.core.clock import utc_now
+from app.core.database import Base
+
+class ReportJob(Base):
+    """A weekly or monthly report of one child, rendered to a file by the report dispatcher"""
+    __tablename__ = "report_jobs"
+    __table_args__ = (
+        # Finds an existing report of the same data before queueing a new one
+        Index("ix_report_jobs_lookup", "child_id", "period", "format", "period_start", "data_version"),
+        # The dispatcher claims the oldest pending job
+        Index("ix_report_jobs_status_id", "status", "id"),
+    )
+    
+    id = Column(Integer, primary_key=True)
+    child_id = Column(Integer, ForeignKey("children.id"), nullable=False)
+    period = Column(Enum('weekly', 'monthly'), nullable=False)
+    period_start = Column(Date, nullable=False)
+    format = Column(Enum('xlsx', 'pdf'), nullable=False)
+    # Fingerprint of the child's star records in the period; a new record makes a new report
+    data_version = Column(String(40), nullable=False)
+    status = Column(Enum('pending', 'running', 'done', 'failed'), nullable=False, default='pending')
+    artifact = Column(String(255), nullable=True)  # relative to REPORT_DIR once done
+    error = Column(String(255), nullable=True)
+    created_at = Column(DateTime, default=utc_now, server_default=func.now())
+    started_at = Column(DateTime, nullable=True)
+    finished_at = Column(DateTime, nullable=True)
@@ -1,5 +1,6 @@
-from sqlalchemy import Column, Integer, String, Text, Table, ForeignKey, DateTime, func, Boolean
+from sqlalchemy import Column, Integer, String, Text, Table, ForeignKey, DateTime, func, Boolean, Index
 from sqlalchemy.orm import relationship
+from app.core.clock import utc_now
 from app.core.database import Base
 
 # Association table for many-to-many relationship with deduction amount
@@ -11,8 +12,10 @@ reward_children = Table(
     Column('reward_id', Integer, ForeignKey('rewards.id'), nullable=False),
     Column('child_id', Integer, ForeignKey('children.id'), nullable=False),
     Column('deduction_amount', Integer, nullable=True),  # Actual stars deducted when redeemed
-    Column('created_at', DateTime, server_default=func.now()),
-    Column('updated_at', DateTime, server_default=func.now(), onupdate=func.now())
+    Column('created_at', DateTime, default=utc_now, server_default=func.now()),
+    Column('updated_at', DateTime, default=utc_now, server_default=func.now(), onupdate=utc_now),
+    # One row per reward/child pair; also the conflict target for upserts
+    Index('uq_reward_children_reward_id_child_id', 'reward_id', 'child_id', unique=True)
 )
 
 class Reward(Base):
@@ -25,8 +28,8 @@ class Reward(Base):
     image = Column(String(255), nullable=True)
     is_redeemed = Column(Boolean, default=False, nullable=False)
     redeemed_at = Column(DateTime, nullable=True)
-    created_at = Column(DateTime, server_default=func.now())
-    updated_at = Column(DateTime, server_default=func.now(), onupdate=func.now())
+    created_at = Column(DateTime, default=utc_now, server_default=func.now())
+    updated_at = Column(DateTime, default=utc_now, server_default=func.now(), onupdate=utc_now)
     
     # Relationships
     children = relationship("Child", secondary=reward_children, back_populates="rewards")
@@ -0,0 +1,21 @@
+from sqlalchemy import Column, Integer, Date, Enum, ForeignKey, Index
+from app.core.database import Base
+
+class StarDailyRollup(Base):
+    """Count and sum of one child's star records of one type on one day
+
+    Maintained by ``insert_star_records`` in the transaction that inserts
+    the records, so trend charts never scan star_records.
+    """
+    __tablename__ = "star_daily_rollups"
+    __table_args__ = (
+        # Conflict target of the incremental upsert; also serves a child's date range
+        Index("uq_star_daily_rollups_child_day_type", "child_id", "day", "type", unique=True),
+    )
+    
+    id = Column(Integer, primary_key=True)
+    child_id = Column(Integer, ForeignKey("children.id"), nullable=False)
+    day = Column(Date, nullable=False)  # date of StarRecord.created_at (naive UTC, see app.services.stars)
+    type = Column(Enum('add', 'subtract', 'redeem'), nullable=False)
+    record_count = Column(Integer, default=0, nullable=False)
+    total_amount = Column(Integer, default=0, nullable=False)  # signed, as StarRecord.amount
@@ -1,17 +1,25 @@
-from sqlalchemy import Column, Integer, String, ForeignKey, DateTime, func, Enum
+from sqlalchemy import Column, Integer, String, ForeignKey, DateTime, func, Enum, Index
 from sqlalchemy.orm import relationship
+from app.core.clock import utc_now
 from app.core.database import Base
 
 class StarRecord(Base):
     __tablename__ = "star_records"
+    __table_args__ = (
+        # Serves "latest records of a child" and keyset pagination over them
+        Index("ix_star_records_child_id_created_at", "child_id", "created_at"),
+        # Serves per-child category aggregates (GROUP BY category) over a date range
+        Index("ix_star_records_child_id_category_created_at", "child_id", "category", "created_at"),
+    )
     
     id = Column(Integer, primary_key=True, index=True)
     child_id = Column(Integer, ForeignKey("children.id"), nullable=False)
     type = Column(Enum('add', 'subtract', 'redeem'), nullable=False)
     amount = Column(Integer, nullable=False)
     reason = Column(String(255), nullable=True)
+    category = Column(String(50), nullable=True)  # from the reason by app.services.categories, at insert time
     reward_id = Column(Integer, ForeignKey("rewards.id"), nullable=True)
-    created_at = Column(DateTime, server_default=func.now())
+    created_at = Column(DateTime, default=utc_now, server_default=func.now())
     
     # Relationships
     child = relationship("Child", back_populates="star_records")
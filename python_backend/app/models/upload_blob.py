@@ -0,0 +1,19 @@
+from sqlalchemy import Column, Integer, BigInteger, String, DateTime, func, Index
+from app.core.clock import utc_now
+from app.core.database import Base
+
+class UploadBlob(Base):
+    """A content-addressed uploaded file, shared by every row that references it"""
+    __tablename__ = "upload_blobs"
+    __table_args__ = (
+        # Conflict target when an identical upload bumps the reference count
+        Index("uq_upload_blobs_sha256", "sha256", unique=True),
+        Index("uq_upload_blobs_path", "path", unique=True),
+    )
+    
+    id = Column(Integer, primary_key=True, index=True)
+    sha256 = Column(String(64), nullable=False)
+    path = Column(String(255), nullable=False)  # relative to public/storage, as stored on children/rewards
+    size = Column(BigInteger, nullable=False)
+    ref_count = Column(Integer, default=0, nullable=False)  # children.avatar + rewards.image rows pointing here
+    created_at = Column(DateTime, default=utc_now, server_default=func.now())
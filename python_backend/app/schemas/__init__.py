@@ -1,9 +1,21 @@
-from .child import ChildCreate, ChildUpdate, ChildResponse, ChildDetailResponse
-from .star import StarAdd, StarSubtract, StarRecordResponse
-from .reward import RewardCreate, RewardUpdate, RewardResponse, RedeemRequest
+from .child import (
+    ChildCreate, ChildUpdate, ChildResponse, ChildDetailResponse,
+    ChildSummary, ChildListResponse, ChildDetail, ChildDetailPayload
+)
+from .star import (
+    StarAdd, StarSubtract, StarOperation, StarBulkRequest, StarRecordResponse,
+    StarRecordItem, StarRecordPage, DailyStarStats, DailyStarStatsResponse
+)
+from .category import CategoryRuleCreate, CategoryRuleResponse, CategoryStats, CategoryStatsResponse
+from .report import ReportRequest, ReportJobResponse
+from .reward import RewardCreate, RewardUpdate, RewardResponse, RedeemRequest, RewardSummary, RewardListResponse
 
 __all__ = [
     "ChildCreate", "ChildUpdate", "ChildResponse", "ChildDetailResponse",
-    "StarAdd", "StarSubtract", "StarRecordResponse",
-    "RewardCreate", "RewardUpdate", "RewardResponse", "RedeemRequest"
+    "ChildSummary", "ChildListResponse", "ChildDetail", "ChildDetailPayload",
+    "StarAdd", "StarSubtract", "StarOperation", "StarBulkRequest", "StarRecordResponse",
+    "StarRecordItem", "StarRecordPage", "DailyStarStats", "DailyStarStatsResponse",
+    "CategoryRuleCreate", "CategoryRuleResponse", "CategoryStats", "CategoryStatsResponse",
+    "ReportRequest", "ReportJobResponse",
+    "RewardCreate", "RewardUpdate", "RewardResponse", "RedeemRequest", "RewardSummary", "RewardListResponse"
 ]
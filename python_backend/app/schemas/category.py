@@ -0,0 +1,29 @@
+from pydantic import BaseModel, Field
+from datetime import datetime
+from typing import List, Optional
+
+class CategoryRuleCreate(BaseModel):
+    keyword: str = Field(..., min_length=1, max_length=100)
+    category: str = Field(..., min_length=1, max_length=50)
+    priority: int = 0
+    
+class CategoryRuleResponse(BaseModel):
+    id: int
+    keyword: str
+    category: str
+    priority: int
+    created_at: Optional[datetime]
+    
+    class Config:
+        from_attributes = True
+    
+class CategoryStats(BaseModel):
+    """Add and subtract records of one category; category is None for reasons matching no rule"""
+    category: Optional[str]
+    records: int
+    added: int
+    subtracted: int
+    
+class CategoryStatsResponse(BaseModel):
+    success: bool = True
+    data: List[CategoryStats]
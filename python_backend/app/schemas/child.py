@@ -1,7 +1,18 @@
-from pydantic import BaseModel, Field
+from pydantic import AliasPath, BaseModel, Field, computed_field, field_validator
 from datetime import date, datetime
-from typing import Optional, List, Literal
-from .star import StarRecordResponse
+from typing import Dict, Optional, List, Literal
+from app.core.clock import utc_today
+from app.services.image_variants import variant_urls
+from .fields import StorageUrl
+from .star import StarRecordResponse, StarRecordItem
+
+def calculate_age(birthday: date) -> int:
+    """Calculate age from birthday"""
+    today = utc_today()
+    age = today.year - birthday.year
+    if (today.month, today.day) < (birthday.month, birthday.day):
+        age -= 1
+    return age
 
 class ChildBase(BaseModel):
     name: str = Field(..., min_length=1, max_length=100)
@@ -32,3 +43,67 @@ class ChildDetailResponse(ChildResponse):
     
     class Config:
         from_attributes = True
+
+class ChildSummary(BaseModel):
+    """A child as listed by GET /api/children, validated straight from the ORM object"""
+    id: int
+    name: str
+    birthday: date
+    # Read from the birthday attribute so it keeps its place in the payload
+    age: int = Field(validation_alias="birthday")
+    gender: str
+    avatar: StorageUrl = None
+    star_count: int
+    
+    @field_validator("age", mode="before")
+    @classmethod
+    def age_from_birthday(cls, birthday: date) -> int:
+        return calculate_age(birthday)
+    
+    @computed_field
+    @property
+    def avatar_variants(self) -> Optional[Dict[str, str]]:
+        return variant_urls(self.avatar)
+    
+    class Config:
+        from_attributes = True
+
+class ChildListResponse(BaseModel):
+    success: bool = True
+    data: List[ChildSummary]
+
+class ChildRewardParticipant(BaseModel):
+    id: int
+    name: str
+    gender: str
+    star_count: int
+    
+    class Config:
+        from_attributes = True
+
+class ChildReward(BaseModel):
+    """A reward on the child detail page, validated from a (Reward, total_stars, is_achieved) row"""
+    id: int = Field(validation_alias=AliasPath("Reward", "id"))
+    name: str = Field(validation_alias=AliasPath("Reward", "name"))
+    image: StorageUrl = Field(None, validation_alias=AliasPath("Reward", "image"))
+    star_cost: int = Field(validation_alias=AliasPath("Reward", "star_cost"))
+    is_redeemed: bool = Field(validation_alias=AliasPath("Reward", "is_redeemed"))
+    children: List[ChildRewardParticipant] = Field(validation_alias=AliasPath("Reward", "children"))
+    total_stars: int
+    is_achieved: bool
+    
+    @computed_field
+    @property
+    def image_variants(self) -> Optional[Dict[str, str]]:
+        return variant_urls(self.image)
+    
+    class Config:
+        from_attributes = True
+
+class ChildDetail(ChildSummary):
+    star_records: List[StarRecordItem]
+    rewards: List[ChildReward]
+
+class ChildDetailPayload(BaseModel):
+    success: bool = True
+    data: ChildDetail
@@ -0,0 +1,17 @@
+"""Field types that serialize straight to the API's wire formats"""
+from datetime import datetime
+from typing import Annotated, Optional
+
+from pydantic import PlainSerializer
+
+
+def storage_url(path: Optional[str]) -> Optional[str]:
+    """Public URL of an uploaded file stored under public/storage"""
+    return f"/storage/{path}" if path else None
+
+
+# Holds the stored relative path, serializes as its /storage/ URL
+StorageUrl = Annotated[Optional[str], PlainSerializer(storage_url, return_type=Optional[str])]
+
+# Serializes like the PHP backend: "2024-01-31 18:05"
+MinuteDateTime = Annotated[datetime, PlainSerializer(lambda value: value.strftime("%Y-%m-%d %H:%M"), return_type=str)]
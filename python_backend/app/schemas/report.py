@@ -0,0 +1,26 @@
+from pydantic import BaseModel
+from datetime import date, datetime
+from typing import Literal, Optional
+
+class ReportRequest(BaseModel):
+    """``start`` may be any day of the period; it defaults to the current one"""
+    child_id: int
+    period: Literal["weekly", "monthly"] = "weekly"
+    start: Optional[date] = None
+    format: Literal["xlsx", "pdf"] = "xlsx"
+    
+class ReportJobResponse(BaseModel):
+    id: int
+    child_id: int
+    period: str
+    period_start: date
+    format: str
+    status: str
+    error: Optional[str]
+    created_at: Optional[datetime]
+    finished_at: Optional[datetime]
+    status_url: str = ""
+    download_url: Optional[str] = None
+    
+    class Config:
+        from_attributes = True
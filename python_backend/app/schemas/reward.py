@@ -1,6 +1,8 @@
-from pydantic import BaseModel, Field
+from pydantic import AliasPath, BaseModel, Field, computed_field
 from datetime import datetime
-from typing import Optional, List
+from typing import Dict, Optional, List
+from app.services.image_variants import variant_urls
+from .fields import MinuteDateTime, StorageUrl
 
 class RewardBase(BaseModel):
     name: str = Field(..., min_length=1, max_length=100)
@@ -31,3 +33,41 @@ class DeductionItem(BaseModel):
     
 class RedeemRequest(BaseModel):
     deductions: List[DeductionItem] = Field(..., min_items=1)
+        
+class RewardParticipant(BaseModel):
+    id: int
+    name: str
+    star_count: int
+    avatar: StorageUrl = None
+    
+    @computed_field
+    @property
+    def avatar_variants(self) -> Optional[Dict[str, str]]:
+        return variant_urls(self.avatar)
+    
+    class Config:
+        from_attributes = True
+        
+class RewardSummary(BaseModel):
+    """A reward as listed by GET /api/rewards, validated from a (Reward, total_stars, is_achieved) row"""
+    id: int = Field(validation_alias=AliasPath("Reward", "id"))
+    name: str = Field(validation_alias=AliasPath("Reward", "name"))
+    image: StorageUrl = Field(None, validation_alias=AliasPath("Reward", "image"))
+    star_cost: int = Field(validation_alias=AliasPath("Reward", "star_cost"))
+    is_redeemed: bool = Field(validation_alias=AliasPath("Reward", "is_redeemed"))
+    redeemed_at: Optional[MinuteDateTime] = Field(None, validation_alias=AliasPath("Reward", "redeemed_at"))
+    children: List[RewardParticipant] = Field(validation_alias=AliasPath("Reward", "children"))
+    total_stars: int
+    is_achieved: bool
+    
+    @computed_field
+    @property
+    def image_variants(self) -> Optional[Dict[str, str]]:
+        return variant_urls(self.image)
+    
+    class Config:
+        from_attributes = True
+        
+class RewardListResponse(BaseModel):
+    success: bool = True
+    data: List[RewardSummary]
@@ -1,6 +1,8 @@
-from pydantic import BaseModel, Field
-from datetime import datetime
-from typing import Optional, Literal
+from pydantic import BaseModel, Field, computed_field
+from datetime import date, datetime
+from typing import Dict, Optional, Literal, List
+from app.services.image_variants import variant_urls
+from .fields import MinuteDateTime, StorageUrl
 
 class StarAdd(BaseModel):
     amount: int = Field(..., ge=1, le=100)
@@ -10,6 +12,17 @@ class StarSubtract(BaseModel):
     amount: int = Field(..., ge=1, le=100)
     reason: Optional[str] = Field(None, max_length=255)
     
+class StarOperation(BaseModel):
+    child_id: int = Field(..., ge=1)
+    type: Literal["add", "subtract"]
+    amount: int = Field(..., ge=1, le=100)
+    reason: Optional[str] = Field(None, max_length=255)
+    
+class StarBulkRequest(BaseModel):
+    operations: List[StarOperation] = Field(..., min_length=1, max_length=500)
+    # atomic: apply all operations or none; partial: apply the valid ones and report per item
+    mode: Literal["atomic", "partial"] = "atomic"
+    
 class StarRecordResponse(BaseModel):
     id: int
     child_id: int
@@ -21,3 +34,46 @@ class StarRecordResponse(BaseModel):
     
     class Config:
         from_attributes = True
+    
+class StarRecordReward(BaseModel):
+    id: int
+    name: str
+    image: StorageUrl = None
+    
+    @computed_field
+    @property
+    def image_variants(self) -> Optional[Dict[str, str]]:
+        return variant_urls(self.image)
+    
+    class Config:
+        from_attributes = True
+    
+class StarRecordItem(BaseModel):
+    """A star record as shown in a child's history, with the redeemed reward if any"""
+    id: int
+    amount: int
+    type: str
+    reason: Optional[str]
+    reward: Optional[StarRecordReward]
+    created_at: MinuteDateTime
+    
+    class Config:
+        from_attributes = True
+    
+class StarRecordPage(BaseModel):
+    success: bool = True
+    data: List[StarRecordItem]
+    next_cursor: Optional[int]
+    
+class DailyStarStats(BaseModel):
+    """Stars a child got and gave up on one day; subtract and redeem are positive amounts"""
+    day: date
+    add: int = 0
+    subtract: int = 0
+    redeem: int = 0
+    net: int = 0
+    records: int = 0
+    
+class DailyStarStatsResponse(BaseModel):
+    success: bool = True
+    data: List[DailyStarStats]
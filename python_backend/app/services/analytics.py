@@ -0,0 +1,206 @@
+"""Star analytics for the charts: activity heatmap, distributions, trends, comparisons
+
+The star records of a family (the children being compared) over a date
+window are read with one streamed Core query that selects four integer
+columns: child id, ``created_at`` as epoch seconds, the record type as a
+small code and the amount. Partitions of rows go straight into one NumPy
+array, so 1M records are never turned into ORM objects or dicts. Every
+statistic is then computed with vectorized operations (``bincount`` over
+flat indices, cumulative sums, sorts); nothing loops over records or days
+in Python.
+
+Times are read as stored, in the naive UTC that ``insert_star_records``
+stamps records with and the daily rollups use.
+
+Results are cached per family and window, keyed by the version of the
+family's star records (``star_records_version`` in app.core.etag). A new
+record invalidates the families of its child, in every worker, and
+writes to other children or to rewards leave the cache alone. The computation
+runs in the thread pool so it does not hold up the event loop.
+
+NumPy is optional; without it the analytics endpoint answers 503.
+"""
+import itertools
+from dataclasses import dataclass
+from datetime import date, datetime, timedelta
+from typing import Sequence
+
+from sqlalchemy import BigInteger, Integer, case, cast, extract, func, literal, literal_column, select
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from app.core.cache import ResponseCache
+from app.core.config import settings
+from app.models import StarRecord
+
+try:
+    import numpy as np
+except ImportError:  # pragma: no cover - optional dependency
+    np = None
+
+TYPE_CODES = {"add": 0, "subtract": 1, "redeem": 2}
+COLUMNS = 4  # child_id, epoch seconds, type code, amount
+STREAM_BATCH = 50000
+DISTRIBUTION_PERCENTILES = (25, 50, 75, 90)
+# Per-child values compared across the family (the radar chart axes)
+COMPARED_METRICS = ("earned", "subtracted", "redeemed", "active_days", "mean_daily_earned")
+SECONDS_PER_DAY = 24 * 60 * 60
+UNIX_EPOCH = date(1970, 1, 1)
+
+
+def analytics_available() -> bool:
+    return np is not None
+
+
+@dataclass
+class StarColumns:
+    """Star records as parallel arrays, one element per record in the window"""
+    child_id: "np.ndarray"
+    day: "np.ndarray"  # days since the start of the window
+    weekday: "np.ndarray"  # Monday is 0
+    hour: "np.ndarray"
+    type: "np.ndarray"  # TYPE_CODES
+    amount: "np.ndarray"  # signed, as stored
+
+    def __len__(self) -> int:
+        return len(self.child_id)
+
+
+def epoch_seconds(dialect_name: str):
+    """StarRecord.created_at as integer seconds since 1970-01-01 in the records' clock (UTC)"""
+    if dialect_name == "sqlite":
+        return cast(func.strftime("%s", StarRecord.created_at), Integer)
+    if dialect_name == "mysql":
+        # TIMESTAMPDIFF does not convert time zones, unlike UNIX_TIMESTAMP
+        return func.timestampdiff(literal_column("SECOND"), literal("1970-01-01"), StarRecord.created_at)
+    return cast(extract("epoch", StarRecord.created_at), BigInteger)
+
+
+def to_columns(data: "np.ndarray", start: date, days: int) -> StarColumns:
+    """Split an (n, 4) array of raw rows into StarColumns, dropping rows outside the window"""
+    seconds = data[:, 1]
+    day = seconds // SECONDS_PER_DAY - (start - UNIX_EPOCH).days
+    keep = (day >= 0) & (day < days)
+    data, seconds, day = data[keep], seconds[keep], day[keep]
+    return StarColumns(
+        child_id=data[:, 0],
+        day=day,
+        # 1970-01-01 was a Thursday
+        weekday=(seconds // SECONDS_PER_DAY + 3) % 7,
+        hour=seconds % SECONDS_PER_DAY // 3600,
+        type=data[:, 2],
+        amount=data[:, 3],
+    )
+
+
+async def load_star_columns(db: AsyncSession, child_ids: Sequence[int], start: date, end: date) -> StarColumns:
+    """Stream the star records of ``child_ids`` created from ``start`` to ``end`` (inclusive)"""
+    stmt = (
+        select(
+            StarRecord.child_id,
+            epoch_seconds(db.bind.dialect.name),
+            case(TYPE_CODES, value=StarRecord.type),
+            StarRecord.amount,
+        )
+        .where(
+            StarRecord.child_id.in_(child_ids),
+            StarRecord.created_at >= datetime.combine(start, datetime.min.time()),
+            StarRecord.created_at < datetime.combine(end + timedelta(days=1), datetime.min.time()),
+        )
+        .execution_options(yield_per=STREAM_BATCH)
+    )
+    # Through the Core connection: the ORM would build its own row objects on top
+    connection = await db.connection()
+    result = await connection.stream(stmt)
+    chunks = [
+        np.fromiter(itertools.chain.from_iterable(rows), dtype=np.int64, count=len(rows) * COLUMNS)
+        async for rows in result.partitions()
+    ]
+    data = np.concatenate(chunks).reshape(-1, COLUMNS) if chunks else np.empty((0, COLUMNS), dtype=np.int64)
+    return to_columns(data, start, (end - start).days + 1)
+
+
+def trailing_mean(values: "np.ndarray", window: int) -> "np.ndarray":
+    """Mean of the last ``window`` values along axis 1; shorter at the start of the series"""
+    totals = np.cumsum(values, axis=1)
+    totals[:, window:] -= totals[:, :-window].copy()
+    return totals / np.minimum(np.arange(1, values.shape[1] + 1), window)
+
+
+def percentile_ranks(values: "np.ndarray") -> "np.ndarray":
+    """Share of the rows whose value is at most each row's, per column, in percent"""
+    ordered = np.sort(values, axis=0)
+    ranks = np.empty_like(values, dtype=np.float64)
+    for column in range(values.shape[1]):  # one searchsorted per metric
+        ranks[:, column] = np.searchsorted(ordered[:, column], values[:, column], side="right")
+    return ranks * 100 / len(values)
+
+
+def compute_star_analytics(columns: StarColumns, child_ids: Sequence[int], start: date, days: int, window: int) -> dict:
+    """Heatmap, per-child distributions and moving averages, and the family comparison"""
+    children = np.asarray(sorted(child_ids), dtype=np.int64)
+    count = len(children)
+    child = np.searchsorted(children, columns.child_id)
+    cell = child * days + columns.day
+    added = columns.type == TYPE_CODES["add"]
+
+    # Records per weekday and hour, for the whole family
+    heatmap = np.bincount(columns.weekday * 24 + columns.hour, minlength=7 * 24).reshape(7, 24)
+
+    # Stars earned per child and day, and which days had any record
+    daily_earned = np.bincount(cell[added], weights=columns.amount[added], minlength=count * days).reshape(count, days)
+    active = np.bincount(cell, minlength=count * days).reshape(count, days) > 0
+
+    # Totals per child and type; subtract and redeem amounts are stored negative
+    totals = np.bincount(
+        child * len(TYPE_CODES) + columns.type, weights=columns.amount, minlength=count * len(TYPE_CODES)
+    ).reshape(count, len(TYPE_CODES))
+    records = np.bincount(child, minlength=count)
+    active_days = active.sum(axis=1)
+
+    metrics = np.column_stack([
+        totals[:, TYPE_CODES["add"]],
+        -totals[:, TYPE_CODES["subtract"]],
+        -totals[:, TYPE_CODES["redeem"]],
+        active_days,
+        daily_earned.mean(axis=1),
+    ])
+    ranks = percentile_ranks(metrics) if count else metrics
+    distribution = np.percentile(daily_earned, DISTRIBUTION_PERCENTILES, axis=1).T
+    moving_average = trailing_mean(daily_earned, window)
+
+    return {
+        "from": start.isoformat(),
+        "to": (start + timedelta(days=days - 1)).isoformat(),
+        "window": window,
+        "records": len(columns),
+        "heatmap": heatmap.tolist(),
+        "metrics": list(COMPARED_METRICS),
+        "family_mean": np.round(metrics.mean(axis=0), 2).tolist() if count else [0.0] * len(COMPARED_METRICS),
+        "children": [
+            {
+                "child_id": int(child_id),
+                "records": int(records[index]),
+                **{name: round(float(value), 2) for name, value in zip(COMPARED_METRICS, metrics[index])},
+                "daily_earned_percentiles": {
+                    f"p{percentile}": round(float(value), 2)
+                    for percentile, value in zip(DISTRIBUTION_PERCENTILES, distribution[index])
+                },
+                "moving_average": np.round(moving_average[index], 2).tolist(),
+                "percentile_ranks": {
+                    name: round(float(value), 1) for name, value in zip(COMPARED_METRICS, ranks[index])
+                },
+            }
+            for index, child_id in enumerate(children)
+        ],
+    }
+
+
+def cache_key(child_ids: Sequence[int], start: date, end: date, window: int, version: str) -> str:
+    return f"{','.join(map(str, sorted(child_ids)))}:{start}:{end}:{window}#{version}"
+
+
+analytics_cache = ResponseCache(
+    max_entries=settings.analytics_cache_max_entries,
+    ttl_seconds=settings.analytics_cache_ttl_seconds,
+    enabled=settings.analytics_cache_enabled
+)
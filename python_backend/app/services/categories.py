@@ -0,0 +1,136 @@
+"""Behavior categories of star records, assigned from their reason at insert time
+
+The keywords of every row in ``category_rules`` are compiled into one
+Aho-Corasick automaton: a trie of the keywords with failure links, so a
+reason is scanned once, character by character, whatever the number of
+rules. Keywords match anywhere in the reason (Chinese has no word
+boundaries) and case-insensitively. When several keywords match, the rule
+with the highest priority wins, then the keyword that starts first, then
+the longest one.
+
+``insert_star_records`` stores the category with the record, so category
+charts are plain GROUP BYs over ``star_records.category``. Changing the
+rules does not touch existing records; run ``backfill_categories.py``
+for that.
+
+The compiled matcher is cached per process. The rule endpoints invalidate
+it after committing a change; other workers reload the rules after at
+most ``CATEGORY_RULES_REFRESH_SECONDS``.
+"""
+import time
+from collections import deque
+from typing import Dict, Iterable, List, Optional, Tuple
+
+from sqlalchemy import select
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from app.core.config import settings
+from app.models import CategoryRule
+
+
+class CategoryMatcher:
+    """Aho-Corasick automaton over (keyword, category, priority) rules"""
+
+    def __init__(self, rules: Iterable[Tuple[str, str, int]]):
+        # State 0 is the root; each state has its transitions, failure link and best match
+        self._goto: List[Dict[str, int]] = [{}]
+        self._fail: List[int] = [0]
+        # Best rule ending at a state, as (priority, length, category), including via failure links
+        self._output: List[Optional[Tuple[int, int, str]]] = [None]
+        self.size = 0
+
+        for keyword, category, priority in rules:
+            keyword = keyword.casefold()
+            if not keyword:
+                continue
+            state = 0
+            for char in keyword:
+                next_state = self._goto[state].get(char)
+                if next_state is None:
+                    next_state = len(self._goto)
+                    self._goto[state][char] = next_state
+                    self._goto.append({})
+                    self._fail.append(0)
+                    self._output.append(None)
+                state = next_state
+            self._output[state] = self._better(self._output[state], (priority, len(keyword), category))
+            self.size += 1
+        self._link()
+
+    @staticmethod
+    def _better(current, candidate):
+        if current is None or candidate[:2] > current[:2]:
+            return candidate
+        return current
+
+    def _link(self):
+        """Set the failure links breadth-first and merge the outputs along them"""
+        queue = deque(self._goto[0].values())
+        while queue:
+            state = queue.popleft()
+            for char, next_state in self._goto[state].items():
+                fail = self._fail[state]
+                while fail and char not in self._goto[fail]:
+                    fail = self._fail[fail]
+                self._fail[next_state] = self._goto[fail].get(char, 0)
+                inherited = self._output[self._fail[next_state]]
+                if inherited is not None:
+                    self._output[next_state] = self._better(self._output[next_state], inherited)
+                queue.append(next_state)
+
+    def categorize(self, reason: Optional[str]) -> Optional[str]:
+        """Category of the best rule matching ``reason``, or None"""
+        if not reason or not self.size:
+            return None
+        best = None  # (priority, -start, length, category)
+        state = 0
+        goto, fail, output = self._goto, self._fail, self._output
+        for end, char in enumerate(reason.casefold()):
+            while state and char not in goto[state]:
+                state = fail[state]
+            state = goto[state].get(char, 0)
+            match = output[state]
+            if match is not None:
+                priority, length, category = match
+                candidate = (priority, length - end - 1, length, category)
+                if best is None or candidate[:3] > best[:3]:
+                    best = candidate
+        return best[3] if best is not None else None
+
+
+class RuleCache:
+    """The compiled matcher of the current rules, reloaded when invalidated or stale"""
+
+    def __init__(self):
+        self._matcher: Optional[CategoryMatcher] = None
+        self._loaded_at = 0.0
+
+    def invalidate(self):
+        self._matcher = None
+
+    def is_current(self) -> bool:
+        return (
+            self._matcher is not None
+            and time.monotonic() - self._loaded_at < settings.category_rules_refresh_seconds
+        )
+
+    async def matcher(self, db: AsyncSession) -> CategoryMatcher:
+        if not self.is_current():
+            rows = await db.execute(select(CategoryRule.keyword, CategoryRule.category, CategoryRule.priority))
+            self._matcher = CategoryMatcher(rows.all())
+            self._loaded_at = time.monotonic()
+        return self._matcher
+
+
+category_rules = RuleCache()
+
+
+async def categorize_records(db: AsyncSession, records: List[dict]):
+    """Set ``category`` on each record from its reason; loads the rules only if a record has one"""
+    if not any(record.get("reason") for record in records):
+        for record in records:
+            record.setdefault("category", None)
+        return
+    matcher = await category_rules.matcher(db)
+    for record in records:
+        record["category"] = matcher.categorize(record.get("reason"))
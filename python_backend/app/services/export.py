@@ -0,0 +1,72 @@
+"""Streaming export of star histories as NDJSON or CSV
+
+The records are read with a server-side cursor (``yield_per``: an
+unbuffered cursor on MySQL, ``fetchmany`` batches on SQLite) and encoded
+one batch at a time inside the response generator. Memory stays flat
+whatever the number of rows, and the first batch goes out while the rest
+of the query is still running.
+
+The generator outlives the request's session (dependencies are closed
+before a streaming body is sent), so it reads through its own connection,
+which is released when the export ends or the client disconnects.
+"""
+import csv
+import io
+from typing import AsyncIterator, List, Optional
+
+import orjson
+from sqlalchemy import select
+from sqlalchemy.sql import Select
+
+from app.core.config import settings
+from app.core.database import async_engine
+from app.models import Child, Reward, StarRecord
+
+EXPORT_COLUMNS = ("id", "child_id", "child_name", "type", "amount", "reason", "category", "reward", "created_at")
+MEDIA_TYPES = {"ndjson": "application/x-ndjson", "csv": "text/csv; charset=utf-8"}
+
+
+def export_statement(child_ids: Optional[List[int]] = None) -> Select:
+    """Star records with their child and reward names, per child and oldest first"""
+    stmt = (
+        select(
+            StarRecord.id, StarRecord.child_id, Child.name, StarRecord.type, StarRecord.amount,
+            StarRecord.reason, StarRecord.category, Reward.name, StarRecord.created_at
+        )
+        .join(Child, Child.id == StarRecord.child_id)
+        .outerjoin(Reward, Reward.id == StarRecord.reward_id)
+        .order_by(StarRecord.child_id, StarRecord.created_at, StarRecord.id)
+    )
+    if child_ids is not None:
+        stmt = stmt.where(StarRecord.child_id.in_(child_ids))
+    return stmt
+
+
+async def stream_partitions(stmt: Select) -> AsyncIterator[list]:
+    async with async_engine.connect() as conn:
+        result = await conn.stream(stmt.execution_options(yield_per=settings.export_batch_size))
+        async for rows in result.partitions():
+            yield rows
+
+
+async def ndjson_chunks(stmt: Select) -> AsyncIterator[bytes]:
+    """One JSON object per line, one chunk per batch of rows"""
+    async for rows in stream_partitions(stmt):
+        yield b"".join(orjson.dumps(dict(zip(EXPORT_COLUMNS, row))) + b"\n" for row in rows)
+
+
+async def csv_chunks(stmt: Select) -> AsyncIterator[bytes]:
+    """CSV with a header row; the UTF-8 BOM makes Excel read Chinese reasons correctly"""
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+    writer.writerow(EXPORT_COLUMNS)
+    yield ("\ufeff" + buffer.getvalue()).encode("utf-8")
+    async for rows in stream_partitions(stmt):
+        buffer.seek(0)
+        buffer.truncate()
+        # created_at comes last
+        writer.writerows((*row[:-1], row[-1].isoformat(sep=" ") if row[-1] else None) for row in rows)
+        yield buffer.getvalue().encode("utf-8")
+
+
+EXPORTERS = {"ndjson": ndjson_chunks, "csv": csv_chunks}
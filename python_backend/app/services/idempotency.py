@@ -0,0 +1,225 @@
+"""Idempotency-Key handling for mutation endpoints
+
+The first request with a key claims it by inserting a row without a
+status, leased for ``IDEMPOTENCY_LEASE_SECONDS``. When it finishes, its
+response is stored on that row and every retry carrying the same key and
+body gets the stored response back without running the handler again.
+Server errors release the key so the client can retry for real.
+
+The store talks to the database through its own connections rather than
+the request's session, so replays never touch children or star_records.
+The one exception is the ``committed`` flag: it is set by the handler's
+session in the transaction that applies the mutation. If the process dies
+before the response is stored, a retry after the lease runs the handler
+again when nothing was committed, and otherwise learns that the mutation
+was applied instead of waiting out the TTL.
+"""
+import asyncio
+import contextvars
+import hashlib
+from datetime import datetime, timedelta
+from typing import Awaitable, Callable, Optional
+
+from fastapi import Request, Response
+from fastapi.responses import JSONResponse
+from loguru import logger
+from sqlalchemy import delete, event, insert, select, update
+from sqlalchemy.exc import IntegrityError
+from sqlalchemy.orm import Session
+
+from app.core.clock import utc_now
+from app.core.config import settings
+from app.core.database import async_engine
+from app.models import IdempotencyKey
+
+IDEMPOTENCY_HEADER = "Idempotency-Key"
+REPLAYED_HEADER = "Idempotent-Replayed"
+MAX_KEY_LENGTH = 255
+
+keys = IdempotencyKey.__table__
+
+# Key of the idempotent request running in this context, if any
+_current_key: contextvars.ContextVar[Optional[str]] = contextvars.ContextVar("idempotency_key", default=None)
+
+
+@event.listens_for(Session, "before_commit")
+def _mark_key_committed(session):
+    key = _current_key.get()
+    if key is None:
+        return
+    # Flushes pending ORM changes, so the tracked writes are complete
+    session.flush()
+    if session.info.get("written_tables", set()) - {keys.name}:
+        session.execute(update(keys).where(keys.c.key == key).values(committed=True))
+
+
+def request_hash(request: Request, body: bytes) -> str:
+    """Fingerprint of what the client asked for; a key may only be reused with the same request"""
+    digest = hashlib.sha256()
+    digest.update(f"{request.method} {request.url.path}?{request.url.query}\n".encode())
+    digest.update(body)
+    return digest.hexdigest()
+
+
+def error_response(status_code: int, message: str) -> JSONResponse:
+    return JSONResponse(status_code=status_code, content={"success": False, "message": message})
+
+
+def lease_end() -> datetime:
+    return utc_now() + timedelta(seconds=settings.idempotency_lease_seconds)
+
+
+async def insert_claim(key: str, fingerprint: str) -> bool:
+    """Insert the in-flight row for ``key``; False when the key already exists"""
+    try:
+        async with async_engine.begin() as conn:
+            await conn.execute(insert(keys).values(
+                key=key,
+                request_hash=fingerprint,
+                locked_until=lease_end(),
+                expires_at=utc_now() + timedelta(seconds=settings.idempotency_ttl_seconds)
+            ))
+        return True
+    except IntegrityError:
+        return False
+
+
+async def claim_key(key: str, fingerprint: str) -> Optional[Response]:
+    """Claim ``key`` for this request; returns the response to send instead if it is taken"""
+    if await insert_claim(key, fingerprint):
+        return None
+
+    async with async_engine.connect() as conn:
+        existing = (await conn.execute(select(keys).where(keys.c.key == key))).first()
+
+    if existing is not None and existing.expires_at < utc_now():
+        # An expired key behaves as if it was never used
+        async with async_engine.begin() as conn:
+            await conn.execute(delete(keys).where(keys.c.key == key, keys.c.expires_at < utc_now()))
+        if await insert_claim(key, fingerprint):
+            return None
+        return error_response(409, "A request with this Idempotency-Key is still in progress")
+
+    if existing is None:
+        # Released by a failed first attempt between our insert and select
+        return error_response(409, "A request with this Idempotency-Key is being retried, try again")
+    if existing.request_hash != fingerprint:
+        return error_response(422, "Idempotency-Key was already used for a different request")
+    if existing.status_code is None:
+        if existing.locked_until is not None and existing.locked_until > utc_now():
+            return error_response(409, "A request with this Idempotency-Key is still in progress")
+        # The request holding the key died before storing its response
+        if existing.committed:
+            return await applied_without_response(key)
+        if await take_over(key, existing.locked_until):
+            logger.warning(f"Retrying Idempotency-Key {key} after its first request was lost")
+            return None
+        return error_response(409, "A request with this Idempotency-Key is still in progress")
+
+    logger.info(f"Replaying stored response for Idempotency-Key {key}")
+    return Response(
+        content=existing.response_body,
+        status_code=existing.status_code,
+        media_type=existing.media_type,
+        headers={REPLAYED_HEADER: "true"}
+    )
+
+
+async def take_over(key: str, locked_until: Optional[datetime]) -> bool:
+    """Renew the expired lease of an uncommitted key; False if another retry got it first"""
+    async with async_engine.begin() as conn:
+        result = await conn.execute(
+            update(keys)
+            .where(keys.c.key == key, keys.c.status_code.is_(None), keys.c.committed.is_(False),
+                   keys.c.locked_until.is_(None) if locked_until is None else keys.c.locked_until == locked_until)
+            .values(locked_until=lease_end())
+        )
+    return result.rowcount == 1
+
+
+async def applied_without_response(key: str) -> Response:
+    """Tell a retry that its mutation was applied although its response was lost"""
+    logger.warning(f"Idempotency-Key {key} was applied but its response was lost")
+    response = JSONResponse(status_code=200, content={
+        "success": True,
+        "message": "The request with this Idempotency-Key was applied, but its response was lost; reload the data"
+    })
+    await store_response(key, response)
+    response.headers[REPLAYED_HEADER] = "true"
+    return response
+
+
+async def store_response(key: str, response: Response):
+    async with async_engine.begin() as conn:
+        await conn.execute(
+            update(keys)
+            .where(keys.c.key == key)
+            .values(status_code=response.status_code, media_type=response.media_type, response_body=response.body)
+        )
+
+
+async def release_key(key: str):
+    """Free the key after a failure; once its mutation committed, only end the lease"""
+    async with async_engine.begin() as conn:
+        deleted = await conn.execute(delete(keys).where(keys.c.key == key, keys.c.committed.is_(False)))
+        if deleted.rowcount == 0:
+            await conn.execute(update(keys).where(keys.c.key == key).values(locked_until=utc_now()))
+
+
+async def run_idempotent(
+    request: Request,
+    key: str,
+    handler: Callable[[Request], Awaitable[Response]]
+) -> Response:
+    """Run ``handler`` at most once per Idempotency-Key and replay its stored response afterwards"""
+    if len(key) > MAX_KEY_LENGTH:
+        return error_response(400, f"Idempotency-Key must be at most {MAX_KEY_LENGTH} characters")
+
+    # The body is cached on the request, so the handler can still read it
+    fingerprint = request_hash(request, await request.body())
+    replay = await claim_key(key, fingerprint)
+    if replay is not None:
+        return replay
+
+    token = _current_key.set(key)
+    try:
+        response = await handler(request)
+    except BaseException:
+        await release_key(key)
+        raise
+    finally:
+        _current_key.reset(token)
+
+    if response.status_code >= 500 or not hasattr(response, "body"):
+        # Server errors are worth retrying, streamed bodies cannot be stored
+        await release_key(key)
+    else:
+        await store_response(key, response)
+    return response
+
+
+async def prune_expired_keys(batch_size: int) -> int:
+    """Delete expired keys in batches of ``batch_size``; returns how many were removed"""
+    removed = 0
+    while True:
+        async with async_engine.begin() as conn:
+            ids = (await conn.execute(
+                select(keys.c.id).where(keys.c.expires_at < utc_now()).limit(batch_size)
+            )).scalars().all()
+            if ids:
+                await conn.execute(delete(keys).where(keys.c.id.in_(ids)))
+        removed += len(ids)
+        if len(ids) < batch_size:
+            return removed
+
+
+async def run_cleanup_task():
+    """Background loop pruning expired idempotency keys"""
+    while True:
+        await asyncio.sleep(settings.idempotency_cleanup_interval_seconds)
+        try:
+            removed = await prune_expired_keys(settings.idempotency_cleanup_batch_size)
+            if removed:
+                logger.info(f"Pruned {removed} expired idempotency keys")
+        except Exception as e:
+            logger.error(f"Error pruning idempotency keys: {e}")
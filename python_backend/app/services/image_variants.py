@@ -0,0 +1,128 @@
+"""Resized WebP variants of uploaded images
+
+Every blob ``blobs/ab/<sha256>.<ext>`` gets square-bounded WebP variants at
+``variants/<size>/ab/<sha256>.webp``. They are rendered in a process pool,
+so resizing never runs on the event loop or holds the GIL of the API
+process: eagerly right after an upload is committed, and lazily by the
+variant route when a file is missing (e.g. blobs imported before variants
+existed). Like the blobs they derive from, variants never change once
+written.
+
+Pillow is optional; without it no variant URLs are exposed.
+"""
+import asyncio
+import os
+import tempfile
+from pathlib import Path
+from typing import Dict, Optional, Set, Tuple
+
+from loguru import logger
+from starlette.concurrency import run_in_threadpool
+
+from app.core import storage
+from app.core.config import settings
+from app.core.process_pool import WorkerPool
+from app.core.storage import BLOB_DIR, is_blob_path
+
+try:
+    from PIL import Image, ImageOps
+except ImportError:  # pragma: no cover - optional dependency
+    Image = None
+
+VARIANT_SIZES = (64, 256, 1024)
+VARIANT_DIR = "variants"
+
+pool = WorkerPool("image variant", lambda: settings.image_variant_workers)
+_in_flight: Dict[Tuple[str, int], asyncio.Future] = {}
+_background_tasks: Set[asyncio.Task] = set()
+
+
+def variants_enabled() -> bool:
+    return Image is not None and settings.image_variants_enabled
+
+
+def variant_path(path: Optional[str], size: int) -> Optional[str]:
+    """Storage path of the ``size`` variant of a blob, or None for non-blob paths"""
+    if not is_blob_path(path):
+        return None
+    stem = path[len(BLOB_DIR) + 1:].rsplit(".", 1)[0]
+    return f"{VARIANT_DIR}/{size}/{stem}.webp"
+
+
+def variant_urls(path: Optional[str]) -> Optional[Dict[str, str]]:
+    """``{"64": url, ...}`` for a stored blob, None when there are no variants"""
+    if not variants_enabled() or not is_blob_path(path):
+        return None
+    return {str(size): f"/storage/{variant_path(path, size)}" for size in VARIANT_SIZES}
+
+
+def render_variant(source: str, target: str, size: int):
+    """Write a WebP copy of ``source`` fitting in ``size`` x ``size`` to ``target``
+
+    Runs in a worker process; never upscales.
+    """
+    with Image.open(source) as image:
+        image.seek(0)  # first frame of animated GIF/WebP
+        image = ImageOps.exif_transpose(image)
+        image.thumbnail((size, size), Image.Resampling.LANCZOS)
+        if image.mode not in ("RGB", "RGBA"):
+            image = image.convert("RGBA" if "transparency" in image.info or image.mode in ("LA", "P") else "RGB")
+
+        Path(target).parent.mkdir(parents=True, exist_ok=True)
+        fd, temp_path = tempfile.mkstemp(dir=Path(target).parent, suffix=".part")
+        try:
+            with os.fdopen(fd, "wb") as f:
+                image.save(f, "WEBP", quality=settings.image_variant_quality, method=4)
+            os.replace(temp_path, target)
+        except BaseException:
+            os.unlink(temp_path)
+            raise
+
+
+def shutdown_executor():
+    pool.shutdown()
+
+
+async def ensure_variant(path: str, size: int) -> Path:
+    """Render the ``size`` variant of blob ``path`` unless it exists; returns its file"""
+    target = storage.STORAGE_ROOT / variant_path(path, size)
+    if await run_in_threadpool(target.exists):
+        return target
+
+    key = (path, size)
+    future = _in_flight.get(key)
+    if future is None:
+        # Concurrent requests for the same variant share one render
+        future = asyncio.ensure_future(
+            pool.run(render_variant, str(storage.STORAGE_ROOT / path), str(target), size)
+        )
+        _in_flight[key] = future
+        future.add_done_callback(lambda _: _in_flight.pop(key, None))
+    await asyncio.shield(future)
+    return target
+
+
+async def _render_all(path: str):
+    for size in VARIANT_SIZES:
+        try:
+            await ensure_variant(path, size)
+        except Exception as e:
+            logger.error(f"Error rendering {size}px variant of {path}: {e}")
+
+
+def schedule_variants(path: Optional[str]):
+    """Render all variants of a just-committed upload in the background"""
+    if not variants_enabled() or not is_blob_path(path):
+        return
+    task = asyncio.get_running_loop().create_task(_render_all(path))
+    _background_tasks.add(task)
+    task.add_done_callback(_background_tasks.discard)
+
+
+def find_blob(stem: str) -> Optional[str]:
+    """Blob path (with its extension) for ``ab/<sha256>``, if it is stored"""
+    directory = storage.STORAGE_ROOT / BLOB_DIR / Path(stem).parent
+    for candidate in directory.glob(f"{Path(stem).name}.*"):
+        if candidate.suffix != ".part":
+            return f"{BLOB_DIR}/{stem}{candidate.suffix}"
+    return None
@@ -0,0 +1,231 @@
+"""Rendering of weekly and monthly child reports, run in report worker processes
+
+A worker reads the report's data with its own synchronous session and
+writes the file next to its target before renaming it into place, so a
+crash never leaves a partial report behind. Daily totals come from
+star_daily_rollups and categories from the category stored with each
+record. The record list is streamed from the database:
+
+- Excel files are written with openpyxl's write-only workbook, which
+  flushes each row to disk as it is appended, so memory stays constant
+  however many records the period has
+- PDF files are laid out by reportlab, which needs the whole document in
+  memory; a period's records of one child stay small
+
+openpyxl and reportlab are optional; the API refuses a format whose
+library is missing.
+"""
+import importlib.util
+import os
+import tempfile
+from datetime import date, datetime, timedelta
+from pathlib import Path
+from typing import Iterator, Tuple
+
+from sqlalchemy import case, func, select
+from sqlalchemy.orm import Session
+
+from app.core.database import SessionLocal
+from app.models import Child, Reward, StarDailyRollup, StarRecord
+
+RECORD_BATCH = 1000
+RECORD_COLUMNS = ("Time", "Type", "Amount", "Reason", "Category", "Reward")
+DAILY_COLUMNS = ("Day", "Added", "Subtracted", "Redeemed", "Net", "Records")
+FORMAT_LIBRARIES = {"xlsx": "openpyxl", "pdf": "reportlab"}
+MEDIA_TYPES = {
+    "xlsx": "application/vnd.openxmlformats-officedocument.spreadsheetml.sheet",
+    "pdf": "application/pdf",
+}
+# Built into reportlab and covers Chinese names and reasons without a font file
+PDF_FONT = "STSong-Light"
+
+
+def format_available(report_format: str) -> bool:
+    return importlib.util.find_spec(FORMAT_LIBRARIES[report_format]) is not None
+
+
+def period_end(period: str, start: date) -> date:
+    """Last day of the weekly or monthly period starting on ``start``"""
+    if period == "weekly":
+        return start + timedelta(days=6)
+    next_month = (start.replace(day=28) + timedelta(days=4)).replace(day=1)
+    return next_month - timedelta(days=1)
+
+
+def period_bounds(period: str, start: date) -> Tuple[datetime, datetime]:
+    """created_at range of the period, end exclusive"""
+    return (
+        datetime.combine(start, datetime.min.time()),
+        datetime.combine(period_end(period, start) + timedelta(days=1), datetime.min.time()),
+    )
+
+
+def report_summary(db: Session, child_id: int, period: str, start: date) -> dict:
+    """Totals, per-day rows and per-category rows of one child's period"""
+    end = period_end(period, start)
+    child = db.get(Child, child_id)
+
+    days = {start + timedelta(days=offset): [0, 0, 0, 0] for offset in range((end - start).days + 1)}
+    rollups = db.execute(
+        select(StarDailyRollup.day, StarDailyRollup.type, StarDailyRollup.record_count, StarDailyRollup.total_amount)
+        .where(StarDailyRollup.child_id == child_id, StarDailyRollup.day >= start, StarDailyRollup.day <= end)
+    )
+    for day, record_type, record_count, total_amount in rollups:
+        totals = days[day]
+        totals[("add", "subtract", "redeem").index(record_type)] += abs(total_amount)
+        totals[3] += record_count
+    daily = [
+        (day.isoformat(), added, subtracted, redeemed, added - subtracted - redeemed, records)
+        for day, (added, subtracted, redeemed, records) in days.items()
+    ]
+
+    since, until = period_bounds(period, start)
+    categories = db.execute(
+        select(
+            func.coalesce(StarRecord.category, "other"),
+            func.count(),
+            func.coalesce(func.sum(case((StarRecord.type == "add", StarRecord.amount), else_=0)), 0),
+        )
+        .where(
+            StarRecord.child_id == child_id,
+            StarRecord.type.in_(("add", "subtract")),
+            StarRecord.created_at >= since,
+            StarRecord.created_at < until,
+        )
+        .group_by(StarRecord.category)
+        .order_by(func.count().desc())
+    ).all()
+
+    added = sum(row[1] for row in daily)
+    subtracted = sum(row[2] for row in daily)
+    redeemed = sum(row[3] for row in daily)
+    return {
+        "title": f"{child.name} {'weekly' if period == 'weekly' else 'monthly'} star report",
+        "period": f"{start.isoformat()} - {end.isoformat()}",
+        "totals": [
+            ("Stars added", added),
+            ("Stars subtracted", subtracted),
+            ("Stars redeemed", redeemed),
+            ("Net change", added - subtracted - redeemed),
+            ("Records", sum(row[5] for row in daily)),
+            ("Active days", sum(1 for row in daily if row[5])),
+        ],
+        "daily": daily,
+        "categories": [tuple(row) for row in categories],
+    }
+
+
+def stream_records(db: Session, child_id: int, period: str, start: date) -> Iterator[tuple]:
+    """The period's star records, oldest first, fetched ``RECORD_BATCH`` rows at a time"""
+    since, until = period_bounds(period, start)
+    result = db.execute(
+        select(
+            StarRecord.created_at, StarRecord.type, StarRecord.amount,
+            StarRecord.reason, StarRecord.category, Reward.name
+        )
+        .outerjoin(Reward, Reward.id == StarRecord.reward_id)
+        .where(StarRecord.child_id == child_id, StarRecord.created_at >= since, StarRecord.created_at < until)
+        .order_by(StarRecord.created_at, StarRecord.id)
+        .execution_options(yield_per=RECORD_BATCH)
+    )
+    for created_at, record_type, amount, reason, category, reward in result:
+        yield (created_at.strftime("%Y-%m-%d %H:%M"), record_type, amount, reason or "", category or "", reward or "")
+
+
+def write_xlsx(db: Session, job: dict, summary: dict, path: str):
+    from openpyxl import Workbook
+    from openpyxl.cell import WriteOnlyCell
+    from openpyxl.styles import Font
+
+    workbook = Workbook(write_only=True)
+
+    def bold_row(sheet, values):
+        cells = []
+        for value in values:
+            cell = WriteOnlyCell(sheet, value=value)
+            cell.font = Font(bold=True)
+            cells.append(cell)
+        return cells
+
+    sheet = workbook.create_sheet("Summary")
+    sheet.append(bold_row(sheet, [summary["title"]]))
+    sheet.append([summary["period"]])
+    sheet.append([])
+    for row in summary["totals"]:
+        sheet.append(list(row))
+    sheet.append([])
+    sheet.append(bold_row(sheet, ["Category", "Records", "Stars added"]))
+    for row in summary["categories"]:
+        sheet.append(list(row))
+
+    sheet = workbook.create_sheet("Daily")
+    sheet.append(bold_row(sheet, DAILY_COLUMNS))
+    for row in summary["daily"]:
+        sheet.append(list(row))
+
+    sheet = workbook.create_sheet("Records")
+    sheet.append(bold_row(sheet, RECORD_COLUMNS))
+    for row in stream_records(db, job["child_id"], job["period"], job["period_start"]):
+        sheet.append(list(row))
+
+    workbook.save(path)
+
+
+def write_pdf(db: Session, job: dict, summary: dict, path: str):
+    from reportlab.lib import colors
+    from reportlab.lib.pagesizes import A4
+    from reportlab.lib.styles import getSampleStyleSheet
+    from reportlab.pdfbase import pdfmetrics
+    from reportlab.pdfbase.cidfonts import UnicodeCIDFont
+    from reportlab.platypus import Paragraph, SimpleDocTemplate, Spacer, Table, TableStyle
+
+    if PDF_FONT not in pdfmetrics.getRegisteredFontNames():
+        pdfmetrics.registerFont(UnicodeCIDFont(PDF_FONT))
+    styles = getSampleStyleSheet()
+    for style in styles.byName.values():
+        style.fontName = PDF_FONT
+    table_style = TableStyle([
+        ("FONTNAME", (0, 0), (-1, -1), PDF_FONT),
+        ("FONTSIZE", (0, 0), (-1, -1), 9),
+        ("BACKGROUND", (0, 0), (-1, 0), colors.lightgrey),
+        ("GRID", (0, 0), (-1, -1), 0.5, colors.grey),
+    ])
+
+    def table(header, rows):
+        result = Table([list(header)] + [list(row) for row in rows], repeatRows=1)
+        result.setStyle(table_style)
+        return result
+
+    story = [
+        Paragraph(summary["title"], styles["Title"]),
+        Paragraph(summary["period"], styles["Normal"]),
+        Spacer(1, 12),
+        table(("Total", "Value"), summary["totals"]),
+        Spacer(1, 12),
+        table(DAILY_COLUMNS, summary["daily"]),
+        Spacer(1, 12),
+    ]
+    if summary["categories"]:
+        story += [table(("Category", "Records", "Stars added"), summary["categories"]), Spacer(1, 12)]
+    records = list(stream_records(db, job["child_id"], job["period"], job["period_start"]))
+    if records:
+        story.append(table(RECORD_COLUMNS, records))
+    SimpleDocTemplate(path, pagesize=A4, title=summary["title"]).build(story)
+
+
+WRITERS = {"xlsx": write_xlsx, "pdf": write_pdf}
+
+
+def render_report(job: dict, target: str):
+    """Write the report described by ``job`` to ``target``; runs in a worker process"""
+    Path(target).parent.mkdir(parents=True, exist_ok=True)
+    fd, temp_path = tempfile.mkstemp(dir=Path(target).parent, suffix=".part")
+    os.close(fd)
+    try:
+        with SessionLocal() as db:
+            summary = report_summary(db, job["child_id"], job["period"], job["period_start"])
+            WRITERS[job["format"]](db, job, summary, temp_path)
+        os.replace(temp_path, target)
+    except BaseException:
+        os.unlink(temp_path)
+        raise
@@ -0,0 +1,244 @@
+"""Weekly and monthly report jobs
+
+``POST /api/reports`` only records a job and returns its status URL; the
+dispatcher started with the app claims pending jobs and renders them in
+a process pool (see app.services.report_rendering), ``REPORT_WORKERS`` at
+a time. Each API worker runs a dispatcher, and a job is claimed with a
+conditional UPDATE, so only one of them renders it.
+
+A finished report is stored under ``REPORT_DIR`` and identified by child,
+period, format and the data version of that child's period: the number
+and the highest id of its star records, and a digest of the child's name
+and of the rewards they were redeemed for, which the report shows too.
+Asking again for a report whose data has not changed returns the existing
+job, so repeat downloads cost one lookup. A new record or a renamed child
+or reward changes the version, and the next request queues a fresh
+report; once it is done the superseded file is deleted.
+
+Jobs left running by a crashed worker are queued again after
+``REPORT_JOB_TIMEOUT_SECONDS``.
+"""
+import asyncio
+import hashlib
+from datetime import date, timedelta
+from pathlib import Path
+from typing import List, Optional
+
+from loguru import logger
+from sqlalchemy import delete, func, select, update
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from app.core.clock import utc_now
+from app.core.config import settings
+from app.core.database import async_engine
+from app.core.process_pool import WorkerPool
+from app.models import Child, ReportJob, Reward, StarRecord
+from app.services.report_rendering import period_bounds, render_report
+
+jobs = ReportJob.__table__
+
+pool = WorkerPool("report", lambda: settings.report_workers)
+_wakeup: Optional[asyncio.Event] = None
+
+
+def report_root() -> Path:
+    return Path(settings.report_dir)
+
+
+def period_start(period: str, day: date) -> date:
+    """First day of the weekly (Monday to Sunday) or monthly period containing ``day``"""
+    if period == "weekly":
+        return day - timedelta(days=day.weekday())
+    return day.replace(day=1)
+
+
+def artifact_name(job: ReportJob) -> str:
+    return f"{job.child_id}/{job.period}-{job.period_start.isoformat()}-{job.id}.{job.format}"
+
+
+async def data_version(db: AsyncSession, child_id: int, period: str, start: date) -> str:
+    """Fingerprint of everything the child's report of the period shows"""
+    since, until = period_bounds(period, start)
+    in_period = (StarRecord.child_id == child_id, StarRecord.created_at >= since, StarRecord.created_at < until)
+    count, max_id, child_name = (await db.execute(
+        select(func.count(), func.max(StarRecord.id), select(Child.name).where(Child.id == child_id).scalar_subquery())
+        .where(*in_period)
+    )).one()
+    rewards = (await db.execute(
+        select(Reward.id, Reward.name).distinct()
+        .join(StarRecord, StarRecord.reward_id == Reward.id)
+        .where(*in_period)
+        .order_by(Reward.id)
+    )).all()
+    names = "\n".join([child_name or "", *(f"{reward_id}:{name}" for reward_id, name in rewards)])
+    return f"{count}.{max_id or 0}.{hashlib.sha1(names.encode()).hexdigest()[:12]}"
+
+
+async def find_report(
+    db: AsyncSession, child_id: int, period: str, start: date, report_format: str, version: str
+) -> Optional[ReportJob]:
+    """The latest job for exactly this data that has not failed"""
+    result = await db.execute(
+        select(ReportJob)
+        .where(
+            ReportJob.child_id == child_id,
+            ReportJob.period == period,
+            ReportJob.format == report_format,
+            ReportJob.period_start == start,
+            ReportJob.data_version == version,
+            ReportJob.status != "failed",
+        )
+        .order_by(ReportJob.id.desc())
+        .limit(1)
+    )
+    return result.scalars().first()
+
+
+async def create_job(child_id: int, period: str, start: date, report_format: str, version: str) -> ReportJob:
+    """Queue a job through its own connection: job bookkeeping is not a data change,
+    so it must not bump the data version behind ETags and caches"""
+    async with async_engine.begin() as conn:
+        result = await conn.execute(
+            jobs.insert().values(
+                child_id=child_id, period=period, period_start=start,
+                format=report_format, data_version=version, status="pending"
+            )
+        )
+        # MySQL has no INSERT ... RETURNING; read back the defaults
+        row = (await conn.execute(select(jobs).where(jobs.c.id == result.inserted_primary_key[0]))).one()
+        job = ReportJob(**row._mapping)
+    notify_dispatcher()
+    return job
+
+
+async def get_job(job_id: int) -> Optional[ReportJob]:
+    async with async_engine.connect() as conn:
+        row = (await conn.execute(select(jobs).where(jobs.c.id == job_id))).first()
+    return ReportJob(**row._mapping) if row is not None else None
+
+
+def shutdown_executor():
+    pool.shutdown()
+
+
+def notify_dispatcher():
+    """Wake this process's dispatcher after queueing a job"""
+    if _wakeup is not None:
+        _wakeup.set()
+
+
+async def claim_next_job() -> Optional[ReportJob]:
+    """Mark the oldest pending job running and return it, or None if there is none"""
+    async with async_engine.begin() as conn:
+        while True:
+            row = (await conn.execute(
+                select(jobs).where(jobs.c.status == "pending").order_by(jobs.c.id).limit(1)
+            )).first()
+            if row is None:
+                return None
+            claimed = await conn.execute(
+                update(jobs)
+                .where(jobs.c.id == row.id, jobs.c.status == "pending")
+                .values(status="running", started_at=utc_now())
+            )
+            if claimed.rowcount == 1:
+                return ReportJob(**row._mapping)
+
+
+async def remove_superseded(job: ReportJob) -> List[str]:
+    """Delete older finished reports of the same child, period and format; returns their files"""
+    async with async_engine.begin() as conn:
+        superseded = (await conn.execute(
+            select(jobs.c.id, jobs.c.artifact).where(
+                jobs.c.child_id == job.child_id,
+                jobs.c.period == job.period,
+                jobs.c.format == job.format,
+                jobs.c.period_start == job.period_start,
+                jobs.c.status == "done",
+                jobs.c.id < job.id,
+            )
+        )).all()
+        if superseded:
+            await conn.execute(delete(jobs).where(jobs.c.id.in_([row.id for row in superseded])))
+    return [row.artifact for row in superseded if row.artifact]
+
+
+def delete_artifacts(artifacts: List[str]):
+    for artifact in artifacts:
+        (report_root() / artifact).unlink(missing_ok=True)
+
+
+async def run_job(job: ReportJob):
+    """Render a claimed job and record the outcome"""
+    artifact = artifact_name(job)
+    spec = {
+        "child_id": job.child_id,
+        "period": job.period,
+        "period_start": job.period_start,
+        "format": job.format,
+    }
+    try:
+        await pool.run(render_report, spec, str((report_root() / artifact).resolve()))
+    except Exception as e:
+        logger.error(f"Error rendering report job {job.id}: {e}")
+        async with async_engine.begin() as conn:
+            await conn.execute(
+                update(jobs).where(jobs.c.id == job.id)
+                .values(status="failed", error=str(e)[:255] or type(e).__name__, finished_at=utc_now())
+            )
+        return
+
+    async with async_engine.begin() as conn:
+        await conn.execute(
+            update(jobs).where(jobs.c.id == job.id)
+            .values(status="done", artifact=artifact, finished_at=utc_now())
+        )
+    delete_artifacts(await remove_superseded(job))
+    logger.info(f"Rendered {job.period} {job.format} report {job.id} of child {job.child_id}")
+
+
+async def requeue_stale_jobs() -> int:
+    """Queue running jobs older than the job timeout again; returns how many"""
+    cutoff = utc_now() - timedelta(seconds=settings.report_job_timeout_seconds)
+    async with async_engine.begin() as conn:
+        result = await conn.execute(
+            update(jobs)
+            .where(jobs.c.status == "running", jobs.c.started_at < cutoff)
+            .values(status="pending", started_at=None)
+        )
+    return result.rowcount
+
+
+async def run_pending_jobs() -> int:
+    """Render pending jobs, ``REPORT_WORKERS`` at a time, until none are left; returns how many ran"""
+    ran = 0
+    while True:
+        claimed = []
+        for _ in range(settings.report_workers):
+            job = await claim_next_job()
+            if job is None:
+                break
+            claimed.append(job)
+        if not claimed:
+            return ran
+        await asyncio.gather(*(run_job(job) for job in claimed))
+        ran += len(claimed)
+
+
+async def run_dispatcher():
+    """Background loop rendering queued report jobs"""
+    global _wakeup
+    _wakeup = asyncio.Event()
+    while True:
+        try:
+            requeued = await requeue_stale_jobs()
+            if requeued:
+                logger.warning(f"Requeued {requeued} report jobs that exceeded the job timeout")
+            await run_pending_jobs()
+        except Exception as e:
+            logger.error(f"Error dispatching report jobs: {e}")
+        try:
+            await asyncio.wait_for(_wakeup.wait(), timeout=settings.report_poll_interval_seconds)
+        except asyncio.TimeoutError:
+            pass
+        _wakeup.clear()
@@ -0,0 +1,158 @@
+"""Reward queries and redemption shared by the reward and child endpoints"""
+from datetime import datetime
+from typing import Dict, Sequence
+
+from sqlalchemy import Float, bindparam, case, cast, func, insert, select, update
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from app.core.clock import utc_now
+from app.models import Child, Reward
+from app.models.reward import reward_children
+from app.schemas.reward import DeductionItem
+from app.services.stars import insert_star_records
+from app.services.upsert import upsert_statement
+
+
+def reward_progress_subquery():
+    """Per-reward sum of participating children's stars, computed with one GROUP BY"""
+    return (
+        select(
+            reward_children.c.reward_id.label("reward_id"),
+            func.sum(Child.star_count).label("total_stars")
+        )
+        .join(Child, Child.id == reward_children.c.child_id)
+        .group_by(reward_children.c.reward_id)
+        .subquery("reward_progress")
+    )
+
+
+def select_rewards_with_progress(progress=None):
+    """SELECT Reward, total_stars, is_achieved with progress joined from the aggregate"""
+    progress = progress if progress is not None else reward_progress_subquery()
+    total_stars = func.coalesce(progress.c.total_stars, 0)
+    return (
+        select(
+            Reward,
+            total_stars.label("total_stars"),
+            (total_stars >= Reward.star_cost).label("is_achieved")
+        )
+        .outerjoin(progress, progress.c.reward_id == Reward.id)
+    )
+
+
+def progress_ratio(progress):
+    """Sortable completion ratio of a reward (total stars / star cost)"""
+    return cast(func.coalesce(progress.c.total_stars, 0), Float) / Reward.star_cost
+
+
+class RedemptionError(Exception):
+    """A redemption request that cannot be fulfilled; carries the HTTP status to answer with"""
+
+    def __init__(self, message: str, status_code: int = 400):
+        super().__init__(message)
+        self.message = message
+        self.status_code = status_code
+
+
+async def record_deductions(db: AsyncSession, reward_id: int, amounts: Dict[int, int], now: datetime):
+    """Store each child's deduction_amount on the reward_children pivot"""
+    rows = [
+        {"reward_id": reward_id, "child_id": child_id, "deduction_amount": amount, "created_at": now, "updated_at": now}
+        for child_id, amount in amounts.items()
+    ]
+    stmt = upsert_statement(
+        db.bind.dialect.name, reward_children, rows,
+        conflict_columns=["reward_id", "child_id"],
+        update_columns=["deduction_amount", "updated_at"]
+    )
+    if stmt is not None:
+        await db.execute(stmt)
+        return
+
+    existing = set((await db.execute(
+        select(reward_children.c.child_id)
+        .where(reward_children.c.reward_id == reward_id, reward_children.c.child_id.in_(amounts))
+    )).scalars())
+    updates = [
+        {"b_child_id": row["child_id"], "deduction_amount": row["deduction_amount"], "updated_at": now}
+        for row in rows if row["child_id"] in existing
+    ]
+    if updates:
+        await db.execute(
+            update(reward_children)
+            .where(reward_children.c.reward_id == reward_id, reward_children.c.child_id == bindparam("b_child_id")),
+            updates
+        )
+    inserts = [row for row in rows if row["child_id"] not in existing]
+    if inserts:
+        await db.execute(insert(reward_children), inserts)
+
+
+async def apply_redemption(db: AsyncSession, reward_id: int, deductions: Sequence[DeductionItem]):
+    """Redeem a reward, deducting each contributing child's stars
+
+    Claims the reward with a conditional UPDATE (is_redeemed = false), so a
+    concurrent second redemption fails instead of deducting twice, then
+    applies all deductions with one guarded UPDATE, one pivot upsert and
+    one bulk insert of redeem records. The caller owns the transaction.
+    """
+    reward = await db.get(Reward, reward_id)
+    if not reward:
+        raise RedemptionError("Reward not found", status_code=404)
+    if reward.is_redeemed:
+        raise RedemptionError("Reward already redeemed")
+
+    # Validate total deduction >= star_cost
+    if sum(d.amount for d in deductions) < reward.star_cost:
+        raise RedemptionError("Total deduction is less than required stars")
+
+    amounts: Dict[int, int] = {}
+    for deduction in deductions:
+        amounts[deduction.child_id] = amounts.get(deduction.child_id, 0) + deduction.amount
+
+    # Validate every child with one query
+    rows = await db.execute(select(Child.id, Child.name, Child.star_count).where(Child.id.in_(amounts)))
+    children = {child_id: (name, star_count) for child_id, name, star_count in rows}
+    for child_id, amount in amounts.items():
+        if child_id not in children:
+            raise RedemptionError(f"Child {child_id} not found")
+        name, star_count = children[child_id]
+        if star_count < amount:
+            raise RedemptionError(f"Child {name} doesn't have enough stars")
+
+    now = utc_now()
+    claimed = await db.execute(
+        update(Reward)
+        .where(Reward.id == reward_id, Reward.is_redeemed.is_(False))
+        .values(is_redeemed=True, redeemed_at=now)
+        .execution_options(synchronize_session=False)
+    )
+    if claimed.rowcount != 1:
+        raise RedemptionError("Reward already redeemed")
+
+    # Skip children who contribute nothing, like the PHP backend
+    amounts = {child_id: amount for child_id, amount in amounts.items() if amount > 0}
+    if amounts:
+        amount_expr = case(amounts, value=Child.id, else_=0)
+        deducted = await db.execute(
+            update(Child)
+            .where(Child.id.in_(amounts), Child.star_count >= amount_expr)
+            .values(star_count=Child.star_count - amount_expr)
+            .execution_options(synchronize_session=False)
+        )
+        if deducted.rowcount != len(amounts):
+            # Stars were spent by a concurrent request after validation
+            raise RedemptionError("Not enough stars, balances changed during redemption", status_code=409)
+
+        await record_deductions(db, reward_id, amounts, now)
+        await insert_star_records(db, [
+            {
+                "child_id": child_id,
+                "type": "redeem",
+                "amount": -amount,  # Store as negative like PHP
+                "reason": None,  # PHP doesn't set reason for redeem
+                "reward_id": reward_id,
+                "created_at": now
+            }
+            for child_id, amount in amounts.items()
+        ])
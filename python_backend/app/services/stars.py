@@ -0,0 +1,265 @@
+"""Star balance mutations
+
+Balances are changed with a single conditional UPDATE instead of a
+read-modify-write in Python, so concurrent requests can neither lose
+updates nor drive a balance negative.
+
+Every star record also increments its child's row in star_daily_rollups
+for the record's day and type, in the same transaction, so the daily
+stats endpoint reads a few rows per child and day however long the
+history grows. Records are stamped here with ``utc_now()``, the
+application's clock, so a record and its rollup day always agree.
+"""
+from dataclasses import dataclass
+from datetime import date
+from typing import Dict, List, Optional, Sequence, Tuple
+
+from sqlalchemy import case, insert, select, update
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from app.core.clock import utc_now
+from app.models import Child, StarDailyRollup, StarRecord
+from app.schemas import StarOperation
+from app.services.categories import categorize_records
+from app.services.upsert import upsert_statement
+
+# Largest single "add" accepted, matching the PHP backend
+MAX_ADD_AMOUNT = 50
+
+
+class ChildNotFoundError(Exception):
+    """Raised when a star mutation targets a child that does not exist"""
+
+    def __init__(self, child_id: int):
+        super().__init__(f"Child {child_id} not found")
+        self.child_id = child_id
+
+
+class InsufficientStarsError(Exception):
+    """Raised when a subtraction would make a child's balance negative"""
+
+    def __init__(self, child_id: int):
+        super().__init__(f"Child {child_id} has insufficient stars")
+        self.child_id = child_id
+
+
+class ConcurrentBalanceChangeError(Exception):
+    """Raised when balances changed between validating and applying a batch"""
+
+
+@dataclass
+class OperationResult:
+    index: int
+    child_id: int
+    success: bool
+    message: Optional[str] = None
+
+    def to_dict(self) -> dict:
+        result = {"index": self.index, "child_id": self.child_id, "success": self.success}
+        if self.message:
+            result["message"] = self.message
+        return result
+
+
+async def insert_star_records(db: AsyncSession, records: List[dict]):
+    """Insert star records in one statement (executemany for several rows)
+
+    Every StarRecord insert goes through here so derived data can be
+    maintained in the same transaction: the behavior category of each
+    record and the daily rollups. Records without ``created_at`` are
+    stamped with one ``utc_now()``, from which their rollup day is derived.
+    """
+    if not records:
+        return
+    now = utc_now()
+    for record in records:
+        record.setdefault("created_at", now)
+    await categorize_records(db, records)
+    if len(records) == 1:
+        await db.execute(insert(StarRecord).values(**records[0]))
+    else:
+        await db.execute(insert(StarRecord), records)
+    await add_to_daily_rollups(db, records)
+
+
+def daily_rollup_rows(records: List[dict]) -> List[dict]:
+    """One star_daily_rollups increment per (child, day, type) in ``records``
+
+    Rows are sorted so that concurrent batches lock rollup rows in the
+    same order.
+    """
+    totals: Dict[Tuple[int, date, str], List[int]] = {}
+    for record in records:
+        key = (record["child_id"], record["created_at"].date(), record["type"])
+        total = totals.setdefault(key, [0, 0])
+        total[0] += 1
+        total[1] += record["amount"]
+    return [
+        {
+            "child_id": child_id,
+            "day": day,
+            "type": record_type,
+            "record_count": count,
+            "total_amount": amount
+        }
+        for (child_id, day, record_type), (count, amount)
+        in sorted(totals.items())
+    ]
+
+
+async def add_to_daily_rollups(db: AsyncSession, records: List[dict]):
+    """Add ``records`` to their children's daily rollups, in one upsert where supported"""
+    rows = daily_rollup_rows(records)
+    stmt = upsert_statement(
+        db.bind.dialect.name, StarDailyRollup.__table__, rows,
+        conflict_columns=["child_id", "day", "type"],
+        update_columns=[],
+        increment_columns=["record_count", "total_amount"]
+    )
+    if stmt is not None:
+        await db.execute(stmt)
+        return
+
+    for row in rows:
+        incremented = await db.execute(
+            update(StarDailyRollup)
+            .where(
+                StarDailyRollup.child_id == row["child_id"],
+                StarDailyRollup.day == row["day"],
+                StarDailyRollup.type == row["type"]
+            )
+            .values(
+                record_count=StarDailyRollup.record_count + row["record_count"],
+                total_amount=StarDailyRollup.total_amount + row["total_amount"]
+            )
+            .execution_options(synchronize_session=False)
+        )
+        if incremented.rowcount == 0:
+            await db.execute(insert(StarDailyRollup).values(**row))
+
+
+async def change_star_balance(
+    db: AsyncSession,
+    child_id: int,
+    delta: int,
+    record_type: str,
+    reason: Optional[str] = None,
+    reward_id: Optional[int] = None
+) -> int:
+    """Apply ``delta`` to a child's balance and record it, returning the new balance
+
+    The caller owns the transaction and must commit. Negative deltas only
+    apply while the balance covers them.
+    """
+    stmt = (
+        update(Child)
+        .where(Child.id == child_id)
+        .values(star_count=Child.star_count + delta)
+        .execution_options(synchronize_session=False)
+    )
+    if delta < 0:
+        stmt = stmt.where(Child.star_count >= -delta)
+
+    if db.bind.dialect.update_returning:
+        result = await db.execute(stmt.returning(Child.star_count))
+        new_balance = result.scalar_one_or_none()
+    else:
+        # e.g. MySQL: the updated row stays locked by this transaction,
+        # so reading it back cannot observe another writer's change
+        result = await db.execute(stmt)
+        new_balance = None
+        if result.rowcount == 1:
+            new_balance = (await db.execute(select(Child.star_count).where(Child.id == child_id))).scalar_one()
+
+    if new_balance is None:
+        exists = (await db.execute(select(Child.id).where(Child.id == child_id))).first()
+        if exists is None:
+            raise ChildNotFoundError(child_id)
+        raise InsufficientStarsError(child_id)
+
+    await insert_star_records(db, [{
+        "child_id": child_id,
+        "type": record_type,
+        "amount": delta,
+        "reason": reason,
+        "reward_id": reward_id
+    }])
+    return new_balance
+
+
+def validate_star_operations(operations: Sequence[StarOperation], balances: Dict[int, int]) -> List[OperationResult]:
+    """Check each operation in order against the running balance of its child"""
+    running = dict(balances)
+    results = []
+    for index, operation in enumerate(operations):
+        child_id = operation.child_id
+        message = None
+        if child_id not in running:
+            message = "Child not found"
+        elif operation.type == "add" and operation.amount > MAX_ADD_AMOUNT:
+            message = f"Amount cannot be more than {MAX_ADD_AMOUNT}"
+        elif operation.type == "subtract" and running[child_id] < operation.amount:
+            message = "Not enough stars"
+        else:
+            running[child_id] += operation.amount if operation.type == "add" else -operation.amount
+        results.append(OperationResult(index=index, child_id=child_id, success=message is None, message=message))
+    return results
+
+
+async def apply_star_operations(
+    db: AsyncSession,
+    operations: Sequence[StarOperation],
+    atomic: bool = True
+) -> tuple[List[OperationResult], Dict[int, int]]:
+    """Validate and apply a batch of add/subtract operations
+
+    Uses one SELECT to validate, one executemany INSERT for the star
+    records and one UPDATE for all balances. Returns the per-operation
+    results and the new balance of every child that changed. When
+    ``atomic`` is set and any operation is invalid, nothing is written.
+    The caller owns the transaction and must commit.
+    """
+    child_ids = {operation.child_id for operation in operations}
+    rows = await db.execute(select(Child.id, Child.star_count).where(Child.id.in_(child_ids)))
+    balances = {child_id: star_count for child_id, star_count in rows}
+
+    results = validate_star_operations(operations, balances)
+    accepted = [operations[result.index] for result in results if result.success]
+    if not accepted or (atomic and len(accepted) != len(operations)):
+        return results, {}
+
+    deltas: Dict[int, int] = {}
+    records = []
+    for operation in accepted:
+        delta = operation.amount if operation.type == "add" else -operation.amount
+        deltas[operation.child_id] = deltas.get(operation.child_id, 0) + delta
+        records.append({
+            "child_id": operation.child_id,
+            "type": operation.type,
+            "amount": delta,
+            "reason": operation.reason,
+            "reward_id": None
+        })
+
+    await insert_star_records(db, records)
+
+    delta_expr = case(deltas, value=Child.id, else_=0)
+    stmt = (
+        update(Child)
+        .where(Child.id.in_(deltas), Child.star_count + delta_expr >= 0)
+        .values(star_count=Child.star_count + delta_expr)
+        .execution_options(synchronize_session=False)
+    )
+    if db.bind.dialect.update_returning:
+        updated = dict((await db.execute(stmt.returning(Child.id, Child.star_count))).all())
+    else:
+        result = await db.execute(stmt)
+        updated = {}
+        if result.rowcount == len(deltas):
+            rows = await db.execute(select(Child.id, Child.star_count).where(Child.id.in_(deltas)))
+            updated = dict(rows.all())
+
+    if len(updated) != len(deltas):
+        # A concurrent request spent stars (or deleted a child) after validation
+        raise ConcurrentBalanceChangeError("Star balances changed while applying the batch")
+    return results, updated
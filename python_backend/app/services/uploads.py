@@ -0,0 +1,275 @@
+"""Streaming, content-addressed storage of uploaded images under public/storage
+
+Uploads are copied in fixed-size chunks: each chunk is written to a
+temporary file and fed to the hash in the thread pool, so neither the
+whole file nor the blocking disk IO ever sits on the event loop. The
+size limit is enforced while streaming and the file type is taken from
+the magic bytes of the first chunk, not from the client's filename.
+
+Files are named after their sha256 (``blobs/ab/ab12...ef.png``), so an
+identical upload lands on the existing file instead of a new copy, and a
+stored file never changes. The ``upload_blobs`` table counts the
+children.avatar / rewards.image values pointing at each blob; a blob and
+its resized variants are unlinked only once that count drops to zero.
+Paths outside ``blobs/`` predate the store (see migrate_uploads.py) and
+are deleted directly.
+
+An upload is moved into place only after its blob row is written, and a
+released blob is unlinked only after re-checking its row under the same
+row lock. A release racing an identical upload therefore either sees the
+upload's row and keeps the file, or unlinks it before the upload moves
+its copy in.
+"""
+import hashlib
+import os
+import tempfile
+from dataclasses import dataclass
+from pathlib import Path
+from typing import Iterable, Optional
+
+from fastapi import UploadFile
+from sqlalchemy import delete, update
+from sqlalchemy.ext.asyncio import AsyncSession
+from starlette.concurrency import run_in_threadpool
+
+from app.core import storage
+from app.core.config import settings
+from app.core.database import async_engine
+from app.core.storage import BLOB_DIR, blob_path, is_blob_path
+from app.models import UploadBlob
+from app.services.image_variants import VARIANT_SIZES, variant_path
+from app.services.upsert import upsert_statement
+
+CHUNK_SIZE = 1024 * 1024
+
+# Leading bytes of the image formats we accept, mapped to the stored extension
+IMAGE_SIGNATURES = (
+    (b"\xff\xd8\xff", ".jpg"),
+    (b"\x89PNG\r\n\x1a\n", ".png"),
+    (b"GIF87a", ".gif"),
+    (b"GIF89a", ".gif"),
+)
+
+
+class UploadError(Exception):
+    """An upload that was rejected; carries the HTTP status to answer with"""
+
+    def __init__(self, message: str, status_code: int = 400):
+        super().__init__(message)
+        self.message = message
+        self.status_code = status_code
+
+
+@dataclass
+class StoredUpload:
+    path: str  # relative to public/storage, as stored in the database
+    size: int
+    sha256: str
+    temp_path: str  # where the upload waits until retain_upload moves it to ``path``
+
+
+def detect_image_type(head: bytes) -> Optional[str]:
+    """Extension of the image format ``head`` starts with, or None"""
+    for signature, extension in IMAGE_SIGNATURES:
+        if head.startswith(signature):
+            return extension
+    if head[:4] == b"RIFF" and head[8:12] == b"WEBP":
+        return ".webp"
+    return None
+
+
+def _open_temp_file(directory: Path):
+    directory.mkdir(parents=True, exist_ok=True)
+    fd, temp_path = tempfile.mkstemp(dir=directory, suffix=".part")
+    return os.fdopen(fd, "wb"), temp_path
+
+
+def _write_chunk(handle, digest, chunk: bytes):
+    handle.write(chunk)
+    digest.update(chunk)
+
+
+def _finish(handle):
+    handle.flush()
+    os.fsync(handle.fileno())
+    handle.close()
+
+
+def _move_into_place(temp_path: str, final_path: Path):
+    final_path.parent.mkdir(parents=True, exist_ok=True)
+    # Replacing an existing blob is harmless: same name, same bytes
+    os.replace(temp_path, final_path)
+
+
+def _discard(handle, temp_path: str):
+    handle.close()
+    try:
+        os.unlink(temp_path)
+    except FileNotFoundError:
+        pass
+
+
+async def save_upload(file: UploadFile, max_size: Optional[int] = None) -> StoredUpload:
+    """Stream ``file`` into a temporary file of the blob store and return where it goes
+
+    The caller records the reference with ``retain_upload`` in the
+    transaction that saves the path, which moves the file into place, and
+    calls ``discard_upload`` if that transaction is rolled back. Raises
+    UploadError (413) once more than ``max_size`` bytes arrive and
+    UploadError (400) when the content is not a supported image.
+    """
+    max_size = settings.max_upload_size if max_size is None else max_size
+    if file.size is not None and file.size > max_size:
+        raise UploadError(f"File too large. Maximum size: {max_size} bytes", status_code=413)
+
+    # Temp files live in the store so the final rename never crosses filesystems
+    handle, temp_path = await run_in_threadpool(_open_temp_file, storage.STORAGE_ROOT / BLOB_DIR)
+    digest = hashlib.sha256()
+    size = 0
+    extension = None
+    try:
+        while chunk := await file.read(CHUNK_SIZE):
+            if extension is None:
+                extension = detect_image_type(chunk)
+                if extension is None:
+                    raise UploadError("Unsupported file content. Allowed types: jpg, png, gif, webp")
+            size += len(chunk)
+            if size > max_size:
+                raise UploadError(f"File too large. Maximum size: {max_size} bytes", status_code=413)
+            await run_in_threadpool(_write_chunk, handle, digest, chunk)
+
+        if extension is None:
+            raise UploadError("Uploaded file is empty")
+
+        sha256 = digest.hexdigest()
+        await run_in_threadpool(_finish, handle)
+    except BaseException:
+        await run_in_threadpool(_discard, handle, temp_path)
+        raise
+
+    return StoredUpload(path=blob_path(sha256, extension), size=size, sha256=sha256, temp_path=temp_path)
+
+
+async def retain_upload(db: AsyncSession, stored: StoredUpload):
+    """Count one more reference to a just-saved upload and move it into place
+
+    The blob row is written first, so the transaction holds its lock while
+    the file is moved in (see ``delete_released_files``).
+    """
+    row = {"sha256": stored.sha256, "path": stored.path, "size": stored.size, "ref_count": 1}
+    table = UploadBlob.__table__
+    stmt = upsert_statement(
+        db.bind.dialect.name, table, [row],
+        conflict_columns=["sha256"],
+        update_columns=[],
+        increment_columns=["ref_count"]
+    )
+    if stmt is not None:
+        await db.execute(stmt)
+    else:
+        retained = await db.execute(
+            update(UploadBlob)
+            .where(UploadBlob.sha256 == stored.sha256)
+            .values(ref_count=UploadBlob.ref_count + 1)
+            .execution_options(synchronize_session=False)
+        )
+        if retained.rowcount == 0:
+            db.add(UploadBlob(**row))
+            await db.flush()
+    await run_in_threadpool(_move_into_place, stored.temp_path, storage.STORAGE_ROOT / stored.path)
+
+
+async def retain_path(db: AsyncSession, path: Optional[str]):
+    """Count one more reference to an already stored blob, e.g. a path copied from another row"""
+    if is_blob_path(path):
+        await db.execute(
+            update(UploadBlob)
+            .where(UploadBlob.path == path)
+            .values(ref_count=UploadBlob.ref_count + 1)
+            .execution_options(synchronize_session=False)
+        )
+
+
+async def release_path(db: AsyncSession, path: Optional[str]) -> Optional[str]:
+    """Drop one reference to ``path``; returns the file to delete after commit, if any
+
+    Pass the returned paths to ``delete_released_files`` once the
+    transaction has committed.
+    """
+    if not path:
+        return None
+    if not is_blob_path(path):
+        # Stored before the blob store existed; owned by this row alone
+        return path
+
+    await db.execute(
+        update(UploadBlob)
+        .where(UploadBlob.path == path)
+        .values(ref_count=UploadBlob.ref_count - 1)
+        .execution_options(synchronize_session=False)
+    )
+    unreferenced = await db.execute(
+        delete(UploadBlob)
+        .where(UploadBlob.path == path, UploadBlob.ref_count <= 0)
+        .execution_options(synchronize_session=False)
+    )
+    return path if unreferenced.rowcount else None
+
+
+def _unlink(path: Path):
+    # Legacy paths came from clients; never follow one out of the storage root
+    if not path.resolve().is_relative_to(storage.STORAGE_ROOT.resolve()):
+        return
+    try:
+        path.unlink()
+    except FileNotFoundError:
+        pass
+
+
+def _unlink_blob(path: str):
+    """Unlink a blob and the resized variants derived from it"""
+    _unlink(storage.STORAGE_ROOT / path)
+    for size in VARIANT_SIZES:
+        _unlink(storage.STORAGE_ROOT / variant_path(path, size))
+
+
+async def _delete_unreferenced_blob(path: str):
+    """Unlink blob ``path`` unless a row references it, holding the row lock meanwhile"""
+    async with async_engine.begin() as conn:
+        # A no-op UPDATE takes the lock an uncommitted retain_upload of the same
+        # blob holds (the database write lock on SQLite), so it waits for that
+        # upload to commit or roll back. Its own transaction keeps the data
+        # version untouched; rowcount counts matched rows on every dialect we use.
+        locked = await conn.execute(
+            update(UploadBlob).where(UploadBlob.path == path).values(ref_count=UploadBlob.ref_count)
+        )
+        if locked.rowcount == 0:
+            await run_in_threadpool(_unlink_blob, path)
+
+
+async def delete_released_files(paths: Iterable[Optional[str]]):
+    """Unlink files released by a committed transaction
+
+    A blob re-uploaded since its release has a row again and is kept.
+    """
+    for path in paths:
+        if not path:
+            continue
+        if is_blob_path(path):
+            await _delete_unreferenced_blob(path)
+        else:
+            await run_in_threadpool(_unlink, storage.STORAGE_ROOT / path)
+
+
+async def discard_upload(stored: Optional[StoredUpload]):
+    """Clean up an upload whose transaction was rolled back
+
+    Removes the temporary file, or the blob it was moved to if no row
+    references that blob.
+    """
+    if stored is None:
+        return
+    if await run_in_threadpool(os.path.exists, stored.temp_path):
+        await run_in_threadpool(_unlink, Path(stored.temp_path))
+    else:
+        await _delete_unreferenced_blob(stored.path)
@@ -0,0 +1,34 @@
+"""Dialect-specific INSERT ... ON CONFLICT statements"""
+from typing import List, Sequence
+
+from sqlalchemy.dialects import mysql, postgresql, sqlite
+
+
+def upsert_statement(
+    dialect_name: str,
+    table,
+    rows: List[dict],
+    conflict_columns: List[str],
+    update_columns: List[str],
+    increment_columns: Sequence[str] = ()
+):
+    """INSERT ... ON CONFLICT/ON DUPLICATE KEY UPDATE for dialects that support it, else None
+
+    On conflict, ``update_columns`` take the inserted values and
+    ``increment_columns`` add the inserted value to the existing one.
+    """
+    if dialect_name in ("sqlite", "postgresql"):
+        module = sqlite if dialect_name == "sqlite" else postgresql
+        stmt = module.insert(table).values(rows)
+        inserted = stmt.excluded
+    elif dialect_name == "mysql":
+        stmt = mysql.insert(table).values(rows)
+        inserted = stmt.inserted
+    else:
+        return None
+
+    values = {column: inserted[column] for column in update_columns}
+    values.update({column: table.c[column] + inserted[column] for column in increment_columns})
+    if dialect_name == "mysql":
+        return stmt.on_duplicate_key_update(values)
+    return stmt.on_conflict_do_update(index_elements=conflict_columns, set_=values)
@@ -0,0 +1,83 @@
+"""Assign behavior categories to existing star records from the current rules
+
+New records are categorized when they are inserted; run this once after
+``migrate_db.py`` adds the category column, and again after changing the
+rules to recategorize the history. Records are read in primary key order,
+``--chunk-size`` at a time, and each chunk's changed categories are
+written with one executemany UPDATE and committed, so an interrupted run
+can simply be restarted.
+"""
+import argparse
+
+from sqlalchemy import bindparam, select, update
+from sqlalchemy.orm import Session
+from loguru import logger
+
+from app.core.database import SessionLocal
+from app.models import CategoryRule, StarRecord
+from app.services.categories import CategoryMatcher
+
+# Star records categorized per transaction
+CHUNK_SIZE = 5000
+
+def load_matcher(db: Session) -> CategoryMatcher:
+    return CategoryMatcher(db.execute(select(CategoryRule.keyword, CategoryRule.category, CategoryRule.priority)).all())
+
+def categorize_chunk(db: Session, matcher: CategoryMatcher, after_id: int, chunk_size: int, missing_only: bool):
+    """Categorize the records following ``after_id``; returns (last id read, records read, records changed)"""
+    stmt = (
+        select(StarRecord.id, StarRecord.reason, StarRecord.category)
+        .where(StarRecord.id > after_id)
+        .order_by(StarRecord.id)
+        .limit(chunk_size)
+    )
+    if missing_only:
+        stmt = stmt.where(StarRecord.category.is_(None), StarRecord.reason.isnot(None))
+    rows = db.execute(stmt).all()
+    if not rows:
+        return after_id, 0, 0
+
+    changes = []
+    for record_id, reason, category in rows:
+        new_category = matcher.categorize(reason)
+        if new_category != category:
+            changes.append({"record_id": record_id, "new_category": new_category})
+    if changes:
+        db.execute(
+            update(StarRecord.__table__)
+            .where(StarRecord.__table__.c.id == bindparam("record_id"))
+            .values(category=bindparam("new_category")),
+            changes
+        )
+    db.commit()
+    return rows[-1][0], len(rows), len(changes)
+
+def backfill_categories(chunk_size: int = CHUNK_SIZE, missing_only: bool = False):
+    """Categorize every star record (or only uncategorized ones) ``chunk_size`` at a time"""
+    logger.info("Categorizing star records...")
+
+    db = SessionLocal()
+    read = changed = 0
+    last_id = 0
+    try:
+        matcher = load_matcher(db)
+        while True:
+            last_id, chunk_read, chunk_changed = categorize_chunk(db, matcher, last_id, chunk_size, missing_only)
+            if not chunk_read:
+                break
+            read += chunk_read
+            changed += chunk_changed
+            logger.info(f"Categorized {read} star records ({changed} changed)")
+    finally:
+        db.close()
+
+    logger.info(f"Read {read} star records, changed the category of {changed}")
+
+if __name__ == "__main__":
+    from app.core.logging import setup_logging
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--chunk-size", type=int, default=CHUNK_SIZE, help="star records categorized per transaction")
+    parser.add_argument("--missing-only", action="store_true", help="only records with a reason and no category yet")
+    args = parser.parse_args()
+    setup_logging()
+    backfill_categories(args.chunk_size, args.missing_only)
@@ -0,0 +1,82 @@
+"""Rebuild star_daily_rollups from the star_records history
+
+The API keeps the rollups current as records are written; run this once
+after ``migrate_db.py`` creates the table, or any time to rebuild it.
+Children are processed in chunks, each in its own transaction: the
+chunk's rollups are deleted and recomputed with one
+``INSERT ... SELECT ... GROUP BY``, so no chunk holds locks for long and an
+interrupted run can simply be restarted.
+
+On SQLite writers are serialized, so the API may keep running. On other
+databases, stop the API while it runs, or records written during a chunk
+may be counted twice or not at all.
+"""
+import argparse
+from typing import Optional, Sequence
+
+from sqlalchemy import Date, cast, delete, func, insert, select
+from sqlalchemy.orm import Session
+from loguru import logger
+
+from app.core.database import SessionLocal
+from app.models import Child, StarDailyRollup, StarRecord
+
+# Children rebuilt per transaction
+CHUNK_SIZE = 500
+
+def record_day(dialect_name: str):
+    """StarRecord.created_at truncated to its date, as the rollups store it"""
+    if dialect_name == "postgresql":
+        return cast(StarRecord.created_at, Date)
+    return func.date(StarRecord.created_at)
+
+def rollup_insert(dialect_name: str, child_ids: Optional[Sequence[int]] = None):
+    """INSERT ... SELECT computing the rollups of ``child_ids`` (all children if None)"""
+    day = record_day(dialect_name).label("day")
+    stmt = (
+        select(StarRecord.child_id, day, StarRecord.type, func.count(), func.sum(StarRecord.amount))
+        .group_by(StarRecord.child_id, day, StarRecord.type)
+    )
+    if child_ids is not None:
+        stmt = stmt.where(StarRecord.child_id.in_(child_ids))
+    return insert(StarDailyRollup).from_select(
+        ["child_id", "day", "type", "record_count", "total_amount"], stmt
+    )
+
+def rebuild_chunk(db: Session, child_ids: Sequence[int]) -> int:
+    """Recompute the rollups of ``child_ids`` and commit; returns the number of rollup rows"""
+    db.execute(delete(StarDailyRollup).where(StarDailyRollup.child_id.in_(child_ids)))
+    result = db.execute(rollup_insert(db.bind.dialect.name, child_ids))
+    db.commit()
+    return result.rowcount
+
+def backfill_rollups(chunk_size: int = CHUNK_SIZE):
+    """Rebuild the daily rollups of every child, ``chunk_size`` children at a time"""
+    logger.info("Rebuilding star_daily_rollups from star_records...")
+
+    db = SessionLocal()
+    children = rows = 0
+    last_id = 0
+    try:
+        while True:
+            child_ids = db.execute(
+                select(Child.id).where(Child.id > last_id).order_by(Child.id).limit(chunk_size)
+            ).scalars().all()
+            if not child_ids:
+                break
+            rows += rebuild_chunk(db, child_ids)
+            children += len(child_ids)
+            last_id = child_ids[-1]
+            logger.info(f"Rebuilt rollups of {children} children")
+    finally:
+        db.close()
+
+    logger.info(f"Rebuilt {rows} daily rollup rows for {children} children")
+
+if __name__ == "__main__":
+    from app.core.logging import setup_logging
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--chunk-size", type=int, default=CHUNK_SIZE, help="children rebuilt per transaction")
+    args = parser.parse_args()
+    setup_logging()
+    backfill_rollups(args.chunk_size)
@@ -0,0 +1,147 @@
+"""Star analytics benchmark: streaming load, vectorized statistics and the cached endpoint
+
+Usage:
+    python benchmarks/bench_analytics.py --star-records 1000000 --children 20 --output bench_analytics.json
+
+Seeds the same synthetic SQLite dataset as ``bench_api.py`` (records 30 s
+apart from 2024-01-01, so 1M records cover most of a year), then times:
+
+    load      the streamed query filling the NumPy arrays
+    compute   heatmap, distributions, moving averages and comparison
+    python    the heatmap and daily earned stars with plain Python loops over
+              the same rows, as a reference for the vectorized code
+    cold      GET /api/analytics/stars with an empty cache
+    warm      the same request answered from the cache
+
+Each step runs ``--repeat`` times; the report has the min and median in ms.
+"""
+import argparse
+import asyncio
+import json
+import statistics
+import sys
+import time
+from datetime import date
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parent))
+
+# Points the app at the benchmark database before importing it
+from bench_api import DATABASE_PATH, WORK_DIR, environment, seed
+
+import httpx
+import shutil
+from loguru import logger
+from sqlalchemy import select
+
+from app.core.database import AsyncSessionLocal
+from app.models import Child
+from app.services.analytics import (
+    SECONDS_PER_DAY,
+    TYPE_CODES,
+    UNIX_EPOCH,
+    analytics_available,
+    analytics_cache,
+    compute_star_analytics,
+    load_star_columns,
+)
+from main import app
+
+START = date(2024, 1, 1)
+END = date(2024, 12, 31)
+DAYS = (END - START).days + 1
+WINDOW = 7
+
+
+def python_reference(rows, child_ids):
+    """Heatmap and daily earned stars per child, one record at a time"""
+    heatmap = [[0] * 24 for _ in range(7)]
+    daily = {child_id: [0] * DAYS for child_id in child_ids}
+    first_day = (START - UNIX_EPOCH).days
+    for child_id, seconds, type_code, amount in rows:
+        day = seconds // SECONDS_PER_DAY - first_day
+        if not 0 <= day < DAYS:
+            continue
+        heatmap[(seconds // SECONDS_PER_DAY + 3) % 7][seconds % SECONDS_PER_DAY // 3600] += 1
+        if type_code == TYPE_CODES["add"]:
+            daily[child_id][day] += amount
+    return heatmap, daily
+
+
+def timings(values) -> dict:
+    return {"min_ms": round(min(values) * 1000, 3), "median_ms": round(statistics.median(values) * 1000, 3)}
+
+
+async def measure(repeat: int) -> dict:
+    async with AsyncSessionLocal() as db:
+        child_ids = (await db.execute(select(Child.id))).scalars().all()
+
+    results = {"load": [], "compute": [], "python": [], "cold": [], "warm": []}
+    for _ in range(repeat):
+        async with AsyncSessionLocal() as db:
+            started = time.perf_counter()
+            columns = await load_star_columns(db, child_ids, START, END)
+            results["load"].append(time.perf_counter() - started)
+
+        started = time.perf_counter()
+        compute_star_analytics(columns, child_ids, START, DAYS, WINDOW)
+        results["compute"].append(time.perf_counter() - started)
+
+        # The reference gets the rows as the database would return them
+        rows = [
+            (int(child_id), int((START - UNIX_EPOCH).days + day) * SECONDS_PER_DAY + int(hour) * 3600, int(kind), int(amount))
+            for child_id, day, hour, kind, amount
+            in zip(columns.child_id, columns.day, columns.hour, columns.type, columns.amount)
+        ]
+        started = time.perf_counter()
+        python_reference(rows, child_ids)
+        results["python"].append(time.perf_counter() - started)
+
+    params = {"from": str(START), "to": str(END), "window": WINDOW}
+    transport = httpx.ASGITransport(app=app)
+    async with httpx.AsyncClient(transport=transport, base_url="http://bench", timeout=None) as client:
+        for _ in range(repeat):
+            analytics_cache.clear()
+            for step in ("cold", "warm"):
+                started = time.perf_counter()
+                response = await client.get("/api/analytics/stars", params=params)
+                results[step].append(time.perf_counter() - started)
+                response.raise_for_status()
+
+    report = {step: timings(values) for step, values in results.items()}
+    report["records"] = len(columns)
+    return report
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--children", type=int, default=20)
+    parser.add_argument("--star-records", type=int, default=1000000)
+    parser.add_argument("--repeat", type=int, default=3)
+    parser.add_argument("--seed", type=int, default=42)
+    parser.add_argument("--output", type=Path, default=Path("bench_analytics.json"), help="where to write the JSON report")
+    args = parser.parse_args()
+
+    if not analytics_available():
+        parser.error("the analytics benchmark needs NumPy")
+    logger.remove()
+    logger.add(sys.stderr, level="ERROR")
+
+    started = time.perf_counter()
+    seed(DATABASE_PATH, args.children, args.star_records, 1, args.seed)
+    print(f"Seeded {args.children} children and {args.star_records} star records "
+          f"in {time.perf_counter() - started:.1f}s", file=sys.stderr)
+
+    report = {
+        "config": {"children": args.children, "star_records": args.star_records, "repeat": args.repeat, "seed": args.seed},
+        "environment": environment(),
+        "results": asyncio.run(measure(args.repeat)),
+    }
+    print(json.dumps(report["results"], indent=2), file=sys.stderr)
+    args.output.write_text(json.dumps(report, indent=2) + "\n")
+    print(f"Report written to {args.output}", file=sys.stderr)
+    shutil.rmtree(WORK_DIR, ignore_errors=True)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,374 @@
+"""End-to-end API benchmark: seeded SQLite database, scenario mixes, JSON report
+
+Usage:
+    python benchmarks/bench_api.py --children 1000 --star-records 1000000 --rewards 10000 \\
+        --requests 2000 --concurrency 20 --output bench.json
+    python benchmarks/bench_api.py --output new.json --compare bench.json   # diff against a saved report
+
+Drives ``main.app`` in-process through ``httpx.ASGITransport``, so the numbers
+cover routing, handlers, serialization and the database, but no network or
+server. The synthetic dataset is generated from ``--seed`` with bulk inserts
+into a template database, and every scenario starts from a fresh copy of it,
+so two runs with the same arguments do the same work.
+
+Scenarios:
+    list      polling GET /api/children/ and GET /api/rewards/ with If-None-Match
+    detail    GET /api/children/{id}
+    stats     GET /api/children/{id}/stats/daily over the seeded history
+    star_add  POST /api/children/{id}/stars/add
+    redeem    POST /api/rewards/{id}/redeem, each reward once
+    mix       all of the above, weighted by --mix
+
+The report has throughput and p50/p95/p99 latency per scenario. Latency is
+measured around each client call, so it includes the in-process transport.
+"""
+import argparse
+import asyncio
+import json
+import math
+import os
+import platform
+import random
+import shutil
+import sqlite3
+import subprocess
+import sys
+import tempfile
+import time
+from datetime import date, datetime, timedelta
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+WORK_DIR = Path(tempfile.mkdtemp(prefix="star-bench-"))
+DATABASE_PATH = WORK_DIR / "bench.db"
+
+# The app binds its engines at import time, so point it at the benchmark database first
+os.environ["DATABASE_URL"] = f"sqlite:///{DATABASE_PATH}"
+os.environ["DEBUG"] = "false"
+
+import httpx
+from loguru import logger
+from sqlalchemy import create_engine, insert
+
+from app.core.cache import response_cache
+from app.core.database import Base, async_engine, engine
+from app.models import Child, Reward, StarRecord
+from app.models.reward import reward_children
+from backfill_rollups import rollup_insert
+from main import app
+
+SCENARIOS = ("list", "detail", "stats", "star_add", "redeem")
+DEFAULT_MIX = "list=50,detail=25,star_add=20,redeem=5"
+INSERT_CHUNK = 50000
+SEED_START = datetime(2024, 1, 1)
+
+
+def chunked(rows, size: int = INSERT_CHUNK):
+    chunk = []
+    for row in rows:
+        chunk.append(row)
+        if len(chunk) == size:
+            yield chunk
+            chunk = []
+    if chunk:
+        yield chunk
+
+
+def seed(path: Path, children: int, star_records: int, rewards: int, rng_seed: int):
+    """Create the schema and bulk insert a synthetic dataset"""
+    rng = random.Random(rng_seed)
+    seed_engine = create_engine(f"sqlite:///{path}")
+    Base.metadata.create_all(seed_engine)
+
+    balances = [0] * children
+    with seed_engine.begin() as conn:
+        conn.execute(insert(Child), [
+            {
+                "name": f"child-{i}",
+                "birthday": date(2014 + i % 10, 1 + i % 12, 1 + i % 28),
+                "gender": "male" if i % 2 else "female",
+                "star_count": 0,
+            }
+            for i in range(children)
+        ])
+
+        def records():
+            for i in range(star_records):
+                child = rng.randrange(children)
+                if rng.random() < 0.85 or balances[child] < 5:
+                    kind, amount = "add", rng.randint(1, 10)
+                else:
+                    kind, amount = "subtract", -rng.randint(1, 5)
+                balances[child] += amount
+                yield {
+                    "child_id": child + 1,
+                    "type": kind,
+                    "amount": amount,
+                    "reason": "homework" if kind == "add" else "chores",
+                    "created_at": SEED_START + timedelta(seconds=i * 30),
+                }
+
+        for chunk in chunked(records()):
+            conn.execute(insert(StarRecord), chunk)
+        conn.execute(rollup_insert("sqlite"))
+
+        # Balances match the records, as the API keeps them
+        conn.exec_driver_sql(
+            "UPDATE children SET star_count = ? WHERE id = ?",
+            [(balance, i + 1) for i, balance in enumerate(balances)]
+        )
+
+        conn.execute(insert(Reward), [
+            {
+                "name": f"reward-{i}",
+                "description": "synthetic",
+                "star_cost": rng.randint(10, 100),
+                "is_redeemed": False,
+            }
+            for i in range(rewards)
+        ])
+        links = []
+        for reward_id in range(1, rewards + 1):
+            for child in rng.sample(range(1, children + 1), k=min(children, rng.randint(1, 3))):
+                links.append({"reward_id": reward_id, "child_id": child})
+        for chunk in chunked(links):
+            conn.execute(insert(reward_children), chunk)
+    seed_engine.dispose()
+
+
+class State:
+    """What the scenarios pick from; rebuilt for every scenario run"""
+
+    def __init__(self, children: int, rewards: int, rng: random.Random):
+        self.children = children
+        self.rng = rng
+        self.etags = {}
+        # Redeemed at most once each, in a reproducible order
+        self.unredeemed = list(range(1, rewards + 1))
+        rng.shuffle(self.unredeemed)
+        self.balances = {}
+        self.rewards = {}
+
+    def child_id(self) -> int:
+        return self.rng.randint(1, self.children)
+
+
+async def poll_list(client: httpx.AsyncClient, state: State) -> httpx.Response:
+    path = state.rng.choice(("/api/children/", "/api/rewards/"))
+    headers = {"If-None-Match": state.etags[path]} if path in state.etags else {}
+    response = await client.get(path, headers=headers)
+    if "etag" in response.headers:
+        state.etags[path] = response.headers["etag"]
+    return response
+
+
+async def child_detail(client: httpx.AsyncClient, state: State) -> httpx.Response:
+    return await client.get(f"/api/children/{state.child_id()}")
+
+
+async def daily_stats(client: httpx.AsyncClient, state: State) -> httpx.Response:
+    # A 90 day chart from the start of the seeded history
+    return await client.get(
+        f"/api/children/{state.child_id()}/stats/daily",
+        params={"from": str(SEED_START.date()), "to": str(SEED_START.date() + timedelta(days=89))}
+    )
+
+
+async def star_add(client: httpx.AsyncClient, state: State) -> httpx.Response:
+    child_id, amount = state.child_id(), state.rng.randint(1, 10)
+    state.balances[child_id] += amount
+    return await client.post(
+        f"/api/children/{child_id}/stars/add",
+        json={"amount": amount, "reason": "benchmark"}
+    )
+
+
+async def redeem(client: httpx.AsyncClient, state: State) -> httpx.Response:
+    if not state.unredeemed:
+        return await child_detail(client, state)
+    reward_id = state.unredeemed.pop()
+    star_cost, participants = state.rewards[reward_id]
+    # Take the cost from the participants with the most stars left, like a family would
+    deductions = []
+    remaining = star_cost
+    for child_id in sorted(participants, key=lambda child_id: -state.balances[child_id]):
+        amount = min(remaining, state.balances[child_id])
+        if amount > 0:
+            deductions.append({"child_id": child_id, "amount": amount})
+            state.balances[child_id] -= amount
+            remaining -= amount
+    return await client.post(f"/api/rewards/{reward_id}/redeem", json={"deductions": deductions or [
+        {"child_id": participants[0], "amount": star_cost}
+    ]})
+
+
+HANDLERS = {"list": poll_list, "detail": child_detail, "stats": daily_stats, "star_add": star_add, "redeem": redeem}
+
+
+def load_dataset(path: Path):
+    """Star balances by child and (star cost, participants) by reward, read from the template"""
+    with sqlite3.connect(path) as conn:
+        balances = dict(conn.execute("SELECT id, star_count FROM children"))
+        rewards = {reward_id: (star_cost, []) for reward_id, star_cost in conn.execute("SELECT id, star_cost FROM rewards")}
+        for reward_id, child_id in conn.execute("SELECT reward_id, child_id FROM reward_children"):
+            rewards[reward_id][1].append(child_id)
+    return balances, rewards
+
+
+def percentile(sorted_values, p: float) -> float:
+    """Nearest-rank percentile"""
+    index = max(math.ceil(p / 100 * len(sorted_values)) - 1, 0)
+    return sorted_values[index]
+
+
+async def run_scenario(weights: dict, args, dataset, template: Path) -> dict:
+    """Run ``args.requests`` requests picked by ``weights`` with ``args.concurrency`` in flight"""
+    # Fresh copy of the seeded data; pooled connections to the old file must go first
+    await async_engine.dispose()
+    engine.dispose()
+    shutil.copyfile(template, DATABASE_PATH)
+    response_cache.clear()
+
+    rng = random.Random(args.seed)
+    state = State(args.children, args.rewards, rng)
+    balances, state.rewards = dataset
+    state.balances = dict(balances)
+    names = list(weights)
+    plan = rng.choices(names, weights=[weights[name] for name in names], k=args.requests)
+
+    latencies = {name: [] for name in names}
+    errors = {name: 0 for name in names}
+    transport = httpx.ASGITransport(app=app)
+    async with httpx.AsyncClient(transport=transport, base_url="http://bench") as client:
+        for name in names:  # warm up route compilation, schema caches and connections
+            await HANDLERS[name](client, state)
+
+        queue = iter(plan)
+
+        async def worker():
+            for name in queue:
+                started = time.perf_counter()
+                response = await HANDLERS[name](client, state)
+                latencies[name].append(time.perf_counter() - started)
+                if response.status_code >= 400:
+                    errors[name] += 1
+
+        started = time.perf_counter()
+        await asyncio.gather(*(worker() for _ in range(args.concurrency)))
+        elapsed = time.perf_counter() - started
+
+    def summarize(values, error_count, seconds):
+        values = sorted(values)
+        if not values:
+            return {"requests": 0}
+        return {
+            "requests": len(values),
+            "errors": error_count,
+            "throughput_rps": round(len(values) / seconds, 1),
+            "mean_ms": round(sum(values) / len(values) * 1000, 3),
+            "p50_ms": round(percentile(values, 50) * 1000, 3),
+            "p95_ms": round(percentile(values, 95) * 1000, 3),
+            "p99_ms": round(percentile(values, 99) * 1000, 3),
+        }
+
+    result = summarize([value for values in latencies.values() for value in values], sum(errors.values()), elapsed)
+    if len(names) > 1:
+        result["by_request"] = {name: summarize(latencies[name], errors[name], elapsed) for name in names}
+    return result
+
+
+def parse_mix(value: str) -> dict:
+    weights = {}
+    for part in value.split(","):
+        name, _, weight = part.partition("=")
+        if name.strip() not in HANDLERS:
+            raise argparse.ArgumentTypeError(f"Unknown scenario: {name}")
+        weights[name.strip()] = float(weight)
+    return weights
+
+
+def environment() -> dict:
+    try:
+        commit = subprocess.run(
+            ["git", "rev-parse", "--short", "HEAD"], capture_output=True, text=True, check=True
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        commit = None
+    return {
+        "commit": commit,
+        "python": platform.python_version(),
+        "sqlite": sqlite3.sqlite_version,
+        "platform": platform.platform(),
+    }
+
+
+def compare(report: dict, baseline: dict):
+    """Print throughput and p95 changes against ``baseline``"""
+    print(f"{'scenario':<10} {'rps':>10} {'base rps':>10} {'change':>8} {'p95 ms':>10} {'base p95':>10} {'change':>8}", file=sys.stderr)
+    for name, result in report["scenarios"].items():
+        base = baseline.get("scenarios", {}).get(name)
+        if not base or not result.get("requests") or not base.get("requests"):
+            continue
+        rps_change = (result["throughput_rps"] / base["throughput_rps"] - 1) * 100
+        p95_change = (result["p95_ms"] / base["p95_ms"] - 1) * 100
+        print(
+            f"{name:<10} {result['throughput_rps']:>10} {base['throughput_rps']:>10} {rps_change:>+7.1f}% "
+            f"{result['p95_ms']:>10} {base['p95_ms']:>10} {p95_change:>+7.1f}%",
+            file=sys.stderr
+        )
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--children", type=int, default=1000)
+    parser.add_argument("--star-records", type=int, default=100000)
+    parser.add_argument("--rewards", type=int, default=10000)
+    parser.add_argument("--requests", type=int, default=2000, help="requests per scenario")
+    parser.add_argument("--concurrency", type=int, default=20)
+    parser.add_argument("--scenarios", default=",".join(SCENARIOS + ("mix",)))
+    parser.add_argument("--mix", type=parse_mix, default=parse_mix(DEFAULT_MIX))
+    parser.add_argument("--seed", type=int, default=42)
+    parser.add_argument("--output", type=Path, default=Path("bench_api.json"), help="where to write the JSON report")
+    parser.add_argument("--compare", type=Path, help="baseline report to diff against")
+    args = parser.parse_args()
+
+    # Logging every request (and every slow statement under load) would dominate the measurements
+    logger.remove()
+    logger.add(sys.stderr, level="ERROR")
+
+    template = WORK_DIR / "template.db"
+    started = time.perf_counter()
+    seed(template, args.children, args.star_records, args.rewards, args.seed)
+    print(f"Seeded {args.children} children, {args.star_records} star records and {args.rewards} rewards "
+          f"in {time.perf_counter() - started:.1f}s", file=sys.stderr)
+    dataset = load_dataset(template)
+
+    scenarios = {}
+    for name in args.scenarios.split(","):
+        weights = args.mix if name == "mix" else {name: 1}
+        scenarios[name] = asyncio.run(run_scenario(weights, args, dataset, template))
+        print(f"{name:<10} {json.dumps({k: v for k, v in scenarios[name].items() if k != 'by_request'})}", file=sys.stderr)
+
+    report = {
+        "config": {
+            "children": args.children,
+            "star_records": args.star_records,
+            "rewards": args.rewards,
+            "requests": args.requests,
+            "concurrency": args.concurrency,
+            "mix": args.mix,
+            "seed": args.seed,
+        },
+        "environment": environment(),
+        "scenarios": scenarios,
+    }
+    args.output.write_text(json.dumps(report, indent=2) + "\n")
+    print(f"Report written to {args.output}", file=sys.stderr)
+    if args.compare:
+        compare(report, json.loads(args.compare.read_text()))
+    shutil.rmtree(WORK_DIR, ignore_errors=True)
+
+
+if __name__ == "__main__":
+    main()
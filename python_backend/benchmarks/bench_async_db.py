@@ -0,0 +1,149 @@
+"""Concurrent throughput benchmark: blocking Session vs AsyncSession in async handlers
+
+Usage:
+    python benchmarks/bench_async_db.py --children 500 --requests 400 --concurrency 50 --db-latency-ms 5
+
+Both variants serve the same "list children" query from the same SQLite file.
+``--db-latency-ms`` adds a per-statement wait that models the network round trip
+to a MySQL server: the blocking variant waits with ``time.sleep`` on the event loop
+(what a sync driver does), the async variant awaits it (what an async driver does).
+"""
+import argparse
+import asyncio
+import sys
+import tempfile
+import time
+from datetime import date
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+import httpx
+from fastapi import Depends, FastAPI
+from sqlalchemy import create_engine, event, insert, select
+from sqlalchemy.ext.asyncio import AsyncSession, async_sessionmaker, create_async_engine
+from sqlalchemy.orm import Session, sessionmaker
+from sqlalchemy.pool import AsyncAdaptedQueuePool
+from sqlalchemy.util import await_only
+
+from app.core.database import Base
+from app.models import Child
+
+
+def seed(database_path: Path, children: int):
+    """Create the schema and bulk insert synthetic children"""
+    engine = create_engine(f"sqlite:///{database_path}")
+    Base.metadata.create_all(engine)
+    with engine.begin() as conn:
+        conn.execute(insert(Child), [
+            {"name": f"child-{i}", "birthday": date(2018, 1, 1), "gender": "male", "star_count": i % 50}
+            for i in range(children)
+        ])
+    engine.dispose()
+
+
+def serialize(children):
+    return [{"id": c.id, "name": c.name, "star_count": c.star_count} for c in children]
+
+
+def build_blocking_app(database_path: Path, latency: float, pool_size: int) -> FastAPI:
+    """The pre-async pattern: an async handler calling a blocking Session"""
+    # The pool must cover every in-flight request: a blocked event loop cannot run
+    # the dependency teardown that would return a connection, so it would deadlock
+    engine = create_engine(
+        f"sqlite:///{database_path}",
+        connect_args={"check_same_thread": False},
+        pool_size=pool_size
+    )
+    if latency:
+        event.listen(engine, "before_cursor_execute", lambda *args: time.sleep(latency))
+    session_factory = sessionmaker(bind=engine)
+
+    def get_db():
+        db = session_factory()
+        try:
+            yield db
+        finally:
+            db.close()
+
+    app = FastAPI()
+
+    @app.get("/children")
+    async def list_children(db: Session = Depends(get_db)):
+        return serialize(db.execute(select(Child).order_by(Child.created_at.desc())).scalars().all())
+
+    return app
+
+
+def build_async_app(database_path: Path, latency: float, pool_size: int) -> FastAPI:
+    """The current pattern: an async handler awaiting an AsyncSession"""
+    engine = create_async_engine(
+        f"sqlite+aiosqlite:///{database_path}",
+        poolclass=AsyncAdaptedQueuePool,
+        pool_size=pool_size
+    )
+    if latency:
+        event.listen(engine.sync_engine, "before_cursor_execute", lambda *args: await_only(asyncio.sleep(latency)))
+    session_factory = async_sessionmaker(bind=engine, expire_on_commit=False)
+
+    async def get_db():
+        async with session_factory() as db:
+            yield db
+
+    app = FastAPI()
+
+    @app.get("/children")
+    async def list_children(db: AsyncSession = Depends(get_db)):
+        result = await db.execute(select(Child).order_by(Child.created_at.desc()))
+        return serialize(result.scalars().all())
+
+    return app
+
+
+async def run(app: FastAPI, requests: int, concurrency: int) -> dict:
+    """Fire ``requests`` GETs with at most ``concurrency`` in flight"""
+    semaphore = asyncio.Semaphore(concurrency)
+    latencies = []
+    transport = httpx.ASGITransport(app=app)
+    async with httpx.AsyncClient(transport=transport, base_url="http://bench") as client:
+        async def one():
+            async with semaphore:
+                started = time.perf_counter()
+                response = await client.get("/children")
+                response.raise_for_status()
+                latencies.append(time.perf_counter() - started)
+
+        await one()  # warm up connections and route compilation
+        latencies.clear()
+        started = time.perf_counter()
+        await asyncio.gather(*(one() for _ in range(requests)))
+        elapsed = time.perf_counter() - started
+
+    latencies.sort()
+    return {
+        "requests_per_second": round(requests / elapsed, 1),
+        "p50_ms": round(latencies[len(latencies) // 2] * 1000, 2),
+        "p99_ms": round(latencies[int(len(latencies) * 0.99) - 1] * 1000, 2),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--children", type=int, default=500)
+    parser.add_argument("--requests", type=int, default=400)
+    parser.add_argument("--concurrency", type=int, default=50)
+    parser.add_argument("--db-latency-ms", type=float, default=5.0)
+    args = parser.parse_args()
+
+    database_path = Path(tempfile.mkdtemp(prefix="star-bench-")) / "bench.db"
+    seed(database_path, args.children)
+    latency = args.db_latency_ms / 1000
+
+    for label, builder in (("before (blocking Session)", build_blocking_app), ("after (AsyncSession)", build_async_app)):
+        app = builder(database_path, latency, args.concurrency)
+        result = asyncio.run(run(app, args.requests, args.concurrency))
+        print(f"{label:<28} {result}")
+
+
+if __name__ == "__main__":
+    main()
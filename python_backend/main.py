@@ -1,16 +1,25 @@
 from fastapi import FastAPI, Request
 from fastapi.middleware.cors import CORSMiddleware
 from fastapi.exceptions import RequestValidationError
-from fastapi.responses import JSONResponse
-from fastapi.staticfiles import StaticFiles
+from fastapi.responses import JSONResponse, Response
 from contextlib import asynccontextmanager
+import asyncio
 import uvicorn
 from loguru import logger
 from pathlib import Path
 
 from app.core.config import settings
-from app.core.logging import setup_logging
-from app.api.endpoints import children, stars, rewards
+from app.core.logging import LogContextMiddleware, setup_logging
+from app.core.cache import response_cache
+from app.core.database import async_engine, engine
+from app.core import profiling
+from app.core.metrics import CONTENT_TYPE as METRICS_CONTENT_TYPE, MetricsMiddleware, instrument_engine, registry
+from app.core.responses import ORJSONResponse
+from app.core.static_files import StorageFiles
+from app.api.endpoints import children, stars, rewards, media, profiles, analytics, categories, reports
+from app.services.idempotency import run_cleanup_task as run_idempotency_cleanup
+from app.services.image_variants import shutdown_executor as shutdown_image_workers
+from app.services.reports import run_dispatcher as run_report_dispatcher, shutdown_executor as shutdown_report_workers
 
 
 @asynccontextmanager
@@ -19,9 +28,15 @@ async def lifespan(app: FastAPI):
     logger.info(f"Starting {settings.app_name} v{settings.app_version}")
     logger.info(f"Server running on {settings.host}:{settings.port}")
     logger.info(f"Debug mode: {settings.debug}")
+    idempotency_cleanup = asyncio.create_task(run_idempotency_cleanup())
+    report_dispatcher = asyncio.create_task(run_report_dispatcher())
     yield
     # Shutdown
     logger.info("Shutting down application")
+    idempotency_cleanup.cancel()
+    report_dispatcher.cancel()
+    shutdown_image_workers()
+    shutdown_report_workers()
 
 
 # Setup logging
@@ -32,7 +47,8 @@ app = FastAPI(
     title=settings.app_name,
     version=settings.app_version,
     lifespan=lifespan,
-    debug=settings.debug
+    debug=settings.debug,
+    default_response_class=ORJSONResponse
 )
 
 # Custom exception handler for validation errors with binary data
@@ -82,22 +98,41 @@ app.add_middleware(
     allow_headers=["*"],
 )
 
+# Lets log filters see the route of the request being handled
+app.add_middleware(LogContextMiddleware)
+
+# Request counts and latencies, with the SQL time spent in each request (see /metrics)
+app.add_middleware(MetricsMiddleware)
+instrument_engine(engine, "sync")
+instrument_engine(async_engine.sync_engine, "async")
+
+# Opt-in profiling of single requests (X-Profile header); not installed at all when disabled
+if settings.profiling_enabled:
+    app.add_middleware(profiling.ProfilingMiddleware)
+    profiling.instrument_engine(engine)
+    profiling.instrument_engine(async_engine.sync_engine)
+
 # Mount static files for serving uploaded files (like Laravel's public/storage)
 public_storage_path = Path("public/storage")
 public_storage_path.mkdir(parents=True, exist_ok=True)
 
-# Create subdirectories for uploads
-avatars_path = public_storage_path / "avatars"
-avatars_path.mkdir(parents=True, exist_ok=True)
-rewards_path = public_storage_path / "rewards"
-rewards_path.mkdir(parents=True, exist_ok=True)
+# Create the content-addressed store for uploads (avatars and reward images)
+blobs_path = public_storage_path / "blobs"
+blobs_path.mkdir(parents=True, exist_ok=True)
 
-app.mount("/storage", StaticFiles(directory="public/storage"), name="storage")
+# Variants missing on disk are rendered on request, so this route must precede the mount
+app.include_router(media.router, prefix="/storage", tags=["media"])
+# Hash-named files are served as immutable, with conditional GET and range support
+app.mount("/storage", StorageFiles(directory="public/storage"), name="storage")
 
 # Include routers
 app.include_router(children.router, prefix="/api/children", tags=["children"])
 app.include_router(stars.router, prefix="/api", tags=["stars"])
 app.include_router(rewards.router, prefix="/api/rewards", tags=["rewards"])
+app.include_router(analytics.router, prefix="/api/analytics", tags=["analytics"])
+app.include_router(categories.router, prefix="/api/categories", tags=["categories"])
+app.include_router(reports.router, prefix="/api/reports", tags=["reports"])
+app.include_router(profiles.router, prefix="/profiles", tags=["profiling"])
 
 @app.get("/")
 async def root():
@@ -113,6 +148,16 @@ async def health_check():
     """Health check endpoint"""
     return {"status": "healthy"}
 
+@app.get("/cache/stats")
+async def cache_stats():
+    """Response cache counters, for sizing RESPONSE_CACHE_MAX_ENTRIES / TTL"""
+    return response_cache.stats()
+
+@app.get("/metrics")
+async def metrics():
+    """Request, SQL and connection pool metrics in the Prometheus text format"""
+    return Response(content=registry.render(), media_type=METRICS_CONTENT_TYPE)
+
 if __name__ == "__main__":
     # Configure uvicorn logging to use loguru
     import logging
@@ -1,6 +1,9 @@
 """Database migration script to update existing database structure"""
 from sqlalchemy import create_engine, text
 from app.core.config import settings
+from app.core.database import Base
+from app.models import StarRecord
+from app.models.reward import reward_children
 from loguru import logger
 
 def migrate_database():
@@ -99,6 +102,40 @@ def migrate_database():
             # The enum constraint will still be boy/girl but data is now male/female
             # This is acceptable as the Python code handles the conversion
     
+    with engine.connect() as conn:
+        columns = [row[1] for row in conn.execute(text("PRAGMA table_info(star_records)"))]
+        if columns and 'category' not in columns:
+            logger.info("Adding category column to star_records table...")
+            conn.execute(text("ALTER TABLE star_records ADD COLUMN category VARCHAR(50)"))
+            conn.commit()
+            logger.info("Column added; run backfill_categories.py to categorize existing records")
+    
+    with engine.connect() as conn:
+        columns = [row[1] for row in conn.execute(text("PRAGMA table_info(children)"))]
+        if columns and 'version' not in columns:
+            logger.info("Adding version column to children table...")
+            conn.execute(text("ALTER TABLE children ADD COLUMN version INTEGER NOT NULL DEFAULT 1"))
+            conn.commit()
+        columns = [row[1] for row in conn.execute(text("PRAGMA table_info(idempotency_keys)"))]
+        if columns and 'committed' not in columns:
+            logger.info("Adding lease columns to idempotency_keys table...")
+            conn.execute(text("ALTER TABLE idempotency_keys ADD COLUMN locked_until DATETIME"))
+            conn.execute(text("ALTER TABLE idempotency_keys ADD COLUMN committed BOOLEAN NOT NULL DEFAULT 0"))
+            conn.commit()
+        columns = [row[1] for row in conn.execute(text("PRAGMA table_info(data_versions)"))]
+        if columns and 'scope' not in columns:
+            # Only ETags depend on it; create_all recreates it with one row per scope
+            logger.info("Replacing the single-row data_versions table...")
+            conn.execute(text("DROP TABLE data_versions"))
+            conn.commit()
+    
+    # Create tables and indexes added to the models since the database was created
+    logger.info("Ensuring model tables and indexes exist...")
+    Base.metadata.create_all(bind=engine)
+    with engine.begin() as conn:
+        for index in [*StarRecord.__table__.indexes, *reward_children.indexes]:
+            index.create(conn, checkfirst=True)
+    
     logger.info("Database migration completed successfully!")
 
 if __name__ == "__main__":
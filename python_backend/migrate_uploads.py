@@ -0,0 +1,107 @@
+"""Move uploads stored under uuid names into the content-addressed blob store
+
+Rewrites children.avatar and rewards.image values such as
+``avatars/<uuid>.png`` to ``blobs/ab/<sha256>.png``, counting references in
+upload_blobs, and removes the old files. Identical files collapse into one
+blob. Safe to run repeatedly; run migrate_db.py first.
+"""
+import hashlib
+import os
+from typing import Dict
+
+from sqlalchemy import select, update
+from sqlalchemy.orm import Session
+from loguru import logger
+
+from app.core.database import SessionLocal
+from app.models import Child, Reward, UploadBlob
+from app.services.upsert import upsert_statement
+from app.core.storage import STORAGE_ROOT, blob_path, is_blob_path
+from app.services.uploads import detect_image_type
+
+def file_digest(path) -> str:
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(1024 * 1024), b""):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+def import_file(db: Session, path: str):
+    """Move one legacy upload into the store and count one reference to it
+
+    Returns the blob path, or None if the file cannot be imported.
+    """
+    source = STORAGE_ROOT / path
+    if not source.resolve().is_relative_to(STORAGE_ROOT.resolve()) or not source.is_file():
+        return None
+    with open(source, "rb") as f:
+        extension = detect_image_type(f.read(16))
+    if extension is None:
+        logger.warning(f"Skipping {path}: not a supported image")
+        return None
+
+    sha256 = file_digest(source)
+    target = blob_path(sha256, extension)
+    (STORAGE_ROOT / target).parent.mkdir(parents=True, exist_ok=True)
+    os.replace(source, STORAGE_ROOT / target)
+
+    row = {"sha256": sha256, "path": target, "size": (STORAGE_ROOT / target).stat().st_size, "ref_count": 1}
+    stmt = upsert_statement(
+        db.bind.dialect.name, UploadBlob.__table__, [row], ["sha256"],
+        update_columns=[], increment_columns=["ref_count"]
+    )
+    if stmt is not None:
+        db.execute(stmt)
+    elif retain(db, target) == 0:
+        db.add(UploadBlob(**row))
+    return target
+
+def retain(db: Session, target: str) -> int:
+    return db.execute(
+        update(UploadBlob).where(UploadBlob.path == target).values(ref_count=UploadBlob.ref_count + 1)
+    ).rowcount
+
+def migrate_column(db: Session, column, imported: Dict[str, str]) -> int:
+    """Point every legacy path in ``column`` at its blob and count the references
+
+    ``imported`` maps legacy paths already moved to their blob path, for
+    rows sharing a file.
+    """
+    model = column.class_
+    migrated = 0
+    rows = db.execute(select(model.id, column).where(column.isnot(None), column != "")).all()
+    for row_id, path in rows:
+        if is_blob_path(path):
+            continue
+        if path in imported:
+            target = imported[path]
+            retain(db, target)
+        else:
+            target = import_file(db, path)
+            if target is None:
+                continue
+        db.execute(update(model).where(model.id == row_id).values({column.key: target}))
+        # Commit per file: the source file has already been moved
+        db.commit()
+        imported[path] = target
+        migrated += 1
+    return migrated
+
+def migrate_uploads():
+    """Import every legacy avatar and reward image into the blob store"""
+    logger.info("Migrating uploads into the content-addressed store...")
+
+    db = SessionLocal()
+    try:
+        imported: Dict[str, str] = {}
+        avatars = migrate_column(db, Child.avatar, imported)
+        images = migrate_column(db, Reward.image, imported)
+    finally:
+        db.close()
+
+    logger.info(f"Migrated {avatars} avatars and {images} reward images")
+
+if __name__ == "__main__":
+    from app.core.logging import setup_logging
+    setup_logging()
+    migrate_uploads()
@@ -0,0 +1,78 @@
+"""Shared pytest fixtures: an isolated SQLite database and an in-process API client"""
+import os
+import tempfile
+from pathlib import Path
+
+# Point the application at a throwaway database before any app module is imported
+_test_dir = Path(tempfile.mkdtemp(prefix="star-tests-"))
+os.environ["DATABASE_URL"] = f"sqlite:///{_test_dir / 'test.db'}"
+os.environ["DEBUG"] = "false"
+
+import httpx
+import pytest
+from loguru import logger
+
+from app.core.cache import response_cache
+from app.core.config import settings
+from app.core.database import Base, async_engine, engine
+from app.services.analytics import analytics_cache
+from app.services.categories import category_rules
+from main import app
+
+
+@pytest.fixture(autouse=True)
+async def database():
+    """Create a fresh schema for every test"""
+    Base.metadata.create_all(bind=engine)
+    response_cache.clear()
+    analytics_cache.clear()
+    category_rules.invalidate()
+    yield
+    # Pooled async connections are bound to this test's event loop
+    await async_engine.dispose()
+    Base.metadata.drop_all(bind=engine)
+
+
+@pytest.fixture(autouse=True)
+def no_image_variants(monkeypatch):
+    """Keep background image rendering out of tests that do not ask for it"""
+    monkeypatch.setattr(settings, "image_variants_enabled", False)
+
+
+@pytest.fixture(autouse=True)
+def enforce_query_budgets(monkeypatch):
+    """Fail any test with a request that runs more SQL statements than its route's @query_budget
+
+    Handlers often turn the raised QueryBudgetExceeded into an error body, and
+    the overrun is only logged once the response has started, so the logged
+    overruns are collected too. A test expecting one clears the yielded list.
+    """
+    monkeypatch.setattr(settings, "query_budget_mode", "raise")
+    overruns = []
+    handler_id = logger.add(
+        lambda message: overruns.append(message.record["message"]),
+        level="ERROR",
+        filter="app.core.query_budget"
+    )
+    yield overruns
+    logger.remove(handler_id)
+    if overruns:
+        pytest.fail("Query budget exceeded:\n" + "\n".join(overruns))
+
+
+@pytest.fixture
+async def client():
+    """Async HTTP client driving the FastAPI app in-process"""
+    transport = httpx.ASGITransport(app=app)
+    async with httpx.AsyncClient(transport=transport, base_url="http://test") as client:
+        yield client
+
+
+@pytest.fixture
+async def make_child(client):
+    """Factory creating a child through the API and returning its id"""
+    async def _make_child(name="小明", birthday="2018-05-15", gender="male"):
+        response = await client.post("/api/children/", data={"name": name, "birthday": birthday, "gender": gender})
+        assert response.status_code == 201
+        return response.json()["data"]["id"]
+    return _make_child
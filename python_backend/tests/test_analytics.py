@@ -0,0 +1,120 @@
+"""Tests for the NumPy star analytics and their endpoint"""
+import random
+from datetime import date, datetime, timedelta, timezone
+
+import pytest
+
+np = pytest.importorskip("numpy")
+
+from app.services.analytics import (  # noqa: E402
+    SECONDS_PER_DAY,
+    TYPE_CODES,
+    UNIX_EPOCH,
+    analytics_cache,
+    compute_star_analytics,
+    to_columns,
+    trailing_mean,
+)
+
+# Star records are stamped in UTC (app.core.clock.utc_now)
+TODAY = datetime.now(timezone.utc).date()
+
+
+def epoch(moment: datetime) -> int:
+    return (moment.date() - UNIX_EPOCH).days * SECONDS_PER_DAY + moment.hour * 3600 + moment.minute * 60
+
+
+def test_statistics_match_a_python_loop():
+    rng = random.Random(7)
+    start, days = date(2024, 3, 1), 30
+    rows = []
+    for _ in range(2000):
+        moment = datetime(2024, 2, 25) + timedelta(minutes=rng.randrange(40 * 24 * 60))
+        record_type = rng.choice(list(TYPE_CODES))
+        amount = rng.randint(1, 10) * (1 if record_type == "add" else -1)
+        rows.append((rng.choice((1, 2, 5)), epoch(moment), TYPE_CODES[record_type], amount))
+
+    columns = to_columns(np.array(rows, dtype=np.int64), start, days)
+    result = compute_star_analytics(columns, [5, 1, 2], start, days, window=7)
+
+    heatmap = [[0] * 24 for _ in range(7)]
+    daily = {child_id: [0] * days for child_id in (1, 2, 5)}
+    redeemed = dict.fromkeys((1, 2, 5), 0)
+    for child_id, seconds, type_code, amount in rows:
+        moment = datetime(1970, 1, 1) + timedelta(seconds=seconds)
+        if not 0 <= (moment.date() - start).days < days:
+            continue
+        heatmap[moment.weekday()][moment.hour] += 1
+        if type_code == TYPE_CODES["add"]:
+            daily[child_id][(moment.date() - start).days] += amount
+        elif type_code == TYPE_CODES["redeem"]:
+            redeemed[child_id] -= amount
+
+    assert result["heatmap"] == heatmap
+    assert result["records"] == sum(map(sum, heatmap))
+    assert [child["child_id"] for child in result["children"]] == [1, 2, 5]
+    for child in result["children"]:
+        earned = daily[child["child_id"]]
+        assert child["earned"] == sum(earned)
+        assert child["redeemed"] == redeemed[child["child_id"]]
+        assert child["daily_earned_percentiles"]["p50"] == round(float(np.median(earned)), 2)
+        assert child["moving_average"][-1] == round(sum(earned[-7:]) / 7, 2)
+        assert child["moving_average"][0] == earned[0]
+    earned_ranks = sorted(child["percentile_ranks"]["earned"] for child in result["children"])
+    assert earned_ranks[-1] == 100.0
+
+
+def test_trailing_mean_uses_shorter_windows_at_the_start():
+    assert trailing_mean(np.array([[2.0, 4.0, 6.0, 8.0]]), 2).tolist() == [[2.0, 3.0, 5.0, 7.0]]
+    assert trailing_mean(np.array([[3.0, 6.0]]), 5).tolist() == [[3.0, 4.5]]
+
+
+async def test_analytics_endpoint_is_cached_until_records_change(client, make_child):
+    first, second = await make_child(), await make_child(name="小红", gender="female")
+    await client.post(f"/api/children/{first}/stars/add", json={"amount": 6})
+    await client.post(f"/api/children/{first}/stars/subtract", json={"amount": 2})
+    await client.post(f"/api/children/{second}/stars/add", json={"amount": 3})
+
+    params = {"from": str(TODAY - timedelta(days=6)), "to": str(TODAY)}
+    response = await client.get("/api/analytics/stars", params=params)
+    data = response.json()["data"]
+    assert data["records"] == 3
+    assert sum(map(sum, data["heatmap"])) == 3
+    by_child = {child["child_id"]: child for child in data["children"]}
+    assert by_child[first]["earned"] == 6 and by_child[first]["subtracted"] == 2
+    assert by_child[second]["active_days"] == 1
+    assert len(by_child[first]["moving_average"]) == 7
+
+    hits = analytics_cache.hits
+    assert (await client.get("/api/analytics/stars", params=params)).json()["data"] == data
+    assert analytics_cache.hits == hits + 1
+
+    await client.post(f"/api/children/{second}/stars/add", json={"amount": 4})
+    response = await client.get("/api/analytics/stars", params={**params, "child_ids": [second]})
+    data = response.json()["data"]
+    assert [child["child_id"] for child in data["children"]] == [second]
+    assert data["children"][0]["earned"] == 7
+
+
+async def test_other_families_and_rewards_keep_the_cache(client, make_child):
+    first, second = await make_child(), await make_child(name="小红", gender="female")
+    params = {"child_ids": [first]}
+    data = (await client.get("/api/analytics/stars", params=params)).json()["data"]
+
+    hits = analytics_cache.hits
+    await client.post(f"/api/children/{second}/stars/add", json={"amount": 4})
+    await client.post("/api/rewards/", data={"name": "绘本", "star_cost": 10, "child_ids[]": [first]})
+    assert (await client.get("/api/analytics/stars", params=params)).json()["data"] == data
+    assert analytics_cache.hits == hits + 1
+
+    await client.post(f"/api/children/{first}/stars/add", json={"amount": 2})
+    assert (await client.get("/api/analytics/stars", params=params)).json()["data"]["children"][0]["earned"] == 2
+    assert analytics_cache.hits == hits + 1
+
+
+async def test_analytics_rejects_bad_ranges_and_unknown_children(client, make_child):
+    child_id = await make_child()
+    response = await client.get("/api/analytics/stars", params={"from": str(TODAY), "to": str(TODAY - timedelta(days=1))})
+    assert response.status_code == 400
+    response = await client.get("/api/analytics/stars", params={"child_ids": [child_id, 999]})
+    assert response.status_code == 404
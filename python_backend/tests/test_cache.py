@@ -0,0 +1,58 @@
+"""Tests for the in-process response cache"""
+from app.core.cache import ResponseCache, response_cache
+
+
+async def test_list_is_served_from_cache_until_a_mutation(client, make_child):
+    child_id = await make_child()
+    before = response_cache.stats()
+
+    first = await client.get("/api/children/")
+    second = await client.get("/api/children/")
+    assert first.content == second.content
+    after = response_cache.stats()
+    assert after["misses"] == before["misses"] + 1
+    assert after["hits"] == before["hits"] + 1
+
+    await client.post(f"/api/children/{child_id}/stars/add", json={"amount": 3})
+    third = await client.get("/api/children/")
+    assert third.json()["data"][0]["star_count"] == 3
+    assert response_cache.stats()["misses"] == after["misses"] + 1
+
+
+async def test_star_change_keeps_other_children_cached(client, make_child):
+    first, second = await make_child(), await make_child(name="小红", gender="female")
+    etag = (await client.get(f"/api/children/{second}")).headers["ETag"]
+    await client.get("/api/rewards/")
+    before = response_cache.stats()
+
+    await client.post(f"/api/children/{first}/stars/add", json={"amount": 3})
+    assert (await client.get(f"/api/children/{second}", headers={"If-None-Match": etag})).status_code == 304
+    # Neither child takes part in a reward, so the reward list is still current
+    await client.get("/api/rewards/")
+    assert response_cache.stats()["hits"] == before["hits"] + 1
+
+
+async def test_reward_list_is_keyed_by_query_string(client, make_child):
+    child_id = await make_child()
+    await client.post("/api/rewards/", data={"name": "绘本", "star_cost": 10, "child_ids[]": [child_id]})
+
+    assert len((await client.get("/api/rewards/")).json()["data"]) == 1
+    assert (await client.get("/api/rewards/", params={"achieved": "true"})).json()["data"] == []
+
+    await client.post(f"/api/children/{child_id}/stars/add", json={"amount": 10})
+    assert len((await client.get("/api/rewards/", params={"achieved": "true"})).json()["data"]) == 1
+
+
+def test_lru_and_ttl_eviction():
+    cache = ResponseCache(max_entries=2, ttl_seconds=60)
+    for key in ("a", "b", "c"):
+        cache.set(key, key.encode())
+    assert cache.get("a") is None
+    assert cache.get("c") == b"c"
+
+    expired = ResponseCache(max_entries=2, ttl_seconds=0)
+    expired.set("a", b"a")
+    assert expired.get("a") is None
+    assert cache.stats()["evictions"] == 1
+    assert expired.stats()["evictions"] == 1
+
@@ -0,0 +1,83 @@
+"""Tests for the behavior categories of star reasons"""
+from sqlalchemy import select
+
+from app.core.database import async_engine
+from app.models import StarRecord
+from app.services.categories import CategoryMatcher
+from backfill_categories import backfill_categories
+
+
+async def record_categories():
+    async with async_engine.connect() as conn:
+        rows = await conn.execute(select(StarRecord.reason, StarRecord.category).order_by(StarRecord.id))
+        return rows.all()
+
+
+def test_matcher_picks_priority_then_earliest_then_longest_keyword():
+    matcher = CategoryMatcher([
+        ("作业", "homework", 0),
+        ("写作业", "writing", 0),
+        ("洗碗", "chores", 0),
+        ("he", "he", 0),
+        ("she", "she", 0),
+        ("hers", "hers", 0),
+        ("Sleep", "sleep", 5),
+    ])
+    assert matcher.categorize("认真写作业") == "writing"
+    assert matcher.categorize("洗碗后写作业") == "chores"
+    assert matcher.categorize("作业和洗碗") == "homework"
+    assert matcher.categorize("ushers") == "she"
+    assert matcher.categorize("Did homework, then SLEEP early") == "sleep"
+    assert matcher.categorize("看电视") is None
+    assert matcher.categorize(None) is None
+    assert CategoryMatcher([]).categorize("作业") is None
+
+
+async def test_records_are_categorized_when_inserted(client, make_child):
+    child_id = await make_child()
+    await client.post(f"/api/children/{child_id}/stars/add", json={"amount": 5, "reason": "完成数学作业"})
+    await client.post(f"/api/children/{child_id}/stars/add", json={"amount": 3, "reason": "主动洗碗"})
+    await client.post(f"/api/children/{child_id}/stars/add", json={"amount": 2, "reason": "Finished HOMEWORK early"})
+    await client.post(f"/api/children/{child_id}/stars/subtract", json={"amount": 1, "reason": "没有收拾玩具"})
+    await client.post(f"/api/children/{child_id}/stars/add", json={"amount": 1})
+    await client.post("/api/stars/bulk", json={"operations": [
+        {"child_id": child_id, "type": "add", "amount": 4, "reason": "按时睡觉"},
+    ]})
+
+    assert [category for _, category in await record_categories()] == [
+        "homework", "chores", "homework", "chores", None, "sleep"
+    ]
+
+    response = await client.get(f"/api/children/{child_id}/stats/categories")
+    stats = {item["category"]: item for item in response.json()["data"]}
+    assert stats["homework"] == {"category": "homework", "records": 2, "added": 7, "subtracted": 0}
+    assert stats["chores"] == {"category": "chores", "records": 2, "added": 3, "subtracted": 1}
+    assert stats[None]["records"] == 1
+
+    response = await client.get("/api/children/999/stats/categories")
+    assert response.status_code == 404
+
+
+async def test_rule_changes_apply_to_new_records_and_the_backfill(client, make_child):
+    child_id = await make_child()
+    await client.post(f"/api/children/{child_id}/stars/add", json={"amount": 2, "reason": "练钢琴"})
+
+    response = await client.post("/api/categories/rules", json={"keyword": "钢琴", "category": "music"})
+    assert response.status_code == 201
+    rule_id = response.json()["data"]["id"]
+    response = await client.post("/api/categories/rules", json={"keyword": "钢琴", "category": "music"})
+    assert response.status_code == 409
+
+    await client.post(f"/api/children/{child_id}/stars/add", json={"amount": 2, "reason": "弹钢琴半小时"})
+    assert await record_categories() == [("练钢琴", None), ("弹钢琴半小时", "music")]
+
+    backfill_categories(chunk_size=1)
+    assert await record_categories() == [("练钢琴", "music"), ("弹钢琴半小时", "music")]
+
+    rules = (await client.get("/api/categories/rules")).json()["data"]
+    assert any(rule["keyword"] == "作业" and rule["category"] == "homework" for rule in rules)
+
+    assert (await client.delete(f"/api/categories/rules/{rule_id}")).json()["success"] is True
+    assert (await client.delete(f"/api/categories/rules/{rule_id}")).status_code == 404
+    await client.post(f"/api/children/{child_id}/stars/add", json={"amount": 2, "reason": "钢琴考级"})
+    assert (await record_categories())[-1] == ("钢琴考级", None)
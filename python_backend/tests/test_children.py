@@ -0,0 +1,74 @@
+"""Tests for the children endpoints"""
+
+
+async def test_create_and_list_children(client, make_child):
+    child_id = await make_child()
+
+    response = await client.get("/api/children/")
+    assert response.status_code == 200
+    result = response.json()
+    assert result["success"] is True
+    assert [c["id"] for c in result["data"]] == [child_id]
+    assert result["data"][0]["star_count"] == 0
+
+
+async def test_list_wire_format(client, make_child):
+    await client.post("/api/children/", data={
+        "name": "小明", "birthday": "2018-05-15", "gender": "boy", "avatar_url": "avatars/a.png"
+    })
+
+    child = (await client.get("/api/children/")).json()["data"][0]
+    assert list(child) == ["id", "name", "birthday", "age", "gender", "avatar", "star_count", "avatar_variants"]
+    assert child["birthday"] == "2018-05-15"
+    assert child["gender"] == "male"
+    assert child["avatar"] == "/storage/avatars/a.png"
+    assert child["avatar_variants"] is None
+
+
+async def test_get_child_details(client, make_child):
+    child_id = await make_child()
+    await client.post(f"/api/children/{child_id}/stars/add", json={"amount": 5, "reason": "做作业认真"})
+
+    response = await client.get(f"/api/children/{child_id}")
+    assert response.status_code == 200
+    data = response.json()["data"]
+    assert data["star_count"] == 5
+    assert data["star_records"][0]["reason"] == "做作业认真"
+    assert len(data["star_records"][0]["created_at"]) == len("2024-01-31 18:05")
+    assert data["rewards"] == []
+
+
+async def test_get_missing_child(client):
+    response = await client.get("/api/children/999")
+    assert response.status_code == 404
+    assert response.json()["success"] is False
+
+
+async def test_update_and_delete_child(client, make_child):
+    child_id = await make_child()
+
+    response = await client.patch(f"/api/children/{child_id}", json={"name": "小红"})
+    assert response.json()["data"]["name"] == "小红"
+
+    response = await client.delete(f"/api/children/{child_id}")
+    assert response.json()["success"] is True
+    assert (await client.get(f"/api/children/{child_id}")).status_code == 404
+
+
+async def test_star_records_keyset_pagination(client, make_child):
+    child_id = await make_child()
+    for amount in range(1, 26):
+        await client.post(f"/api/children/{child_id}/stars/add", json={"amount": amount})
+
+    detail = (await client.get(f"/api/children/{child_id}")).json()["data"]
+    assert [r["amount"] for r in detail["star_records"]] == list(range(25, 5, -1))
+
+    amounts, cursor = [], None
+    while True:
+        params = {"limit": 10} if cursor is None else {"limit": 10, "before": cursor}
+        page = (await client.get(f"/api/children/{child_id}/star-records", params=params)).json()
+        amounts += [r["amount"] for r in page["data"]]
+        cursor = page["next_cursor"]
+        if cursor is None:
+            break
+    assert amounts == list(range(25, 0, -1))
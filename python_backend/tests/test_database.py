@@ -0,0 +1,15 @@
+"""Tests for the async database URL derived from DATABASE_URL"""
+import pytest
+
+from app.core.database import get_async_database_url
+
+
+def test_sync_urls_map_to_their_async_driver():
+    assert get_async_database_url("sqlite:///./star_db.db") == "sqlite+aiosqlite:///./star_db.db"
+    assert get_async_database_url("mysql+pymysql://root:pw@localhost/star_db") == "mysql+aiomysql://root:pw@localhost/star_db"
+    assert get_async_database_url("sqlite+aiosqlite:///./star_db.db") == "sqlite+aiosqlite:///./star_db.db"
+
+
+def test_unsupported_backend_fails_clearly():
+    with pytest.raises(ValueError, match="No async driver configured for database backend 'postgresql'"):
+        get_async_database_url("postgresql://user@localhost/star_db")
@@ -0,0 +1,56 @@
+"""Tests for ETag / If-None-Match conditional responses"""
+
+
+async def test_children_list_not_modified_until_change(client, make_child):
+    child_id = await make_child()
+
+    first = await client.get("/api/children/")
+    etag = first.headers["ETag"]
+    second = await client.get("/api/children/", headers={"If-None-Match": etag})
+    assert second.status_code == 304
+    assert second.content == b""
+    assert second.headers["ETag"] == etag
+
+    await client.post(f"/api/children/{child_id}/stars/add", json={"amount": 2})
+    third = await client.get("/api/children/", headers={"If-None-Match": etag})
+    assert third.status_code == 200
+    assert third.headers["ETag"] != etag
+    assert third.json()["data"][0]["star_count"] == 2
+
+
+async def test_child_detail_and_rewards_etags(client, make_child):
+    child_id = await make_child()
+    await client.post("/api/rewards/", data={"name": "绘本", "star_cost": 10, "child_ids[]": [child_id]})
+
+    for url in (f"/api/children/{child_id}", "/api/rewards/"):
+        etag = (await client.get(url)).headers["ETag"]
+        assert (await client.get(url, headers={"If-None-Match": f"W/{etag}"})).status_code == 304
+
+    etag = (await client.get("/api/rewards/")).headers["ETag"]
+    await client.patch(f"/api/children/{child_id}", json={"name": "小红"})
+    assert (await client.get("/api/rewards/", headers={"If-None-Match": etag})).status_code == 200
+
+
+async def test_failed_mutation_keeps_etag(client, make_child):
+    child_id = await make_child()
+    etag = (await client.get("/api/children/")).headers["ETag"]
+
+    response = await client.post(f"/api/children/{child_id}/stars/subtract", json={"amount": 1})
+    assert response.status_code == 400
+    assert (await client.get("/api/children/", headers={"If-None-Match": etag})).status_code == 304
+
+
+async def test_child_etag_follows_its_rewards_and_their_participants(client, make_child):
+    child_id, sibling_id, other_id = await make_child(), await make_child(name="小红"), await make_child(name="小刚")
+    url = f"/api/children/{child_id}"
+    etag = (await client.get(url)).headers["ETag"]
+
+    await client.post("/api/rewards/", data={"name": "绘本", "star_cost": 10, "child_ids[]": [child_id, sibling_id]})
+    assert (await client.get(url, headers={"If-None-Match": etag})).status_code == 200
+
+    etag = (await client.get(url)).headers["ETag"]
+    await client.post(f"/api/children/{other_id}/stars/add", json={"amount": 2})
+    assert (await client.get(url, headers={"If-None-Match": etag})).status_code == 304
+    # The reward's progress in the detail includes the sibling's stars
+    await client.post(f"/api/children/{sibling_id}/stars/add", json={"amount": 2})
+    assert (await client.get(url, headers={"If-None-Match": etag})).status_code == 200
@@ -0,0 +1,72 @@
+"""Tests for the streamed NDJSON and CSV star history exports"""
+import csv
+import io
+import json
+
+from app.core.config import settings
+from app.services.export import csv_chunks, export_statement, ndjson_chunks
+from test_rewards import create_reward
+
+
+async def add_stars(client, child_id, *amounts):
+    for amount in amounts:
+        await client.post(f"/api/children/{child_id}/stars/add", json={"amount": amount, "reason": "认真写作业"})
+
+
+async def test_ndjson_export_of_a_child(client, make_child):
+    child_id = await make_child()
+    await add_stars(client, child_id, 5, 6)
+    reward_id = await create_reward(client, [child_id])
+    await client.post(f"/api/rewards/{reward_id}/redeem", json={"deductions": [{"child_id": child_id, "amount": 10}]})
+
+    response = await client.get(f"/api/children/{child_id}/star-records/export")
+    assert response.status_code == 200
+    assert response.headers["content-type"] == "application/x-ndjson"
+    assert response.headers["content-disposition"] == f'attachment; filename="star-records-{child_id}.ndjson"'
+
+    records = [json.loads(line) for line in response.text.splitlines()]
+    assert [(record["type"], record["amount"]) for record in records] == [("add", 5), ("add", 6), ("redeem", -10)]
+    assert records[0]["child_name"] == "小明"
+    assert records[0]["reason"] == "认真写作业"
+    assert records[0]["category"] == "homework"
+    assert records[2]["reward"] is not None
+    assert records[0]["id"] < records[1]["id"] < records[2]["id"]
+
+
+async def test_csv_export_of_a_family(client, make_child):
+    first, second, third = await make_child(), await make_child(name="小红", gender="female"), await make_child(name="小刚")
+    await add_stars(client, first, 1)
+    await add_stars(client, second, 2, 3)
+    await add_stars(client, third, 4)
+
+    response = await client.get("/api/children/star-records/export", params={"child_ids": [first, second], "format": "csv"})
+    assert response.status_code == 200
+    assert response.headers["content-type"] == "text/csv; charset=utf-8"
+    rows = list(csv.DictReader(io.StringIO(response.content.decode("utf-8-sig"))))
+    assert [(int(row["child_id"]), int(row["amount"])) for row in rows] == [(first, 1), (second, 2), (second, 3)]
+    assert rows[1]["child_name"] == "小红"
+
+    response = await client.get("/api/children/star-records/export")
+    assert len(response.text.splitlines()) == 4
+
+
+async def test_export_is_streamed_in_batches(client, make_child, monkeypatch):
+    child_id = await make_child()
+    await add_stars(client, child_id, *range(1, 6))
+    monkeypatch.setattr(settings, "export_batch_size", 2)
+
+    chunks = [chunk async for chunk in ndjson_chunks(export_statement([child_id]))]
+    assert [chunk.count(b"\n") for chunk in chunks] == [2, 2, 1]
+    # The CSV header goes out before the query
+    chunks = [chunk async for chunk in csv_chunks(export_statement([child_id]))]
+    assert [chunk.count(b"\n") for chunk in chunks] == [1, 2, 2, 1]
+
+
+async def test_export_of_unknown_children(client, make_child):
+    child_id = await make_child()
+    assert (await client.get("/api/children/999/star-records/export")).status_code == 404
+    response = await client.get("/api/children/star-records/export", params={"child_ids": [child_id, 999]})
+    assert response.status_code == 404
+    response = await client.get(f"/api/children/{child_id}/star-records/export")
+    assert response.status_code == 200
+    assert response.text == ""
@@ -0,0 +1,137 @@
+"""Tests for Idempotency-Key handling on mutation routes"""
+from datetime import datetime, timedelta
+
+import pytest
+from sqlalchemy import select, update
+
+from app.api.endpoints import stars as stars_endpoint
+from app.core import storage
+from app.core.config import settings
+from app.core.database import async_engine
+from app.models import IdempotencyKey
+from app.services import idempotency
+from app.services.idempotency import prune_expired_keys
+
+
+async def test_retry_replays_stored_response(client, make_child):
+    child_id = await make_child()
+    headers = {"Idempotency-Key": "add-1"}
+
+    first = await client.post(f"/api/children/{child_id}/stars/add", json={"amount": 5}, headers=headers)
+    retry = await client.post(f"/api/children/{child_id}/stars/add", json={"amount": 5}, headers=headers)
+
+    assert retry.status_code == first.status_code == 200
+    assert retry.json() == first.json()
+    assert retry.headers["Idempotent-Replayed"] == "true"
+    detail = (await client.get(f"/api/children/{child_id}")).json()["data"]
+    assert detail["star_count"] == 5
+    assert len(detail["star_records"]) == 1
+
+
+async def test_key_reused_for_different_request(client, make_child):
+    child_id = await make_child()
+    headers = {"Idempotency-Key": "add-2"}
+
+    await client.post(f"/api/children/{child_id}/stars/add", json={"amount": 5}, headers=headers)
+    response = await client.post(f"/api/children/{child_id}/stars/add", json={"amount": 6}, headers=headers)
+
+    assert response.status_code == 422
+    assert (await client.get(f"/api/children/{child_id}")).json()["data"]["star_count"] == 5
+
+
+async def test_redeem_retry_is_not_rejected_as_already_redeemed(client, make_child):
+    child_id = await make_child()
+    await client.post(f"/api/children/{child_id}/stars/add", json={"amount": 20})
+    response = await client.post("/api/rewards/", data={"name": "绘本", "star_cost": 10, "child_ids[]": [child_id]})
+    reward_id = response.json()["data"]["id"]
+
+    body = {"deductions": [{"child_id": child_id, "amount": 10}]}
+    headers = {"Idempotency-Key": "redeem-1"}
+    first = await client.post(f"/api/rewards/{reward_id}/redeem", json=body, headers=headers)
+    retry = await client.post(f"/api/rewards/{reward_id}/redeem", json=body, headers=headers)
+
+    assert first.json()["success"] is True
+    assert retry.json() == first.json()
+
+
+async def test_multipart_routes_ignore_the_key(client, make_child, tmp_path, monkeypatch):
+    monkeypatch.setattr(storage, "STORAGE_ROOT", tmp_path)
+    child_id = await make_child()
+    headers = {"Idempotency-Key": "reward-1"}
+    data = {"name": "绘本", "star_cost": 10, "child_ids[]": [child_id]}
+    files = {"image": ("book.png", b"\x89PNG\r\n\x1a\n" + b"\x00" * 100, "image/png")}
+
+    # Each attempt has its own multipart boundary; neither is rejected as a reused key
+    first = await client.post("/api/rewards/", data=data, files=files, headers=headers)
+    second = await client.post("/api/rewards/", data=data, files=files, headers=headers)
+    assert first.status_code == second.status_code == 201
+    assert "Idempotent-Replayed" not in second.headers
+    async with async_engine.connect() as conn:
+        assert (await conn.execute(select(IdempotencyKey.key))).all() == []
+
+
+async def test_lost_response_after_commit_is_reported_as_applied(client, make_child, monkeypatch):
+    child_id = await make_child()
+    headers = {"Idempotency-Key": "lost-1"}
+    url = f"/api/children/{child_id}/stars/add"
+
+    # The process dies after the handler committed, before the response is stored
+    async def die(key, response):
+        pass
+    monkeypatch.setattr(idempotency, "store_response", die)
+    await client.post(url, json={"amount": 5}, headers=headers)
+    monkeypatch.undo()
+
+    # In flight until the lease runs out
+    assert (await client.post(url, json={"amount": 5}, headers=headers)).status_code == 409
+    async with async_engine.begin() as conn:
+        await conn.execute(update(IdempotencyKey.__table__).values(locked_until=datetime.now() - timedelta(seconds=1)))
+
+    retry = await client.post(url, json={"amount": 5}, headers=headers)
+    assert retry.status_code == 200
+    assert retry.json()["success"] is True
+    assert retry.headers["Idempotent-Replayed"] == "true"
+    assert (await client.post(url, json={"amount": 5}, headers=headers)).json() == retry.json()
+    assert (await client.get(f"/api/children/{child_id}")).json()["data"]["star_count"] == 5
+
+
+async def test_uncommitted_request_is_run_again_after_its_lease(client, make_child, monkeypatch):
+    child_id = await make_child()
+    headers = {"Idempotency-Key": "lost-2"}
+    url = f"/api/children/{child_id}/stars/add"
+
+    # The first request dies before committing, without releasing its key
+    async def crash(*args, **kwargs):
+        raise RuntimeError("worker lost")
+    monkeypatch.setattr(stars_endpoint, "change_star_balance", crash)
+    monkeypatch.setattr(idempotency, "release_key", crash)
+    monkeypatch.setattr(settings, "idempotency_lease_seconds", 0)
+    with pytest.raises(RuntimeError):
+        await client.post(url, json={"amount": 5}, headers=headers)
+    monkeypatch.undo()
+
+    retry = await client.post(url, json={"amount": 5}, headers=headers)
+    assert retry.status_code == 200
+    assert "Idempotent-Replayed" not in retry.headers
+    assert (await client.get(f"/api/children/{child_id}")).json()["data"]["star_count"] == 5
+    async with async_engine.connect() as conn:
+        row = (await conn.execute(select(IdempotencyKey.__table__))).one()
+    assert row.committed and row.status_code == 200
+
+
+async def test_prune_expired_keys(client, make_child):
+    child_id = await make_child()
+    for i in range(5):
+        await client.post(f"/api/children/{child_id}/stars/add", json={"amount": 1}, headers={"Idempotency-Key": f"k{i}"})
+
+    async with async_engine.begin() as conn:
+        await conn.execute(
+            update(IdempotencyKey.__table__)
+            .where(IdempotencyKey.key.in_(["k0", "k1", "k2"]))
+            .values(expires_at=datetime.now() - timedelta(seconds=1))
+        )
+
+    assert await prune_expired_keys(batch_size=2) == 3
+    async with async_engine.connect() as conn:
+        remaining = (await conn.execute(select(IdempotencyKey.key).order_by(IdempotencyKey.key))).scalars().all()
+    assert remaining == ["k3", "k4"]
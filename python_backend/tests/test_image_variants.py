@@ -0,0 +1,102 @@
+"""Tests for resized WebP variants of uploaded images"""
+import asyncio
+import io
+
+import pytest
+from PIL import Image
+
+from app.api.endpoints import children
+from app.core import storage
+from app.core.config import settings
+from app.services import image_variants
+
+
+def png_bytes(width=400, height=200) -> bytes:
+    buffer = io.BytesIO()
+    Image.new("RGB", (width, height), (200, 30, 30)).save(buffer, "PNG")
+    return buffer.getvalue()
+
+
+@pytest.fixture(autouse=True)
+def storage_root(tmp_path, monkeypatch):
+    monkeypatch.setattr(storage, "STORAGE_ROOT", tmp_path)
+    monkeypatch.setattr(settings, "image_variants_enabled", True)
+    yield tmp_path
+    image_variants.shutdown_executor()
+    # Renders still in flight belong to this test's event loop
+    image_variants._in_flight.clear()
+
+
+async def upload_avatar(client, content):
+    response = await client.post(
+        "/api/children/",
+        data={"name": "小明", "birthday": "2018-05-15", "gender": "boy"},
+        files={"avatar": ("me.png", content, "image/png")}
+    )
+    assert response.status_code == 201
+    return response.json()["data"]
+
+
+async def test_variants_are_rendered_after_upload(client, storage_root):
+    child = await upload_avatar(client, png_bytes())
+    await asyncio.gather(*image_variants._background_tasks)
+
+    variants = child["avatar_variants"]
+    assert set(variants) == {"64", "256", "1024"}
+    for size, url in variants.items():
+        with Image.open(storage_root / url.removeprefix("/storage/")) as image:
+            assert image.format == "WEBP"
+            # Bounded by the variant size, never upscaled
+            assert image.size == (min(400, int(size)), min(200, int(size) // 2))
+
+    listed = (await client.get("/api/children/")).json()["data"][0]
+    assert listed["avatar_variants"] == variants
+
+
+async def test_missing_variant_is_rendered_on_request(client, storage_root, monkeypatch):
+    monkeypatch.setattr(children, "schedule_variants", lambda path: None)
+    child = await upload_avatar(client, png_bytes())
+    url = child["avatar_variants"]["64"]
+    assert not (storage_root / url.removeprefix("/storage/")).exists()
+
+    response = await client.get(url)
+    assert response.status_code == 200
+    assert response.headers["content-type"] == "image/webp"
+    assert "immutable" in response.headers["cache-control"]
+    with Image.open(io.BytesIO(response.content)) as image:
+        assert image.size == (64, 32)
+
+
+async def test_unknown_variants_are_not_found(client):
+    child = await upload_avatar(client, png_bytes())
+    url = child["avatar_variants"]["64"]
+
+    assert (await client.get(url.replace("/64/", "/65/"))).status_code == 404
+    assert (await client.get(url.replace(".webp", ".png"))).status_code == 404
+    assert (await client.get(f"/storage/variants/64/ab/{'ab' * 32}.webp")).status_code == 404
+
+
+async def test_variants_are_deleted_with_their_blob(client, storage_root):
+    child = await upload_avatar(client, png_bytes())
+    await asyncio.gather(*image_variants._background_tasks)
+    variants = [storage_root / url.removeprefix("/storage/") for url in child["avatar_variants"].values()]
+    assert all(variant.exists() for variant in variants)
+
+    assert (await client.delete(f"/api/children/{child['id']}")).status_code == 200
+    assert not any(variant.exists() for variant in variants)
+
+
+async def test_dead_worker_does_not_stop_later_renders(client, storage_root, monkeypatch):
+    monkeypatch.setattr(children, "schedule_variants", lambda path: None)
+    child = await upload_avatar(client, png_bytes())
+    urls = child["avatar_variants"]
+    assert (await client.get(urls["64"])).status_code == 200
+
+    kill_workers(image_variants.pool)
+    assert (await client.get(urls["256"])).status_code == 200
+
+
+def kill_workers(pool):
+    for process in list(pool.executor()._processes.values()):
+        process.kill()
+        process.join()
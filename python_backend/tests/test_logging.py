@@ -0,0 +1,81 @@
+"""Tests for the batching JSON log sink and per-route sampling"""
+import json
+import threading
+
+from loguru import logger
+
+from app.core.cache import response_cache
+from app.core.config import settings
+from app.core.logging import BatchingJsonSink, sample_filter
+
+
+def read_lines(directory):
+    return [json.loads(line) for path in sorted(directory.glob("app_*.jsonl")) for line in path.read_text().splitlines()]
+
+
+def test_json_lines_are_written_in_batches(tmp_path):
+    sink = BatchingJsonSink(tmp_path, batch_size=10, flush_interval=0.05)
+    handler_id = logger.add(sink, level="DEBUG")
+    try:
+        for i in range(25):
+            logger.bind(child_id=i).info(f"Record {i}")
+        try:
+            raise ValueError("boom")
+        except ValueError:
+            logger.exception("Failed")
+    finally:
+        logger.remove(handler_id)
+
+    lines = read_lines(tmp_path)
+    assert [line["message"] for line in lines[:25]] == [f"Record {i}" for i in range(25)]
+    assert lines[3]["level"] == "INFO"
+    assert lines[3]["extra"] == {"child_id": 3}
+    assert lines[3]["function"] == "test_json_lines_are_written_in_batches"
+    assert "ValueError: boom" in lines[-1]["exception"]
+    assert sink.stats()["written"] == 26
+
+
+def test_full_queue_drops_info_records(tmp_path, monkeypatch):
+    sink = BatchingJsonSink(tmp_path, queue_size=5, batch_size=1, flush_interval=0)
+    writing = threading.Event()
+    release = threading.Event()
+    write_batch = sink._write_batch
+
+    def stalled_write_batch(entries):
+        writing.set()
+        release.wait(5)
+        write_batch(entries)
+
+    monkeypatch.setattr(sink, "_write_batch", stalled_write_batch)
+    handler_id = logger.add(sink, level="DEBUG")
+    try:
+        logger.info("first")
+        assert writing.wait(5)
+        for i in range(10):
+            logger.info(f"Record {i}")
+        assert sink.dropped == 5
+        release.set()
+    finally:
+        logger.remove(handler_id)
+
+    messages = [line["message"] for line in read_lines(tmp_path)]
+    assert [m for m in messages if m.startswith("Record")] == [f"Record {i}" for i in range(5)]
+    assert "Dropped 5 log records: log queue full" in messages
+
+
+async def test_info_records_are_sampled_per_route(client, monkeypatch):
+    messages = []
+    handler_id = logger.add(lambda message: messages.append(message.record["message"]), filter=sample_filter)
+    try:
+        monkeypatch.setattr(settings, "log_sample_rates", {"/api/children/": 0.0})
+        await client.get("/api/children/")
+        logger.info("outside a request")
+        assert "Retrieved 0 children" not in messages
+        assert "outside a request" in messages
+
+        monkeypatch.setattr(settings, "log_sample_rates", {"/api/children/": 1.0})
+        response_cache.clear()
+        await client.get("/api/children/")
+        assert "Retrieved 0 children" in messages
+    finally:
+        logger.remove(handler_id)
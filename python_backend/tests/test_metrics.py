@@ -0,0 +1,59 @@
+"""Tests for the /metrics endpoint"""
+import pytest
+
+from app.core.metrics import (
+    Histogram,
+    db_pool_checkout_wait,
+    http_request_db_statements,
+    http_request_duration,
+    http_requests,
+    registry,
+)
+
+
+@pytest.fixture(autouse=True)
+def fresh_metrics():
+    registry.clear()
+
+
+async def test_requests_are_counted_by_route_template(client, make_child):
+    child_id = await make_child()
+    await client.get(f"/api/children/{child_id}")
+    await client.get(f"/api/children/{child_id}")
+    await client.get("/api/children/9999")
+
+    assert http_requests.value("GET", "/api/children/{child_id}", "200") == 2
+    assert http_requests.value("GET", "/api/children/{child_id}", "404") == 1
+    assert http_requests.value("POST", "/api/children/", "201") == 1
+    assert http_request_duration.count("GET", "/api/children/{child_id}") == 3
+    # Every request that reads a child runs SQL, attributed to that request
+    assert http_request_db_statements.sum("GET", "/api/children/{child_id}") >= 3
+    assert db_pool_checkout_wait.count("async") >= 1
+
+
+async def test_metrics_text_format(client):
+    await client.get("/api/rewards/")
+    response = await client.get("/metrics")
+
+    assert response.status_code == 200
+    assert response.headers["content-type"].startswith("text/plain; version=0.0.4")
+    text = response.text
+    assert "# TYPE http_request_duration_seconds histogram" in text
+    assert 'http_requests_total{method="GET",route="/api/rewards/",status="200"} 1' in text
+    assert 'http_request_duration_seconds_bucket{method="GET",route="/api/rewards/",le="+Inf"} 1' in text
+    assert 'db_pool_size{engine="async"}' in text
+    assert 'db_pool_saturation{engine="async"}' in text
+
+
+def test_histogram_buckets_are_cumulative():
+    histogram = Histogram("test_seconds", "Test", ("route",), buckets=(0.1, 1.0))
+    for value in (0.05, 0.1, 0.5, 3.0):
+        histogram.observe(value, "/x")
+
+    assert histogram.render() == [
+        'test_seconds_bucket{route="/x",le="0.1"} 2',
+        'test_seconds_bucket{route="/x",le="1.0"} 3',
+        'test_seconds_bucket{route="/x",le="+Inf"} 4',
+        'test_seconds_sum{route="/x"} 3.65',
+        'test_seconds_count{route="/x"} 4',
+    ]
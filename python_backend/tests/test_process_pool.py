@@ -0,0 +1,32 @@
+"""Tests for the worker process pools replacing themselves when broken"""
+import os
+from concurrent.futures.process import BrokenProcessPool
+
+import pytest
+
+from app.core.process_pool import WorkerPool
+
+
+@pytest.fixture
+def pool():
+    pool = WorkerPool("test", lambda: 1)
+    yield pool
+    pool.shutdown()
+
+
+async def test_broken_pool_is_replaced(pool):
+    assert await pool.run(abs, -1) == 1
+    broken = pool.executor()
+    for process in list(broken._processes.values()):
+        process.kill()
+        process.join()
+
+    assert await pool.run(abs, -2) == 2
+    assert pool.executor() is not broken
+
+
+async def test_job_killing_its_worker_fails_without_breaking_the_pool(pool):
+    # Crashes the first worker and the one it is retried on
+    with pytest.raises(BrokenProcessPool):
+        await pool.run(os._exit, 1)
+    assert await pool.run(abs, -3) == 3
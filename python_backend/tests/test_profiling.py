@@ -0,0 +1,76 @@
+"""Tests for on-demand request profiling"""
+import json
+
+import httpx
+import pytest
+
+from app.core import profiling
+from app.core.config import settings
+from app.core.database import async_engine
+from main import app
+
+
+@pytest.fixture
+async def profiled_client(tmp_path, monkeypatch):
+    """Client for the app wrapped in the profiling middleware, as main.py installs it when enabled"""
+    monkeypatch.setattr(settings, "profiling_enabled", True)
+    monkeypatch.setattr(profiling, "PROFILE_DIR", tmp_path)
+    profiling.instrument_engine(async_engine.sync_engine)
+    transport = httpx.ASGITransport(app=profiling.ProfilingMiddleware(app))
+    async with httpx.AsyncClient(transport=transport, base_url="http://test") as client:
+        yield client
+
+
+async def test_profile_is_stored(profiled_client, make_child, tmp_path):
+    child_id = await make_child()
+
+    response = await profiled_client.get(f"/api/children/{child_id}", headers={"X-Profile": "1"})
+    assert response.status_code == 200
+    profile_id = response.headers["x-profile-id"]
+
+    speedscope = json.loads((tmp_path / f"{profile_id}.speedscope.json").read_text())
+    profile = speedscope["profiles"][0]
+    assert profile["type"] == "sampled"
+    assert profile["name"] == "GET /api/children/{child_id}"
+    assert len(profile["samples"]) == len(profile["weights"])
+
+    details = json.loads((tmp_path / f"{profile_id}.json").read_text())
+    assert details["route"] == "/api/children/{child_id}"
+    assert details["status"] == 200
+    assert details["sql_statements"] == len(details["sql"]) > 0
+    assert all(statement["duration_ms"] >= 0 for statement in details["sql"])
+    assert isinstance(details["allocations"], list)
+
+    listing = await profiled_client.get("/profiles/")
+    assert [entry["id"] for entry in listing.json()["data"]] == [profile_id]
+    download = await profiled_client.get(f"/profiles/{profile_id}")
+    assert download.json()["$schema"] == profiling.SPEEDSCOPE_SCHEMA
+
+
+async def test_only_requested_profiles_are_taken(profiled_client, monkeypatch, tmp_path):
+    response = await profiled_client.get("/api/children/")
+    assert "x-profile-id" not in response.headers
+
+    monkeypatch.setattr(settings, "profiling_token", "secret")
+    response = await profiled_client.get("/api/children/?profile=wrong")
+    assert "x-profile-id" not in response.headers
+    response = await profiled_client.get("/api/rewards/?profile=secret")
+    assert "x-profile-id" in response.headers
+    assert len(list(tmp_path.glob("*.speedscope.json"))) == 1
+
+
+async def test_profiles_endpoint_requires_the_token(profiled_client, monkeypatch):
+    monkeypatch.setattr(settings, "profiling_token", "secret")
+    response = await profiled_client.get("/profiles/")
+    assert response.status_code == 403
+    response = await profiled_client.get("/profiles/20260101-000000-0123abcd?token=wrong")
+    assert response.status_code == 403
+    response = await profiled_client.get("/profiles/", headers={"X-Profiling-Token": "secret"})
+    assert response.status_code == 200
+    response = await profiled_client.get("/profiles/20260101-000000-0123abcd?token=secret")
+    assert response.status_code == 404
+
+
+async def test_profiles_endpoint_is_hidden_when_disabled(client):
+    response = await client.get("/profiles/")
+    assert response.status_code == 404
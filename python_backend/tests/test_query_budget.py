@@ -0,0 +1,75 @@
+"""Tests for per-route SQL statement budgets and N+1 detection"""
+import pytest
+from loguru import logger
+
+from app.api.endpoints import children
+from app.core.config import settings
+from app.core.metrics import RequestStats
+from app.core.query_budget import QueryBudgetExceeded, budget_mode, check_request, repeated_statements, statement_shape
+
+
+@pytest.fixture
+def warnings():
+    messages = []
+    handler_id = logger.add(lambda message: messages.append(message.record["message"]), level="WARNING")
+    yield messages
+    logger.remove(handler_id)
+
+
+def test_statement_shape_collapses_in_lists():
+    assert statement_shape("SELECT * FROM children\n  WHERE id IN (?, ?, ?)") == "SELECT * FROM children WHERE id IN (?, ...)"
+    assert repeated_statements({
+        "SELECT * FROM children WHERE id IN (?, ?)": 2,
+        "SELECT * FROM children WHERE id IN (?, ?, ?)": 1,
+        "SELECT 1": 1,
+    }) == [("SELECT * FROM children WHERE id IN (?, ...)", 3)]
+
+
+async def test_over_budget_request_fails_in_raise_mode(client, monkeypatch, enforce_query_budgets):
+    monkeypatch.setattr(children.get_children, "query_budget", 1)
+
+    # The statement over budget raised inside the handler, which answered with its error body
+    response = await client.get("/api/children/")
+    assert response.json()["success"] is False
+    # The overrun is logged, not raised, once the response has started
+    assert enforce_query_budgets == ["GET /api/children/ ran 2 SQL statements, budget is 1"]
+    enforce_query_budgets.clear()
+
+
+def test_raise_mode_raises_before_the_response_starts(monkeypatch):
+    monkeypatch.setattr(children.get_children, "query_budget", 1)
+    stats = RequestStats({"method": "GET", "path": "/api/children/", "route": children.router.routes[0]})
+    stats.statements = 2
+
+    with pytest.raises(QueryBudgetExceeded, match=r"GET / ran 2 SQL statements, budget is 1"):
+        check_request(stats, response_started=False)
+
+
+def test_budgets_are_logged_unless_configured(monkeypatch):
+    monkeypatch.setattr(settings, "query_budget_mode", None)
+    monkeypatch.setattr(settings, "debug", True)
+    assert budget_mode() == "log"
+
+
+async def test_over_budget_request_is_logged(client, monkeypatch, warnings):
+    monkeypatch.setattr(children.get_children, "query_budget", 1)
+    monkeypatch.setattr(settings, "query_budget_mode", "log")
+
+    response = await client.get("/api/children/")
+
+    assert response.status_code == 200
+    assert warnings == ["GET /api/children/ ran 2 SQL statements, budget is 1"]
+
+
+def test_repeated_statements_are_flagged(monkeypatch, warnings):
+    monkeypatch.setattr(settings, "n_plus_one_threshold", 3)
+    stats = RequestStats({"method": "GET", "path": "/api/rewards/"})
+    stats.statements = 4
+    stats.shapes = {
+        "SELECT children.id FROM children WHERE children.id = ?": 3,
+        "SELECT rewards.id FROM rewards": 1,
+    }
+
+    check_request(stats)
+
+    assert warnings == ["Probable N+1 in GET /api/rewards/: 3 x SELECT children.id FROM children WHERE children.id = ?"]
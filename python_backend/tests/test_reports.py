@@ -0,0 +1,205 @@
+"""Tests for the report jobs: queueing, rendering in worker processes and the cache"""
+from datetime import datetime, timedelta, timezone
+
+import pytest
+
+openpyxl = pytest.importorskip("openpyxl")
+pytest.importorskip("reportlab")
+
+from sqlalchemy import select, update
+
+from app.core.config import settings
+from app.core.database import async_engine
+from app.models import ReportJob, Reward
+from app.services import reports
+from app.services.reports import period_start, run_pending_jobs
+from test_rewards import create_reward
+
+# Star records are stamped in UTC (app.core.clock.utc_now)
+TODAY = datetime.now(timezone.utc).date()
+
+
+@pytest.fixture(autouse=True)
+def report_dir(tmp_path, monkeypatch):
+    monkeypatch.setattr(settings, "report_dir", str(tmp_path))
+    yield tmp_path
+    reports.shutdown_executor()
+
+
+async def request_report(client, child_id, **body):
+    response = await client.post("/api/reports/", json={"child_id": child_id, "start": str(TODAY), **body})
+    assert response.status_code in (200, 202)
+    return response
+
+
+async def job_status(client, job_id):
+    response = await client.get(f"/api/reports/jobs/{job_id}")
+    assert response.status_code == 200
+    return response.json()["data"]
+
+
+async def test_report_is_queued_rendered_and_downloaded(client, make_child, report_dir):
+    child_id = await make_child()
+    await client.post(f"/api/children/{child_id}/stars/add", json={"amount": 5, "reason": "认真写作业"})
+    await client.post(f"/api/children/{child_id}/stars/subtract", json={"amount": 2, "reason": "不收拾玩具"})
+
+    response = await request_report(client, child_id)
+    assert response.status_code == 202
+    job = response.json()["data"]
+    assert job["status"] == "pending"
+    assert job["period_start"] == str(period_start("weekly", TODAY))
+    assert job["status_url"] == f"/api/reports/jobs/{job['id']}"
+    assert job["download_url"] is None
+
+    download = await client.get(f"/api/reports/jobs/{job['id']}/download")
+    assert download.status_code == 409
+
+    assert await run_pending_jobs() == 1
+    job = await job_status(client, job["id"])
+    assert job["status"] == "done"
+
+    download = await client.get(job["download_url"])
+    assert download.status_code == 200
+    assert download.headers["content-type"].startswith("application/vnd.openxmlformats")
+    path = report_dir / "downloaded.xlsx"
+    path.write_bytes(download.content)
+    workbook = openpyxl.load_workbook(path, read_only=True)
+    assert workbook.sheetnames == ["Summary", "Daily", "Records"]
+    records = list(workbook["Records"].iter_rows(min_row=2, values_only=True))
+    assert [(row[1], row[2], row[3]) for row in records] == [("add", 5, "认真写作业"), ("subtract", -2, "不收拾玩具")]
+    daily = {row[0]: row for row in workbook["Daily"].iter_rows(min_row=2, values_only=True)}
+    assert len(daily) == 7
+    assert daily[str(TODAY)][1:] == (5, 2, 0, 3, 2)
+
+
+async def test_pdf_report(client, make_child):
+    child_id = await make_child()
+    await client.post(f"/api/children/{child_id}/stars/add", json={"amount": 3, "reason": "帮妈妈做家务"})
+
+    job = (await request_report(client, child_id, period="monthly", format="pdf")).json()["data"]
+    assert job["period_start"] == str(TODAY.replace(day=1))
+    await run_pending_jobs()
+
+    download = await client.get((await job_status(client, job["id"]))["download_url"])
+    assert download.status_code == 200
+    assert download.headers["content-type"] == "application/pdf"
+    assert download.content.startswith(b"%PDF")
+
+
+async def test_unchanged_data_reuses_the_report(client, make_child, report_dir):
+    child_id = await make_child()
+    await client.post(f"/api/children/{child_id}/stars/add", json={"amount": 5})
+
+    first = (await request_report(client, child_id)).json()["data"]
+    # Asking again before it is rendered does not queue a second job
+    assert (await request_report(client, child_id)).json()["data"]["id"] == first["id"]
+    await run_pending_jobs()
+
+    response = await request_report(client, child_id)
+    assert response.status_code == 200
+    assert response.json()["data"]["id"] == first["id"]
+    assert response.json()["data"]["status"] == "done"
+    assert await run_pending_jobs() == 0
+
+    # A new record is new data: a fresh report replaces the old one
+    await client.post(f"/api/children/{child_id}/stars/add", json={"amount": 1})
+    response = await request_report(client, child_id)
+    assert response.status_code == 202
+    second = response.json()["data"]
+    assert second["id"] != first["id"]
+    await run_pending_jobs()
+
+    assert (await client.get(f"/api/reports/jobs/{first['id']}")).status_code == 404
+    assert [path.name for path in report_dir.rglob("*.xlsx")] == [f"weekly-{second['period_start']}-{second['id']}.xlsx"]
+
+
+async def test_renamed_child_or_reward_renders_a_new_report(client, make_child):
+    child_id = await make_child()
+    await client.post(f"/api/children/{child_id}/stars/add", json={"amount": 10})
+    reward_id = await create_reward(client, [child_id])
+    await client.post(f"/api/rewards/{reward_id}/redeem", json={"deductions": [{"child_id": child_id, "amount": 10}]})
+    first = (await request_report(client, child_id)).json()["data"]
+
+    await client.patch(f"/api/children/{child_id}", json={"name": "小红"})
+    second = (await request_report(client, child_id)).json()["data"]
+    assert second["id"] != first["id"]
+
+    # Redeemed rewards are read-only in the API, so rename it in the database
+    async with async_engine.begin() as conn:
+        await conn.execute(update(Reward).where(Reward.id == reward_id).values(name="绘本"))
+    third = (await request_report(client, child_id)).json()["data"]
+    assert third["id"] != second["id"]
+    assert (await request_report(client, child_id)).json()["data"]["id"] == third["id"]
+
+
+async def test_queueing_a_report_does_not_change_the_data_version(client, make_child):
+    child_id = await make_child()
+    etag = (await client.get("/api/children/")).headers["etag"]
+    await request_report(client, child_id)
+    assert (await client.get("/api/children/", headers={"If-None-Match": etag})).status_code == 304
+
+
+async def test_failed_job_is_reported_and_retried_on_request(client, make_child):
+    child_id = await make_child()
+    job = (await request_report(client, child_id)).json()["data"]
+    async with async_engine.begin() as conn:
+        # A job for a child that no longer exists fails in the worker
+        await conn.execute(update(ReportJob).where(ReportJob.id == job["id"]).values(child_id=child_id + 100))
+    await run_pending_jobs()
+
+    failed = await job_status(client, job["id"])
+    assert failed["status"] == "failed"
+    assert failed["error"]
+
+    retry = (await request_report(client, child_id)).json()["data"]
+    assert retry["id"] != job["id"]
+    assert retry["status"] == "pending"
+
+
+async def test_stale_running_jobs_are_requeued(client, make_child):
+    child_id = await make_child()
+    job = (await request_report(client, child_id)).json()["data"]
+    async with async_engine.begin() as conn:
+        await conn.execute(
+            update(ReportJob).where(ReportJob.id == job["id"])
+            .values(status="running", started_at=datetime.now() - timedelta(seconds=settings.report_job_timeout_seconds + 1))
+        )
+    assert await run_pending_jobs() == 0
+    assert await reports.requeue_stale_jobs() == 1
+    assert await run_pending_jobs() == 1
+    assert (await job_status(client, job["id"]))["status"] == "done"
+
+
+async def test_deleting_a_child_removes_its_reports(client, make_child, report_dir):
+    child_id = await make_child()
+    job = (await request_report(client, child_id)).json()["data"]
+    await run_pending_jobs()
+    assert list(report_dir.rglob("*.xlsx"))
+
+    assert (await client.delete(f"/api/children/{child_id}")).status_code == 200
+    assert not list(report_dir.rglob("*.xlsx"))
+    async with async_engine.connect() as conn:
+        assert (await conn.execute(select(ReportJob.id))).all() == []
+    assert (await client.get(f"/api/reports/jobs/{job['id']}")).status_code == 404
+
+
+async def test_unknown_child_and_job(client):
+    response = await client.post("/api/reports/", json={"child_id": 999})
+    assert response.status_code == 404
+    assert (await client.get("/api/reports/jobs/999")).status_code == 404
+    assert (await client.get("/api/reports/jobs/999/download")).status_code == 404
+
+
+async def test_dead_worker_does_not_fail_later_jobs(client, make_child):
+    child_id = await make_child()
+    await request_report(client, child_id)
+    await run_pending_jobs()
+    broken = reports.pool.executor()
+    for process in list(broken._processes.values()):
+        process.kill()
+        process.join()
+
+    job = (await request_report(client, child_id, format="pdf")).json()["data"]
+    await run_pending_jobs()
+    assert (await job_status(client, job["id"]))["status"] == "done"
+    assert reports.pool.executor() is not broken
@@ -0,0 +1,133 @@
+"""Tests for the reward endpoints"""
+import asyncio
+
+from sqlalchemy import select
+
+from app.core.clock import utc_now
+from app.core.database import async_engine
+from app.models import Reward, StarRecord
+
+
+async def create_reward(client, child_ids, star_cost=10, name="乐高积木套装"):
+    response = await client.post(
+        "/api/rewards/",
+        data={"name": name, "star_cost": star_cost, "child_ids[]": child_ids}
+    )
+    assert response.status_code == 201
+    return response.json()["data"]["id"]
+
+
+async def test_reward_progress(client, make_child):
+    first, second = await make_child(), await make_child(name="小红", gender="female")
+    await client.post(f"/api/children/{first}/stars/add", json={"amount": 6})
+    await client.post(f"/api/children/{second}/stars/add", json={"amount": 5})
+    reward_id = await create_reward(client, [first, second])
+
+    response = await client.get("/api/rewards/")
+    reward = response.json()["data"][0]
+    assert reward["id"] == reward_id
+    assert reward["total_stars"] == 11
+    assert reward["is_achieved"] is True
+    assert {c["id"] for c in reward["children"]} == {first, second}
+
+
+async def test_redeem_reward(client, make_child):
+    first, second = await make_child(), await make_child(name="小红", gender="female")
+    await client.post(f"/api/children/{first}/stars/add", json={"amount": 6})
+    await client.post(f"/api/children/{second}/stars/add", json={"amount": 5})
+    reward_id = await create_reward(client, [first, second])
+
+    response = await client.post(
+        f"/api/rewards/{reward_id}/redeem",
+        json={"deductions": [{"child_id": first, "amount": 6}, {"child_id": second, "amount": 4}]}
+    )
+    assert response.json()["success"] is True
+
+    detail = (await client.get(f"/api/children/{second}")).json()["data"]
+    assert detail["star_count"] == 1
+    redeem_record = next(r for r in detail["star_records"] if r["type"] == "redeem")
+    assert redeem_record["amount"] == -4
+    assert redeem_record["reward"]["id"] == reward_id
+
+    response = await client.post(
+        f"/api/rewards/{reward_id}/redeem",
+        json={"deductions": [{"child_id": first, "amount": 10}]}
+    )
+    assert response.status_code == 400
+
+
+async def test_update_and_delete_reward(client, make_child):
+    first, second = await make_child(), await make_child(name="小红", gender="female")
+    reward_id = await create_reward(client, [first])
+
+    response = await client.patch(f"/api/rewards/{reward_id}", data={"child_ids[]": [first, second], "star_cost": 20})
+    data = response.json()["data"]
+    assert data["star_cost"] == 20
+    assert {c["id"] for c in data["children"]} == {first, second}
+
+    response = await client.delete(f"/api/rewards/{reward_id}")
+    assert response.json()["success"] is True
+    assert (await client.get(f"/api/rewards/{reward_id}")).status_code == 404
+
+
+async def test_reward_list_filters_and_pagination(client, make_child):
+    first, second = await make_child(), await make_child(name="小红", gender="female")
+    await client.post(f"/api/children/{first}/stars/add", json={"amount": 8})
+    near = await create_reward(client, [first], star_cost=10, name="绘本")
+    done = await create_reward(client, [first, second], star_cost=5, name="冰淇淋")
+    other = await create_reward(client, [second], star_cost=20, name="自行车")
+
+    async def ids(**params):
+        response = await client.get("/api/rewards/", params=params)
+        return [r["id"] for r in response.json()["data"]]
+
+    assert await ids(achieved="true") == [done]
+    assert set(await ids(achieved="false")) == {near, other}
+    assert set(await ids(child_id=second)) == {done, other}
+    assert await ids(order_by="progress") == [done, near, other]
+    assert await ids(order_by="progress", limit=1, offset=1) == [near]
+    assert await ids(redeemed="true") == []
+
+
+async def test_concurrent_redemptions_deduct_once(client, make_child):
+    child_id = await make_child()
+    await client.post(f"/api/children/{child_id}/stars/add", json={"amount": 30})
+    reward_id = await create_reward(client, [child_id])
+
+    responses = await asyncio.gather(*(
+        client.post(f"/api/rewards/{reward_id}/redeem", json={"deductions": [{"child_id": child_id, "amount": 10}]})
+        for _ in range(10)
+    ))
+    assert sum(r.status_code == 200 for r in responses) == 1
+
+    detail = (await client.get(f"/api/children/{child_id}")).json()["data"]
+    assert detail["star_count"] == 20
+    assert sum(r["type"] == "redeem" for r in detail["star_records"]) == 1
+
+
+async def test_redeem_rejects_unknown_child(client, make_child):
+    child_id = await make_child()
+    await client.post(f"/api/children/{child_id}/stars/add", json={"amount": 30})
+    reward_id = await create_reward(client, [child_id])
+
+    response = await client.post(
+        f"/api/rewards/{reward_id}/redeem",
+        json={"deductions": [{"child_id": child_id, "amount": 10}, {"child_id": 999, "amount": 1}]}
+    )
+    assert response.status_code == 400
+    assert response.json()["message"] == "Child 999 not found"
+    assert (await client.get(f"/api/children/{child_id}")).json()["data"]["star_count"] == 30
+
+
+async def test_redemption_is_stamped_on_the_app_clock(client, make_child):
+    child_id = await make_child()
+    await client.post(f"/api/children/{child_id}/stars/add", json={"amount": 10})
+    reward_id = await create_reward(client, [child_id])
+    await client.post(f"/api/rewards/{reward_id}/redeem", json={"deductions": [{"child_id": child_id, "amount": 10}]})
+
+    async with async_engine.connect() as conn:
+        redeemed_at = (await conn.execute(select(Reward.redeemed_at))).scalar_one()
+        record_at = (await conn.execute(select(StarRecord.created_at).where(StarRecord.type == "redeem"))).scalar_one()
+    # The reward and its star record agree, and both are UTC like the rollup days
+    assert redeemed_at == record_at
+    assert abs((utc_now() - redeemed_at).total_seconds()) < 60
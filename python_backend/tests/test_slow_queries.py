@@ -0,0 +1,52 @@
+"""Tests for the slow query log"""
+import pytest
+from loguru import logger
+from sqlalchemy import create_engine, text
+
+from app.core.config import settings
+from app.core.slow_queries import SlowQueryRecorder, parameters_shape
+
+
+@pytest.fixture
+def warnings(monkeypatch):
+    monkeypatch.setattr(settings, "slow_query_ms", 0)
+    messages = []
+    handler_id = logger.add(lambda message: messages.append(message.record["message"]), level="WARNING")
+    yield messages
+    logger.remove(handler_id)
+
+
+def test_parameters_shape():
+    assert parameters_shape((1, "a", None)) == "(int, str, NoneType)"
+    assert parameters_shape((1, 2, 3, "a")) == "(int x 3, str)"
+    assert parameters_shape({"child_id": 1}) == "{child_id: int}"
+    assert parameters_shape([(1, "a"), (2, "b")], executemany=True) == "2 x (int, str)"
+
+
+def test_slow_statements_are_explained_once_per_shape(warnings):
+    engine = create_engine("sqlite://")
+    SlowQueryRecorder(engine)
+    with engine.connect() as conn:
+        conn.execute(text("CREATE TABLE star_records (id INTEGER PRIMARY KEY, child_id INTEGER)"))
+        warnings.clear()
+        conn.execute(text("SELECT id FROM star_records WHERE child_id = :child_id"), {"child_id": 1})
+        conn.execute(text("SELECT id FROM star_records WHERE child_id = :child_id"), {"child_id": 2})
+        conn.execute(text("SELECT id FROM star_records WHERE id = :id"), {"id": 1})
+
+    slow = [message for message in warnings if message.startswith("Slow query")]
+    plans = [message for message in warnings if message.startswith("Query plan")]
+    assert len(slow) == 3
+    assert slow[0].startswith("Slow query (")
+    assert slow[0].endswith("ms) in no request: SELECT id FROM star_records WHERE child_id = ? params=(int)")
+    assert len(plans) == 2
+    assert plans[0].startswith("Query plan for SELECT id FROM star_records WHERE child_id = ? (full scan of star_records):")
+    assert "full scan" not in plans[1]
+
+
+async def test_slow_statements_name_their_route(client, make_child, warnings):
+    child_id = await make_child()
+    warnings.clear()
+
+    await client.get(f"/api/children/{child_id}/star-records")
+
+    assert any(" in /api/children/{child_id}/star-records: SELECT " in message for message in warnings)
@@ -0,0 +1,98 @@
+"""Tests for the star endpoints"""
+import asyncio
+
+
+async def test_add_and_subtract_stars(client, make_child):
+    child_id = await make_child()
+
+    response = await client.post(f"/api/children/{child_id}/stars/add", json={"amount": 10})
+    assert response.json()["data"]["star_count"] == 10
+
+    response = await client.post(f"/api/children/{child_id}/stars/subtract", json={"amount": 4})
+    assert response.json()["data"]["star_count"] == 6
+
+
+async def test_subtract_more_than_balance(client, make_child):
+    child_id = await make_child()
+
+    response = await client.post(f"/api/children/{child_id}/stars/subtract", json={"amount": 1})
+    assert response.status_code == 400
+    assert response.json()["message"] == "Not enough stars"
+
+
+async def test_add_stars_to_missing_child(client):
+    response = await client.post("/api/children/999/stars/add", json={"amount": 1})
+    assert response.status_code == 404
+
+
+async def test_concurrent_adds_are_not_lost(client, make_child):
+    child_id = await make_child()
+
+    responses = await asyncio.gather(*(
+        client.post(f"/api/children/{child_id}/stars/add", json={"amount": 3})
+        for _ in range(300)
+    ))
+    assert all(r.status_code == 200 for r in responses)
+
+    detail = (await client.get(f"/api/children/{child_id}")).json()["data"]
+    assert detail["star_count"] == 900
+
+
+async def test_concurrent_subtracts_never_go_negative(client, make_child):
+    child_id = await make_child()
+    await client.post(f"/api/children/{child_id}/stars/add", json={"amount": 10})
+
+    responses = await asyncio.gather(*(
+        client.post(f"/api/children/{child_id}/stars/subtract", json={"amount": 1})
+        for _ in range(50)
+    ))
+    assert sum(r.status_code == 200 for r in responses) == 10
+    assert sum(r.status_code == 400 for r in responses) == 40
+
+    detail = (await client.get(f"/api/children/{child_id}")).json()["data"]
+    assert detail["star_count"] == 0
+
+
+async def test_bulk_operations_atomic(client, make_child):
+    first, second = await make_child(), await make_child(name="小红", gender="female")
+
+    response = await client.post("/api/stars/bulk", json={"operations": [
+        {"child_id": first, "type": "add", "amount": 5, "reason": "按时睡觉"},
+        {"child_id": second, "type": "add", "amount": 3},
+        {"child_id": first, "type": "subtract", "amount": 2},
+    ]})
+    assert response.status_code == 200
+    data = response.json()["data"]
+    assert all(r["success"] for r in data["results"])
+    assert data["star_counts"] == [
+        {"child_id": first, "star_count": 3},
+        {"child_id": second, "star_count": 3},
+    ]
+
+    response = await client.post("/api/stars/bulk", json={"operations": [
+        {"child_id": first, "type": "add", "amount": 1},
+        {"child_id": second, "type": "subtract", "amount": 10},
+        {"child_id": 999, "type": "add", "amount": 1},
+    ]})
+    assert response.status_code == 400
+    results = response.json()["data"]["results"]
+    assert [r["success"] for r in results] == [True, False, False]
+    assert results[1]["message"] == "Not enough stars"
+    assert (await client.get(f"/api/children/{first}")).json()["data"]["star_count"] == 3
+
+
+async def test_bulk_operations_partial(client, make_child):
+    child_id = await make_child()
+
+    response = await client.post("/api/stars/bulk", json={"mode": "partial", "operations": [
+        {"child_id": child_id, "type": "add", "amount": 4},
+        {"child_id": child_id, "type": "subtract", "amount": 9},
+        {"child_id": child_id, "type": "subtract", "amount": 1},
+    ]})
+    assert response.status_code == 200
+    data = response.json()["data"]
+    assert [r["success"] for r in data["results"]] == [True, False, True]
+    assert data["star_counts"] == [{"child_id": child_id, "star_count": 3}]
+
+    detail = (await client.get(f"/api/children/{child_id}")).json()["data"]
+    assert len(detail["star_records"]) == 2
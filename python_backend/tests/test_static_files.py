@@ -0,0 +1,96 @@
+"""Tests for the /storage file server"""
+import gzip
+
+import httpx
+import pytest
+from fastapi import FastAPI
+
+from app.core.config import settings
+from app.core.static_files import IMMUTABLE_CACHE_CONTROL, StorageFiles
+
+SHA = "ab" * 32
+CONTENT = bytes(range(256)) * 4
+
+
+@pytest.fixture
+async def storage_client(tmp_path):
+    (tmp_path / "blobs" / "ab").mkdir(parents=True)
+    (tmp_path / "blobs" / "ab" / f"{SHA}.png").write_bytes(CONTENT)
+    (tmp_path / "avatars").mkdir()
+    (tmp_path / "avatars" / "old.png").write_bytes(CONTENT)
+
+    app = FastAPI()
+    app.mount("/storage", StorageFiles(directory=tmp_path), name="storage")
+    transport = httpx.ASGITransport(app=app)
+    async with httpx.AsyncClient(transport=transport, base_url="http://test") as client:
+        yield client
+
+
+BLOB_URL = f"/storage/blobs/ab/{SHA}.png"
+
+
+async def test_hash_named_files_are_immutable(storage_client):
+    response = await storage_client.get(BLOB_URL)
+    assert response.status_code == 200
+    assert response.content == CONTENT
+    assert response.headers["cache-control"] == IMMUTABLE_CACHE_CONTROL
+    assert response.headers["etag"] == f'"blobs-ab-{SHA}"'
+    assert response.headers["accept-ranges"] == "bytes"
+
+    legacy = await storage_client.get("/storage/avatars/old.png")
+    assert legacy.headers["cache-control"] == "public, no-cache"
+
+
+async def test_conditional_get(storage_client):
+    response = await storage_client.get(BLOB_URL, headers={"If-None-Match": f'"blobs-ab-{SHA}"'})
+    assert response.status_code == 304
+    assert response.content == b""
+
+    legacy = await storage_client.get("/storage/avatars/old.png")
+    response = await storage_client.get(
+        "/storage/avatars/old.png", headers={"If-Modified-Since": legacy.headers["last-modified"]}
+    )
+    assert response.status_code == 304
+
+
+async def test_range_requests(storage_client):
+    response = await storage_client.get(BLOB_URL, headers={"Range": "bytes=10-19"})
+    assert response.status_code == 206
+    assert response.content == CONTENT[10:20]
+    assert response.headers["content-range"] == f"bytes 10-19/{len(CONTENT)}"
+
+    response = await storage_client.get(BLOB_URL, headers={"Range": "bytes=-5"})
+    assert response.content == CONTENT[-5:]
+
+    response = await storage_client.get(BLOB_URL, headers={"Range": f"bytes={len(CONTENT)}-"})
+    assert response.status_code == 416
+    assert response.headers["content-range"] == f"bytes */{len(CONTENT)}"
+
+    # A stale If-Range gets the whole file
+    response = await storage_client.get(BLOB_URL, headers={"Range": "bytes=0-1", "If-Range": '"other"'})
+    assert response.status_code == 200
+    assert response.content == CONTENT
+
+
+async def test_precompressed_sibling(storage_client, tmp_path):
+    (tmp_path / "blobs" / "ab" / f"{SHA}.png.gz").write_bytes(gzip.compress(CONTENT))
+
+    response = await storage_client.get(BLOB_URL, headers={"Accept-Encoding": "gzip"})
+    assert response.headers["content-encoding"] == "gzip"
+    assert response.headers["vary"] == "Accept-Encoding"
+    assert response.content == CONTENT  # decoded by httpx
+
+    response = await storage_client.get(BLOB_URL, headers={"Accept-Encoding": "identity"})
+    assert "content-encoding" not in response.headers
+    assert response.content == CONTENT
+
+
+async def test_accel_redirect(storage_client, monkeypatch):
+    monkeypatch.setattr(settings, "storage_accel_redirect_prefix", "/_storage/")
+
+    response = await storage_client.get(BLOB_URL)
+    assert response.status_code == 200
+    assert response.content == b""
+    assert response.headers["x-accel-redirect"] == f"/_storage/blobs/ab/{SHA}.png"
+    assert response.headers["cache-control"] == IMMUTABLE_CACHE_CONTROL
+    assert response.headers["content-type"] == "image/png"
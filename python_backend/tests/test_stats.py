@@ -0,0 +1,122 @@
+"""Tests for the daily star rollups and the stats endpoint"""
+from datetime import datetime, timedelta, timezone
+
+from sqlalchemy import delete, select
+
+from app.core import clock
+from app.core.database import AsyncSessionLocal, async_engine
+from app.models import StarDailyRollup, StarRecord
+from app.services import stars
+from app.services.stars import insert_star_records
+from backfill_rollups import backfill_rollups
+from test_rewards import create_reward
+
+# Star records are stamped in UTC (app.core.clock.utc_now)
+TODAY = datetime.now(timezone.utc).date()
+
+
+async def daily_stats(client, child_id, **params):
+    response = await client.get(f"/api/children/{child_id}/stats/daily", params=params)
+    assert response.status_code == 200
+    return response.json()["data"]
+
+
+async def rollups():
+    async with async_engine.connect() as conn:
+        rows = await conn.execute(
+            select(
+                StarDailyRollup.child_id, StarDailyRollup.day, StarDailyRollup.type,
+                StarDailyRollup.record_count, StarDailyRollup.total_amount
+            ).order_by(StarDailyRollup.child_id, StarDailyRollup.day, StarDailyRollup.type)
+        )
+        return rows.all()
+
+
+async def test_star_changes_are_rolled_up_by_day(client, make_child):
+    first, second = await make_child(), await make_child(name="小红", gender="female")
+    await client.post(f"/api/children/{first}/stars/add", json={"amount": 10})
+    await client.post(f"/api/children/{first}/stars/add", json={"amount": 5})
+    await client.post(f"/api/children/{first}/stars/subtract", json={"amount": 2})
+    await client.post("/api/stars/bulk", json={"operations": [
+        {"child_id": first, "type": "add", "amount": 3},
+        {"child_id": second, "type": "add", "amount": 4},
+    ]})
+    reward_id = await create_reward(client, [first])
+    await client.post(f"/api/rewards/{reward_id}/redeem", json={"deductions": [{"child_id": first, "amount": 10}]})
+
+    data = await daily_stats(client, first, **{"from": str(TODAY - timedelta(days=2)), "to": str(TODAY)})
+    assert [day["day"] for day in data] == [str(TODAY - timedelta(days=offset)) for offset in (2, 1, 0)]
+    assert data[0] == {"day": str(TODAY - timedelta(days=2)), "add": 0, "subtract": 0, "redeem": 0, "net": 0, "records": 0}
+    assert data[-1] == {"day": str(TODAY), "add": 18, "subtract": 2, "redeem": 10, "net": 6, "records": 5}
+
+    data = await daily_stats(client, second, **{"from": str(TODAY), "to": str(TODAY)})
+    assert data == [{"day": str(TODAY), "add": 4, "subtract": 0, "redeem": 0, "net": 4, "records": 1}]
+
+
+async def test_record_and_rollup_share_one_timestamp(client, make_child, monkeypatch):
+    # A record written just before midnight must land on the same day in both places
+    just_before_midnight = datetime(2024, 5, 8, 23, 59, 59, 999999)
+    monkeypatch.setattr(clock, "utc_now", lambda: just_before_midnight)
+    monkeypatch.setattr(stars, "utc_now", lambda: just_before_midnight)
+    child_id = await make_child()
+    await client.post(f"/api/children/{child_id}/stars/add", json={"amount": 3})
+
+    async with async_engine.connect() as conn:
+        created_at = (await conn.execute(select(StarRecord.created_at))).scalar_one()
+    assert created_at == just_before_midnight
+    assert [row[1] for row in await rollups()] == [just_before_midnight.date()]
+    # The default range ends on the same clock's today
+    data = await daily_stats(client, child_id)
+    assert data[-1] == {"day": "2024-05-08", "add": 3, "subtract": 0, "redeem": 0, "net": 3, "records": 1}
+
+
+async def test_default_range_is_the_last_30_days(client, make_child):
+    child_id = await make_child()
+    data = await daily_stats(client, child_id, to=str(TODAY))
+    assert len(data) == 30
+    assert data[-1]["day"] == str(TODAY)
+
+
+async def test_invalid_range_and_missing_child(client, make_child):
+    child_id = await make_child()
+    response = await client.get(
+        f"/api/children/{child_id}/stats/daily", params={"from": str(TODAY), "to": str(TODAY - timedelta(days=1))}
+    )
+    assert response.status_code == 400
+    response = await client.get(
+        f"/api/children/{child_id}/stats/daily", params={"from": str(TODAY - timedelta(days=366)), "to": str(TODAY)}
+    )
+    assert response.status_code == 400
+
+    response = await client.get("/api/children/999/stats/daily")
+    assert response.status_code == 404
+
+
+async def test_backfill_rebuilds_the_incremental_rollups(client, make_child):
+    first, second = await make_child(), await make_child(name="小红", gender="female")
+    await client.post(f"/api/children/{first}/stars/add", json={"amount": 7})
+    await client.post(f"/api/children/{second}/stars/add", json={"amount": 2})
+    past = datetime.now() - timedelta(days=3)
+    async with AsyncSessionLocal() as db:
+        await insert_star_records(db, [
+            {"child_id": first, "type": "add", "amount": 1, "reason": None, "reward_id": None, "created_at": past},
+            {"child_id": first, "type": "subtract", "amount": -4, "reason": None, "reward_id": None, "created_at": past},
+            {"child_id": first, "type": "add", "amount": 2, "reason": None, "reward_id": None, "created_at": past},
+        ])
+        await db.commit()
+    incremental = await rollups()
+    assert (first, past.date(), "add", 2, 3) in incremental
+
+    async with async_engine.begin() as conn:
+        await conn.execute(delete(StarDailyRollup))
+    backfill_rollups(chunk_size=1)
+    assert await rollups() == incremental
+
+
+async def test_deleting_a_child_deletes_its_rollups(client, make_child):
+    child_id = await make_child()
+    await client.post(f"/api/children/{child_id}/stars/add", json={"amount": 7})
+
+    response = await client.delete(f"/api/children/{child_id}")
+    assert response.json()["success"] is True
+    assert await rollups() == []
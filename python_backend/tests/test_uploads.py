@@ -0,0 +1,224 @@
+"""Tests for streamed, content-addressed avatar and reward image uploads"""
+import asyncio
+import hashlib
+import os
+
+import pytest
+from sqlalchemy import select
+
+from app.core import storage
+from app.core.database import AsyncSessionLocal
+from app.models import UploadBlob
+from app.services import uploads
+
+PNG = b"\x89PNG\r\n\x1a\n" + b"\x00" * 100
+
+
+@pytest.fixture(autouse=True)
+def storage_root(tmp_path, monkeypatch):
+    monkeypatch.setattr(storage, "STORAGE_ROOT", tmp_path)
+    return tmp_path
+
+
+def test_detect_image_type():
+    assert uploads.detect_image_type(PNG) == ".png"
+    assert uploads.detect_image_type(b"\xff\xd8\xff\xe0rest") == ".jpg"
+    assert uploads.detect_image_type(b"RIFF\x00\x00\x00\x00WEBPVP8 ") == ".webp"
+    assert uploads.detect_image_type(b"<?php echo 1;") is None
+
+
+async def test_avatar_is_streamed_to_storage(client, storage_root, monkeypatch):
+    monkeypatch.setattr(uploads, "CHUNK_SIZE", 16)
+    response = await client.post(
+        "/api/children/",
+        data={"name": "小明", "birthday": "2018-05-15", "gender": "boy"},
+        files={"avatar": ("me.png", PNG, "image/png")}
+    )
+    assert response.status_code == 201
+    avatar = response.json()["data"]["avatar"]
+    assert avatar == f"/storage/blobs/{hashlib.sha256(PNG).hexdigest()[:2]}/{hashlib.sha256(PNG).hexdigest()}.png"
+
+    stored = storage_root / avatar.removeprefix("/storage/")
+    assert stored.read_bytes() == PNG
+    assert [p.name for p in stored.parent.iterdir()] == [stored.name]
+
+
+class StreamedUpload:
+    """An upload whose size is unknown until it has been read, like a chunked request body"""
+    size = None
+
+    def __init__(self, content):
+        self.content = content
+
+    async def read(self, size):
+        chunk, self.content = self.content[:size], self.content[size:]
+        return chunk
+
+
+async def test_upload_hash_and_size(storage_root):
+    stored = await uploads.save_upload(StreamedUpload(PNG), max_size=1024)
+    assert stored.size == len(PNG)
+    assert stored.sha256 == hashlib.sha256(PNG).hexdigest()
+    # Moved into place only once its reference is recorded
+    assert not (storage_root / stored.path).exists()
+    async with AsyncSessionLocal() as db:
+        await uploads.retain_upload(db, stored)
+        await db.commit()
+    assert (storage_root / stored.path).read_bytes() == PNG
+    assert not os.path.exists(stored.temp_path)
+
+
+async def test_size_limit_is_enforced_while_streaming(storage_root, monkeypatch):
+    monkeypatch.setattr(uploads, "CHUNK_SIZE", 16)
+    with pytest.raises(uploads.UploadError) as exc_info:
+        await uploads.save_upload(StreamedUpload(PNG), max_size=64)
+    assert exc_info.value.status_code == 413
+    assert list((storage_root / "blobs").iterdir()) == []
+
+
+async def test_oversized_upload_is_rejected_without_leftovers(client, storage_root, monkeypatch):
+    monkeypatch.setattr(uploads, "CHUNK_SIZE", 16)
+    monkeypatch.setattr(uploads.settings, "max_upload_size", 64)
+    response = await client.post(
+        "/api/children/",
+        data={"name": "小明", "birthday": "2018-05-15", "gender": "boy"},
+        files={"avatar": ("me.png", PNG, "image/png")}
+    )
+    assert response.status_code == 413
+    assert response.json()["success"] is False
+    assert not any(storage_root.rglob("*.png"))
+    assert (await client.get("/api/children/")).json()["data"] == []
+
+
+async def test_reward_image_content_is_checked(client, make_child, storage_root):
+    child_id = await make_child()
+    response = await client.post(
+        "/api/rewards/",
+        data={"name": "绘本", "star_cost": 10, "child_ids[]": [child_id]},
+        files={"image": ("book.png", b"MZ\x90\x00 not an image", "image/png")}
+    )
+    assert response.status_code == 400
+    assert "Unsupported" in response.json()["message"]
+    assert list((storage_root / "blobs").iterdir()) == []
+
+
+async def blob_ref_counts():
+    async with AsyncSessionLocal() as db:
+        return dict((await db.execute(select(UploadBlob.path, UploadBlob.ref_count))).all())
+
+
+async def create_child_with_avatar(client, content=PNG):
+    response = await client.post(
+        "/api/children/",
+        data={"name": "小明", "birthday": "2018-05-15", "gender": "boy"},
+        files={"avatar": ("me.png", content, "image/png")}
+    )
+    assert response.status_code == 201
+    return response.json()["data"]
+
+
+async def test_identical_uploads_share_one_blob(client, make_child, storage_root):
+    first = await create_child_with_avatar(client)
+    second = await create_child_with_avatar(client)
+    child_id = await make_child()
+    response = await client.post(
+        "/api/rewards/",
+        data={"name": "绘本", "star_cost": 10, "child_ids[]": [child_id]},
+        files={"image": ("book.png", PNG, "image/png")}
+    )
+
+    path = first["avatar"].removeprefix("/storage/")
+    assert second["avatar"] == first["avatar"] == response.json()["data"]["image"]
+    assert len(list(storage_root.rglob("*.png"))) == 1
+    assert await blob_ref_counts() == {path: 3}
+
+
+async def test_blob_is_unlinked_with_its_last_reference(client, storage_root):
+    first = await create_child_with_avatar(client)
+    second = await create_child_with_avatar(client)
+    path = first["avatar"].removeprefix("/storage/")
+
+    await client.delete(f"/api/children/{first['id']}")
+    assert (storage_root / path).exists()
+    assert await blob_ref_counts() == {path: 1}
+
+    await client.delete(f"/api/children/{second['id']}")
+    assert not (storage_root / path).exists()
+    assert await blob_ref_counts() == {}
+
+
+async def test_replacing_a_reward_image_releases_the_old_blob(client, make_child, storage_root):
+    child_id = await make_child()
+    response = await client.post(
+        "/api/rewards/",
+        data={"name": "绘本", "star_cost": 10, "child_ids[]": [child_id]},
+        files={"image": ("book.png", PNG, "image/png")}
+    )
+    reward = response.json()["data"]
+    old_path = reward["image"].removeprefix("/storage/")
+
+    gif = b"GIF89a" + b"\x01" * 20
+    response = await client.patch(f"/api/rewards/{reward['id']}", files={"image": ("book.gif", gif, "image/gif")})
+    new_path = response.json()["data"]["image"].removeprefix("/storage/")
+
+    assert new_path.endswith(".gif")
+    assert not (storage_root / old_path).exists()
+    assert (storage_root / new_path).read_bytes() == gif
+    assert await blob_ref_counts() == {new_path: 1}
+
+
+async def test_rejected_reward_leaves_no_blob(client, make_child, storage_root):
+    child_id = await make_child()
+    response = await client.post(
+        "/api/rewards/",
+        data={"name": "绘本", "star_cost": 10, "child_ids[]": [child_id, 999]},
+        files={"image": ("book.png", PNG, "image/png")}
+    )
+    assert response.status_code == 422
+    assert not any(storage_root.rglob("*.png"))
+
+    response = await client.post(
+        "/api/rewards/",
+        data={"name": "绘本", "star_cost": 10, "child_ids[]": [child_id]},
+    )
+    reward_id = response.json()["data"]["id"]
+    response = await client.patch(
+        f"/api/rewards/{reward_id}",
+        data={"child_ids[]": [999]},
+        files={"image": ("book.png", PNG, "image/png")}
+    )
+    assert response.status_code == 422
+    assert not any(storage_root.rglob("*.png"))
+    assert not any(storage_root.rglob("*.part"))
+
+
+async def test_rolled_back_upload_is_discarded(storage_root):
+    stored = await uploads.save_upload(StreamedUpload(PNG))
+    async with AsyncSessionLocal() as db:
+        await uploads.retain_upload(db, stored)
+        assert (storage_root / stored.path).exists()
+        await db.rollback()
+    await uploads.discard_upload(stored)
+    assert not (storage_root / stored.path).exists()
+    assert await blob_ref_counts() == {}
+
+
+async def test_release_waits_for_a_concurrent_identical_upload(client, storage_root):
+    child = await create_child_with_avatar(client)
+    path = child["avatar"].removeprefix("/storage/")
+    # The last reference was released and committed; the file is not unlinked yet
+    async with AsyncSessionLocal() as db:
+        assert await uploads.release_path(db, path) == path
+        await db.commit()
+
+    # Meanwhile an identical upload is retained but not committed
+    async with AsyncSessionLocal() as db:
+        stored = await uploads.save_upload(StreamedUpload(PNG))
+        await uploads.retain_upload(db, stored)
+        release = asyncio.create_task(uploads.delete_released_files([path]))
+        await asyncio.sleep(0.2)
+        assert not release.done()
+        await db.commit()
+    await release
+    assert (storage_root / path).read_bytes() == PNG
+    assert await blob_ref_counts() == {path: 1}